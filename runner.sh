@@ -1,5 +1,5 @@
 #!/bin/bash
 export PATH="/home/runner/.local/bin":$PATH
 echo "Connecting to the Github runner"
-./config.sh --unattended --url $URL --token $TOKEN --ephemeral
+./config.sh --unattended --url $URL --token $TOKEN --ephemeral ${LABELS:+--labels "$LABELS"}
 ./run.sh
@@ -5,22 +5,34 @@ This module contains the app factory for the autoscaler app, and
 acts as the main entry point for the app.
 """
 
+import asyncio
 import sys
 
+from typing import (
+    Awaitable,
+    Callable,
+)
+
 from fastapi import (
     FastAPI,
     Depends,
+    Request,
+    Response,
 )
 from loguru import logger
 
+from autoscaler import metrics
 from autoscaler.config import Settings
 from autoscaler.dependencies import (
     access_log,
     get_settings,
 )
+from autoscaler.middleware import WebhookSignatureMiddleware
 from autoscaler.services import (
+    docker,
     get_services,
 )
+from autoscaler.tasks import start_background_tasks
 
 from autoscaler.routes import router
 
@@ -49,6 +61,20 @@ def create_app(
     )
 
     app.include_router(router)
+    app.add_middleware(WebhookSignatureMiddleware, settings=active_settings)
+
+    @app.middleware("http")
+    async def _(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]],
+    ) -> Response:
+        if not request.url.path.startswith("/webhook"):
+            return await call_next(request)
+
+        with metrics.webhook_duration.time(path=request.url.path):
+            return await call_next(request)
+
+    background: list[asyncio.Task[None]] = []
 
     @app.on_event(
         "startup"
@@ -73,14 +99,24 @@ def create_app(
             logger.info(f"Starting {service.__class__.__name__}")
             service.initialize(active_settings)
 
+        for service in get_services():
+            await service.start()
+
         logger.info("Services loaded")
 
+        background.extend(
+            start_background_tasks(active_settings, runner_provider=docker)
+        )
+
     @app.on_event(
         "shutdown"
     )  # pyright: reportUnknownMemberType=false,reportUntypedFunctionDecorator=false
     async def _() -> None:
         logger.info("Shutting down app")
-        for service in get_services():
+        for task in background:
+            task.cancel()
+
+        for service in reversed(get_services()):
             logger.info(f"Closing {service.__class__.__name__}")
             await service.close()
 
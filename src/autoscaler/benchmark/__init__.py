@@ -0,0 +1,30 @@
+"""
+An offline benchmark of the webhook to runner pipeline.
+
+The benchmark replays recorded or generated workflow job webhooks
+through the app, with fake runners and a fake Github API, and reports
+the webhook throughput, the time for jobs to get a runner, and the CPU
+and memory used. Run it with ``python -m autoscaler.benchmark``.
+"""
+
+from autoscaler.benchmark.fakes import (
+    FakeGithubAPI,
+    FakeRunnerProvider,
+)
+from autoscaler.benchmark.harness import (
+    BenchmarkReport,
+    RecordedWebhook,
+    generate_webhooks,
+    load_webhooks,
+    run_benchmark,
+)
+
+__all__ = [
+    "BenchmarkReport",
+    "FakeGithubAPI",
+    "FakeRunnerProvider",
+    "RecordedWebhook",
+    "generate_webhooks",
+    "load_webhooks",
+    "run_benchmark",
+]
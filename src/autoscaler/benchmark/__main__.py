@@ -0,0 +1,104 @@
+"""Run the benchmark of the webhook to runner pipeline from the command line."""
+
+import asyncio
+import sys
+
+from typing import (
+    cast,
+    get_args,
+)
+
+import typer
+
+from loguru import logger
+
+from autoscaler.benchmark.harness import (
+    Backend,
+    generate_webhooks,
+    load_webhooks,
+    run_benchmark,
+)
+from autoscaler.config import Settings
+
+cli = typer.Typer()
+
+
+@cli.command()
+def benchmark(
+    events: str = typer.Option(
+        None, help="A file of recorded webhooks to replay, one JSON per line."
+    ),
+    jobs: int = typer.Option(1000, help="The number of jobs to generate."),
+    owners: int = typer.Option(4, help="The number of owners to generate jobs for."),
+    burst: int = typer.Option(100, help="The number of jobs queued at once."),
+    interval: float = typer.Option(1.0, help="The time between bursts."),
+    speed: float = typer.Option(
+        1.0, help="The replay speed, or 0 to send every webhook at once."
+    ),
+    concurrency: int = typer.Option(100, help="The webhooks sent at once."),
+    max_runners: int = typer.Option(50, help="The maximum number of runners."),
+    start_latency: float = typer.Option(0.5, help="The time to start a runner."),
+    job_duration: float = typer.Option(1.0, help="The time a job runs for."),
+    github_latency: float = typer.Option(0.05, help="The Github API latency."),
+    github_rate_limit: int = typer.Option(
+        None, help="The Github API requests allowed per second."
+    ),
+    timeout: float = typer.Option(600.0, help="The time to wait for the jobs."),
+    backend: str = typer.Option(
+        "memory", help="Where to keep the queue and leases: memory, sqlite or redis."
+    ),
+    json: bool = typer.Option(False, "--json", help="Print the report as JSON."),
+    max_p95: float = typer.Option(
+        None, help="Fail if the p95 time for a job to get a runner is over this."
+    ),
+    min_throughput: float = typer.Option(
+        None, help="Fail if fewer webhooks per second are handled."
+    ),
+) -> None:
+    """Replay workflow job webhooks through the autoscaler, offline."""
+    if backend not in get_args(Backend):
+        raise typer.BadParameter(f"Unknown backend {backend}", param_hint="backend")
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    webhooks = (
+        generate_webhooks(jobs, owners, burst, interval)
+        if events is None
+        else load_webhooks(events)
+    )
+    settings = Settings()
+    settings.runner.max_runners = max_runners
+
+    report = asyncio.run(
+        run_benchmark(
+            webhooks,
+            settings=settings,
+            speed=speed,
+            concurrency=concurrency,
+            start_latency=start_latency,
+            job_duration=job_duration,
+            github_latency=github_latency,
+            github_rate_limit=github_rate_limit,
+            timeout=timeout,
+            backend=cast(Backend, backend),
+        )
+    )
+
+    if json:
+        typer.echo(report.model_dump_json(indent=2))
+    else:
+        for name, value in report.model_dump().items():
+            formatted = f"{value:.3f}" if isinstance(value, float) else value
+            typer.echo(f"{name:24s} {formatted}")
+
+    failed = report.jobs_started < report.jobs
+    failed |= max_p95 is not None and report.queued_to_started_p95 > max_p95
+    failed |= min_throughput is not None and report.webhooks_per_second < min_throughput
+
+    if failed:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,569 @@
+"""Local stand-ins for the docker hosts and the Github API."""
+
+import asyncio
+import json
+import queue
+import time
+
+from collections import (
+    Counter,
+    defaultdict,
+)
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+)
+
+import httpx
+
+from autoscaler.config import (
+    RunnerClass,
+    RunnerSettings,
+)
+from autoscaler.models import RunnerRecord
+from autoscaler.services.classes import DEFAULT_CLASS
+from autoscaler.services.docker import (
+    CLASS_LABEL,
+    OWNER_LABEL,
+    REPO_LABEL,
+    WARM_LABEL,
+    runner_record,
+)
+
+# Called with the id, owner, repo and runner class of a started runner
+StartListener = Callable[[str, str, str | None, str], None]
+
+
+class FakeEventStream(Iterator[dict[str, Any]]):
+    """A blocking stream of runner events, like the docker events stream."""
+
+    def __init__(self) -> None:
+        """Create a new, empty event stream."""
+        self._events: queue.SimpleQueue[dict[str, Any] | None] = queue.SimpleQueue()
+
+    def __iter__(self) -> "FakeEventStream":
+        """Iterate over the events until the stream is closed."""
+        return self
+
+    def __next__(self) -> dict[str, Any]:
+        """Wait for the next event."""
+        event = self._events.get()
+
+        if event is None:
+            raise StopIteration
+
+        return event
+
+    def put(self, event: dict[str, Any]) -> None:
+        """
+        Add an event to the stream.
+
+        Args:
+            event: The event.
+        """
+        self._events.put(event)
+
+    def close(self) -> None:
+        """Close the stream."""
+        self._events.put(None)
+
+
+class FakeRunnerProvider:
+    """
+    A runner provider that starts runners without starting containers.
+
+    Runners take a configurable time to start, and report their start and
+    exit in the same events as docker, so the capacity manager tracks them
+    as it would track containers.
+
+    Attributes:
+        settings: The settings of the runners.
+        start_latency: The time, in seconds, that it takes to start a runner.
+        cpus: The number of CPUs that the runners may reserve.
+        memory: The bytes of memory that the runners may reserve.
+        started: The number of runners that were started.
+    """
+
+    def __init__(
+        self,
+        settings: RunnerSettings,
+        start_latency: float,
+        cpus: float = 1024.0,
+        memory: int = 1 << 40,
+    ) -> None:
+        """
+        Create a new fake runner provider.
+
+        Args:
+            settings: The settings of the runners.
+            start_latency: The time, in seconds, that it takes to start a
+                runner.
+            cpus: The number of CPUs that the runners may reserve.
+            memory: The bytes of memory that the runners may reserve.
+        """
+        self.settings = settings
+        self.start_latency = start_latency
+        self.cpus = cpus
+        self.memory = memory
+        self.started = 0
+        self._live: dict[str, dict[str, str]] = {}
+        self._streams: list[FakeEventStream] = []
+        self._listeners: list[StartListener] = []
+
+    def add_start_listener(self, listener: StartListener) -> None:
+        """
+        Register a callback for when a runner has started.
+
+        Args:
+            listener: The callback, called with the id, owner, repo and
+                runner class of the runner.
+        """
+        self._listeners.append(listener)
+
+    async def start_runner(
+        self,
+        *,
+        url: str,
+        token: str,
+        owner: str,
+        repo: str | None = None,
+        runner_class: RunnerClass | None = None,
+        warm: bool = False,
+    ) -> str:
+        """
+        Start a fake runner.
+
+        Args:
+            url: The URL of the runner.
+            token: The registration token for the runner.
+            owner: The owner that the runner is registered to.
+            repo: The repo that the runner is registered to, or None if
+                the runner is registered to an org.
+            runner_class: The class of the runner, or None for the
+                default class.
+            warm: Whether the runner is started for a warm pool.
+
+        Returns:
+            The id of the runner.
+        """
+        await asyncio.sleep(self.start_latency)
+
+        self.started += 1
+        runner_id = f"runner-{self.started}"
+        name = DEFAULT_CLASS if runner_class is None else runner_class.name
+        self._live[runner_id] = {CLASS_LABEL: name, OWNER_LABEL: owner}
+
+        if repo is not None:
+            self._live[runner_id][REPO_LABEL] = repo
+
+        if warm:
+            self._live[runner_id][WARM_LABEL] = "true"
+
+        self._emit("start", runner_id)
+
+        for listener in self._listeners:
+            listener(runner_id, owner, repo, name)
+
+        return runner_id
+
+    def stop_runner(self, runner_id: str) -> None:
+        """
+        Stop a fake runner, as an ephemeral runner does after its job.
+
+        Args:
+            runner_id: The id of the runner.
+        """
+        self._emit("die", runner_id)
+        self._live.pop(runner_id, None)
+
+    async def remove_runner(self, runner_id: str) -> None:
+        """
+        Stop a fake runner before its job is done.
+
+        Args:
+            runner_id: The id of the runner.
+        """
+        self.stop_runner(runner_id)
+
+    async def count_runners(self) -> int:
+        """Count the live runners."""
+        return len(self._live)
+
+    async def runner_events(self) -> FakeEventStream:
+        """Subscribe to the start/die events of the runners."""
+        stream = FakeEventStream()
+        self._streams.append(stream)
+
+        return stream
+
+    async def list_runner_records(self) -> dict[str, RunnerRecord]:
+        """List the ids of the live runners with their records."""
+        return {
+            runner_id: runner_record(runner_id, labels)
+            for runner_id, labels in self._live.items()
+        }
+
+    async def allocatable_resources(self) -> tuple[float, int]:
+        """Get the CPUs and bytes of memory that runners may reserve."""
+        return self.cpus, self.memory
+
+    def can_place(self, runner_class: RunnerClass, reserved: Counter[str]) -> bool:
+        """
+        Check whether there is room for one more runner.
+
+        The runners all share one host, so the totals that the capacity
+        manager checks are all there is to check.
+        """
+        return True
+
+    def close(self) -> None:
+        """Close the event streams."""
+        for stream in self._streams:
+            stream.close()
+
+    def _emit(self, action: str, runner_id: str) -> None:
+        """Send a runner event to every subscriber."""
+        event = {
+            "Action": action,
+            "Actor": {"ID": runner_id, "Attributes": self._live.get(runner_id, {})},
+        }
+
+        for stream in self._streams:
+            stream.put(event)
+
+
+class FakeGithubAPI:
+    """
+    A stand-in for the Github API, to plug into the Github client.
+
+    Registration tokens are handed out after a configurable latency. The
+    API allows a number of requests per second, and answers the requests
+    over that budget with a secondary rate limit, as Github does.
+
+    Attributes:
+        latency: The time, in seconds, that the API takes to answer.
+        rate_limit: The number of requests allowed per second, or None
+            for no limit.
+        requests: The number of requests made, by path.
+        throttled: The number of requests that were rate limited.
+    """
+
+    def __init__(self, latency: float, rate_limit: int | None = None) -> None:
+        """
+        Create a new fake Github API.
+
+        Args:
+            latency: The time, in seconds, that the API takes to answer.
+            rate_limit: The number of requests allowed per second, or
+                None for no limit.
+        """
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.requests: Counter[str] = Counter()
+        self.throttled = 0
+        self._window = 0
+        self._window_requests = 0
+
+    @property
+    def transport(self) -> httpx.AsyncBaseTransport:
+        """Get a transport that sends the requests to the fake API."""
+        return httpx.MockTransport(self._handle)
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        """
+        Answer a request to the API.
+
+        Args:
+            request: The request.
+
+        Returns:
+            The response.
+        """
+        await asyncio.sleep(self.latency)
+
+        window = int(time.monotonic())
+
+        if window != self._window:
+            self._window, self._window_requests = window, 0
+
+        self._window_requests += 1
+
+        if self.rate_limit is not None and self._window_requests > self.rate_limit:
+            self.throttled += 1
+            return httpx.Response(429, headers={"Retry-After": "1"})
+
+        self.requests[request.url.path] += 1
+
+        if not request.url.path.endswith("/registration-token"):
+            return httpx.Response(404)
+
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+
+        return httpx.Response(
+            201,
+            content=json.dumps(
+                {
+                    "token": f"token-{sum(self.requests.values())}",
+                    "expires_at": expires_at.isoformat(),
+                }
+            ),
+        )
+
+
+def parse_score(value: str) -> float:
+    """
+    Parse a score of a sorted set command, such as ``-inf`` or ``12.5``.
+
+    Args:
+        value: The score.
+
+    Returns:
+        The score as a float.
+    """
+    return float(value.replace("+", "")) if "inf" in value else float(value)
+
+
+class FakeRespServer:
+    """
+    A stand-in for a Redis server, for the Redis queue and lease backends.
+
+    The server listens on a local port and speaks the Redis protocol, but
+    only implements the commands that the autoscaler sends, on data kept
+    in memory. The Redis backends can be run against it without a server.
+
+    Attributes:
+        commands: The number of commands received, by name.
+    """
+
+    def __init__(self) -> None:
+        """Create a new, empty server."""
+        self.commands: Counter[str] = Counter()
+        self._hashes: defaultdict[str, dict[str, str]] = defaultdict(dict)
+        self._lists: defaultdict[str, list[str]] = defaultdict(list)
+        self._zsets: defaultdict[str, dict[str, float]] = defaultdict(dict)
+        self._server: asyncio.Server | None = None
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task[Any]] = {}
+
+    @property
+    def url(self) -> str:
+        """Get the URL to connect to the server with."""
+        if self._server is None:
+            raise RuntimeError("The server is not started")
+
+        host, port = self._server.sockets[0].getsockname()[:2]
+
+        return f"redis://{host}:{port}/0"
+
+    async def start(self) -> None:
+        """Start listening on a free local port."""
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+
+    async def close(self) -> None:
+        """Stop listening, and close the open connections."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        for writer in self._connections:
+            writer.close()
+
+        await asyncio.gather(*self._connections.values(), return_exceptions=True)
+
+    async def _serve(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """Answer the commands of a connection until it is closed."""
+        task = asyncio.current_task()
+
+        if task is not None:
+            self._connections[writer] = task
+
+        # The commands of an open transaction, run together on EXEC
+        queued: list[list[str]] | None = None
+
+        try:
+            while True:
+                header = await reader.readuntil(b"\r\n")
+                args: list[str] = []
+
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readuntil(b"\r\n"))[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode())
+
+                name = args[0].upper()
+                reply: Any
+
+                if name == "MULTI":
+                    queued, reply = [], "OK"
+                elif name == "EXEC" and queued is not None:
+                    reply = [self._execute(command) for command in queued]
+                    queued = None
+                elif name == "DISCARD":
+                    queued, reply = None, "OK"
+                elif queued is not None:
+                    queued.append(args)
+                    reply = "QUEUED"
+                else:
+                    reply = self._execute(args)
+
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    def _execute(self, args: list[str]) -> Any:
+        """Run a command, returning its reply or the error it failed with."""
+        name = args[0].lower()
+        self.commands[name] += 1
+        command = getattr(self, f"_{name}", None)
+
+        if command is None:
+            return ValueError(f"ERR unknown command '{args[0]}'")
+
+        try:
+            return command(*args[1:])
+        except (TypeError, ValueError) as e:
+            return ValueError(f"ERR {e}")
+
+    def _encode(self, reply: Any) -> bytes:
+        """Encode a reply in the Redis protocol."""
+        if isinstance(reply, Exception):
+            return b"-%s\r\n" % str(reply).encode()
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(map(self._encode, reply))
+
+        data = str(reply).encode()
+
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def _auth(self, *args: str) -> str:
+        return "OK"
+
+    def _select(self, db: str) -> str:
+        return "OK"
+
+    def _ping(self) -> str:
+        return "PONG"
+
+    def _hset(self, key: str, field: str, value: str) -> int:
+        added = field not in self._hashes[key]
+        self._hashes[key][field] = value
+
+        return int(added)
+
+    def _hsetnx(self, key: str, field: str, value: str) -> int:
+        if field in self._hashes[key]:
+            return 0
+
+        return self._hset(key, field, value)
+
+    def _hget(self, key: str, field: str) -> str | None:
+        return self._hashes[key].get(field)
+
+    def _hdel(self, key: str, *fields: str) -> int:
+        return sum(self._hashes[key].pop(field, None) is not None for field in fields)
+
+    def _hlen(self, key: str) -> int:
+        return len(self._hashes[key])
+
+    def _rpush(self, key: str, *values: str) -> int:
+        self._lists[key].extend(values)
+
+        return len(self._lists[key])
+
+    def _lrange(self, key: str, start: str, stop: str) -> list[str]:
+        end = int(stop) + 1 or None
+
+        return self._lists[key][slice(int(start), end)]
+
+    def _lrem(self, key: str, count: str, value: str) -> int:
+        items = self._lists[key]
+        limit = int(count) or len(items)
+        kept: list[str] = []
+        removed = 0
+
+        for item in items:
+            if item == value and removed < limit:
+                removed += 1
+            else:
+                kept.append(item)
+
+        self._lists[key] = kept
+
+        return removed
+
+    def _zadd(self, key: str, *args: str) -> int:
+        flags = {"NX", "XX", "CH"}
+        options = set()
+
+        while args and args[0].upper() in flags:
+            options.add(args[0].upper())
+            args = args[1:]
+
+        zset = self._zsets[key]
+        counted = 0
+
+        for score, member in zip(args[::2], args[1::2]):
+            exists = member in zset
+
+            if ("NX" in options and exists) or ("XX" in options and not exists):
+                continue
+
+            if not exists or ("CH" in options and zset[member] != parse_score(score)):
+                counted += 1
+
+            zset[member] = parse_score(score)
+
+        return counted
+
+    def _zrem(self, key: str, *members: str) -> int:
+        return sum(self._zsets[key].pop(member, None) is not None for member in members)
+
+    def _zcard(self, key: str) -> int:
+        return len(self._zsets[key])
+
+    def _zscore(self, key: str, member: str) -> str | None:
+        score = self._zsets[key].get(member)
+
+        return None if score is None else repr(score)
+
+    def _zrangebyscore(self, key: str, low: str, high: str, *args: str) -> list[str]:
+        members = sorted(
+            (score, member)
+            for member, score in self._zsets[key].items()
+            if parse_score(low) <= score <= parse_score(high)
+        )
+        options = [arg.upper() for arg in args]
+
+        if "LIMIT" in options:
+            limit = options.index("LIMIT")
+            offset, count = int(args[limit + 1]), int(args[limit + 2])
+            members = members[slice(offset, offset + count if count >= 0 else None)]
+
+        if "WITHSCORES" in options:
+            return [part for score, member in members for part in (member, repr(score))]
+
+        return [member for _, member in members]
+
+    def _zremrangebyscore(self, key: str, low: str, high: str) -> int:
+        removed = self._zrangebyscore(key, low, high)
+
+        for member in removed:
+            del self._zsets[key][member]
+
+        return len(removed)
@@ -0,0 +1,565 @@
+"""A harness that replays workflow job webhooks through the autoscaler."""
+
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import math
+import os
+import resource
+import secrets
+import shutil
+import tempfile
+import time
+import uuid
+
+from collections import (
+    defaultdict,
+    deque,
+)
+from typing import (
+    Any,
+    Literal,
+)
+
+import httpx
+
+from pydantic import BaseModel
+
+from autoscaler import create_app
+from autoscaler.benchmark.fakes import (
+    FakeGithubAPI,
+    FakeRespServer,
+    FakeRunnerProvider,
+)
+from autoscaler.config import Settings
+from autoscaler.services import (
+    capacity,
+    docker,
+    get_services,
+    github,
+    runner_classes,
+)
+from autoscaler.tasks import (
+    drain_queue,
+    replenish_warm_pools,
+)
+
+SECRET = secrets.token_hex(16)
+
+# The owner, repo and runner class that a runner can take jobs for
+RunnerKey = tuple[str, str | None, str]
+
+# Where the queue and the leases are kept
+Backend = Literal["memory", "sqlite", "redis"]
+
+
+class RecordedWebhook(BaseModel):
+    """
+    A workflow job webhook to replay.
+
+    Attributes:
+        at: The time, in seconds from the start of the replay, at which
+            the webhook is delivered.
+        payload: The payload of the webhook.
+    """
+
+    at: float = 0.0
+    payload: dict[str, Any]
+
+
+class BenchmarkReport(BaseModel):
+    """
+    The results of a benchmark run.
+
+    Latencies are in milliseconds for the webhooks, and in seconds from
+    the queued webhook to the start of a runner for the jobs.
+
+    Attributes:
+        webhooks: The number of webhooks delivered.
+        webhooks_per_second: The rate at which the webhooks were handled.
+        webhook_latency_p50: The median time to handle a webhook.
+        webhook_latency_p95: The 95th percentile time to handle a webhook.
+        webhook_latency_p99: The 99th percentile time to handle a webhook.
+        jobs: The number of queued jobs.
+        jobs_started: The number of jobs that a runner was started for.
+        queued_to_started_p50: The median time for a job to get a runner.
+        queued_to_started_p95: The 95th percentile time for a job to get
+            a runner.
+        queued_to_started_p99: The 99th percentile time for a job to get
+            a runner.
+        runners_started: The number of runners that were started.
+        github_requests: The number of requests answered by the Github API.
+        github_throttled: The number of requests that were rate limited.
+        wall_seconds: The time that the run took.
+        cpu_seconds: The CPU time that the run used.
+        peak_rss_mb: The peak resident memory of the process.
+    """
+
+    webhooks: int
+    webhooks_per_second: float
+    webhook_latency_p50: float
+    webhook_latency_p95: float
+    webhook_latency_p99: float
+    jobs: int
+    jobs_started: int
+    queued_to_started_p50: float
+    queued_to_started_p95: float
+    queued_to_started_p99: float
+    runners_started: int
+    github_requests: int
+    github_throttled: int
+    wall_seconds: float
+    cpu_seconds: float
+    peak_rss_mb: float
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Get a percentile of some values, by the nearest rank.
+
+    Args:
+        values: The values.
+        q: The percentile, between 0 and 100.
+
+    Returns:
+        The percentile, or 0 if there are no values.
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def load_webhooks(path: str) -> list[RecordedWebhook]:
+    """
+    Load recorded webhooks from a file with one JSON object per line.
+
+    Each line is either a recorded webhook, with the time at which it was
+    delivered and its payload, or the bare payload of a webhook to deliver
+    at the start. Only the ``queued`` webhooks are replayed, as the rest of
+    the lifecycle of a job is simulated.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        The webhooks, in the order in which they are delivered.
+    """
+    webhooks = []
+
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            data = json.loads(line)
+            webhook = RecordedWebhook.model_validate(
+                data if "payload" in data else {"payload": data}
+            )
+
+            if webhook.payload.get("action") == "queued":
+                webhooks.append(webhook)
+
+    return sorted(webhooks, key=lambda webhook: webhook.at)
+
+
+def workflow_job_payload(
+    action: str,
+    job_id: int,
+    owner: str,
+    repo: str,
+    labels: list[str],
+) -> dict[str, Any]:
+    """
+    Create the payload of a workflow job webhook.
+
+    Args:
+        action: The action of the webhook.
+        job_id: The id of the workflow job.
+        owner: The owner of the repo.
+        repo: The name of the repo.
+        labels: The labels of the job.
+
+    Returns:
+        The payload.
+    """
+    return {
+        "action": action,
+        "workflow_job": {
+            "id": job_id,
+            "run_id": job_id,
+            "status": action,
+            "labels": labels,
+        },
+        "repository": {
+            "id": 1,
+            "name": repo,
+            "full_name": f"{owner}/{repo}",
+            "private": True,
+            "owner": {"id": 1, "login": owner},
+        },
+    }
+
+
+def generate_webhooks(
+    jobs: int,
+    owners: int = 1,
+    burst: int = 1,
+    interval: float = 0.0,
+    labels: list[str] | None = None,
+) -> list[RecordedWebhook]:
+    """
+    Generate bursts of queued jobs, like the jobs of workflow matrices.
+
+    The bursts take turns between the owners, one repo per owner.
+
+    Args:
+        jobs: The number of jobs.
+        owners: The number of owners.
+        burst: The number of jobs queued at once.
+        interval: The time, in seconds, between bursts.
+        labels: The labels of the jobs.
+
+    Returns:
+        The webhooks.
+    """
+    return [
+        RecordedWebhook(
+            at=(job_id // burst) * interval,
+            payload=workflow_job_payload(
+                "queued",
+                job_id,
+                owner=f"owner-{job_id // burst % owners}",
+                repo="repo",
+                labels=labels or ["self-hosted"],
+            ),
+        )
+        for job_id in range(jobs)
+    ]
+
+
+class Simulation:
+    """
+    Replay webhooks through the app, and simulate the jobs on the runners.
+
+    Github hands every queued job to an idle runner that can take it, and
+    sends the ``in_progress`` and ``completed`` webhooks of the job. The
+    simulation does the same: runners take the oldest job they can run,
+    run it for a while, and then exit, as ephemeral runners do.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        provider: FakeRunnerProvider,
+        job_duration: float,
+        concurrency: int,
+    ) -> None:
+        """
+        Create a new simulation.
+
+        Args:
+            client: The client to send webhooks to the app with.
+            provider: The runner provider that the app uses.
+            job_duration: The time, in seconds, that a job runs for.
+            concurrency: The maximum number of webhooks sent at once.
+        """
+        self.client = client
+        self.provider = provider
+        self.job_duration = job_duration
+        self.webhook_latencies: list[float] = []
+        self.start_latencies: list[float] = []
+        self.jobs = 0
+        self._senders = asyncio.Semaphore(concurrency)
+        self._pending: defaultdict[
+            RunnerKey, deque[tuple[dict[str, Any], float]]
+        ] = defaultdict(deque)
+        self._idle: defaultdict[RunnerKey, deque[str]] = defaultdict(deque)
+        self._running: set[asyncio.Task[None]] = set()
+        self._runner_numbers = itertools.count(1)
+        self._finished = 0
+        self._done = asyncio.Event()
+
+        provider.add_start_listener(self._on_started)
+
+    async def replay(self, webhooks: list[RecordedWebhook], speed: float) -> None:
+        """
+        Deliver the webhooks, at their recorded times.
+
+        Args:
+            webhooks: The webhooks.
+            speed: How much faster than recorded to deliver the webhooks,
+                or 0 to deliver them all at once.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deliveries = []
+
+        for webhook in webhooks:
+            runner_class = runner_classes.match(
+                webhook.payload["workflow_job"].get("labels", [])
+            )
+
+            if runner_class is None:
+                continue
+
+            if speed > 0:
+                await asyncio.sleep(max(started + webhook.at / speed - loop.time(), 0))
+
+            self.jobs += 1
+            deliveries.append(
+                asyncio.create_task(self._queue(webhook.payload, runner_class.name))
+            )
+
+        await asyncio.gather(*deliveries)
+
+        if self.jobs == 0:
+            self._done.set()
+
+    async def wait(self, timeout: float) -> None:
+        """
+        Wait until every job has run, or for a while.
+
+        Args:
+            timeout: The maximum time, in seconds, to wait.
+        """
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self) -> None:
+        """Stop the jobs that are still running."""
+        for task in self._running:
+            task.cancel()
+
+    async def _queue(self, payload: dict[str, Any], runner_class: str) -> None:
+        """Deliver a queued webhook, and hand the job to an idle runner."""
+        key = self._key(payload, runner_class)
+        queued_at = time.monotonic()
+        await self._send(payload)
+
+        if self._idle[key]:
+            self._run(self._idle[key].popleft(), payload, queued_at)
+        else:
+            self._pending[key].append((payload, queued_at))
+
+    def _on_started(
+        self,
+        runner_id: str,
+        owner: str,
+        repo: str | None,
+        runner_class: str,
+    ) -> None:
+        """Hand the oldest job that a new runner can take to it."""
+        key = (owner, repo, runner_class)
+
+        if self._pending[key]:
+            payload, queued_at = self._pending[key].popleft()
+            self._run(runner_id, payload, queued_at)
+        else:
+            self._idle[key].append(runner_id)
+
+    def _run(self, runner_id: str, payload: dict[str, Any], queued_at: float) -> None:
+        """Run a job on a runner in the background."""
+        self.start_latencies.append(time.monotonic() - queued_at)
+        task = asyncio.create_task(self._job(runner_id, payload))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _job(self, runner_id: str, payload: dict[str, Any]) -> None:
+        """Run a job, sending its lifecycle webhooks, then stop the runner."""
+        job = {
+            **payload["workflow_job"],
+            "runner_id": next(self._runner_numbers),
+            "runner_name": runner_id,
+        }
+        await self._send(
+            {
+                **payload,
+                "action": "in_progress",
+                "workflow_job": {**job, "status": "in_progress"},
+            }
+        )
+        await asyncio.sleep(self.job_duration)
+        await self._send(
+            {
+                **payload,
+                "action": "completed",
+                "workflow_job": {**job, "status": "completed", "conclusion": "success"},
+            }
+        )
+        self.provider.stop_runner(runner_id)
+        self._finished += 1
+
+        if self._finished >= self.jobs:
+            self._done.set()
+
+    async def _send(self, payload: dict[str, Any]) -> None:
+        """Deliver a signed webhook to the app."""
+        body = json.dumps(payload).encode()
+        signature = hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+        path = (
+            "/webhook/org/docker"
+            if "organization" in payload
+            else ("/webhook/repo/docker")
+        )
+
+        async with self._senders:
+            started = time.perf_counter()
+            res = await self.client.post(
+                path,
+                content=body,
+                headers={
+                    "Content-Type": "application/json",
+                    "X-GitHub-Event": "workflow_job",
+                    "X-GitHub-Delivery": str(uuid.uuid4()),
+                    "X-Hub-Signature-256": f"sha256={signature}",
+                },
+            )
+            self.webhook_latencies.append(time.perf_counter() - started)
+
+        res.raise_for_status()
+
+    @staticmethod
+    def _key(payload: dict[str, Any], runner_class: str) -> RunnerKey:
+        """Get the owner, repo and runner class of the runners for a job."""
+        organization = payload.get("organization")
+
+        if organization is not None:
+            return (organization["login"], None, runner_class)
+
+        repository = payload["repository"]
+
+        return (repository["owner"]["login"], repository["name"], runner_class)
+
+
+async def run_benchmark(
+    webhooks: list[RecordedWebhook],
+    *,
+    settings: Settings | None = None,
+    speed: float = 0.0,
+    concurrency: int = 100,
+    start_latency: float = 0.5,
+    job_duration: float = 1.0,
+    github_latency: float = 0.05,
+    github_rate_limit: int | None = None,
+    timeout: float = 600.0,
+    backend: Backend = "memory",
+) -> BenchmarkReport:
+    """
+    Replay webhooks through the autoscaler with fake runners and Github API.
+
+    Everything runs in this process, without docker or network access: the
+    webhooks go through the app, the provisioning queue and the capacity
+    manager as they would in production, but the runners are started by a
+    fake provider and the registration tokens come from a fake Github API.
+
+    Args:
+        webhooks: The queued webhooks to replay.
+        settings: The settings of the autoscaler, or None for the defaults.
+            The queue and the leases are kept in the given backend.
+        speed: How much faster than recorded to deliver the webhooks, or 0
+            to deliver them all at once.
+        concurrency: The maximum number of webhooks sent at once.
+        start_latency: The time, in seconds, that it takes to start a runner.
+        job_duration: The time, in seconds, that a job runs for.
+        github_latency: The time, in seconds, that the Github API takes to
+            answer.
+        github_rate_limit: The number of requests per second that the
+            Github API allows, or None for no limit.
+        timeout: The maximum time, in seconds, to wait for the jobs to run.
+        backend: Where to keep the queue and the leases. A ``sqlite``
+            database is made in a temporary directory, and ``redis`` is a
+            local stand-in for a Redis server.
+
+    Returns:
+        The report of the run.
+    """
+    settings = settings or Settings()
+    settings.secret_token = SECRET
+    settings.docker.enabled = True
+    settings.queue.backend = settings.lease.backend = backend
+    state = tempfile.mkdtemp(prefix="autoscaler-benchmark-")
+    settings.queue.sqlite_path = settings.lease.sqlite_path = os.path.join(
+        state, "autoscaler.db"
+    )
+    redis = FakeRespServer()
+
+    if backend == "redis":
+        await redis.start()
+        settings.queue.redis_url = settings.lease.redis_url = redis.url
+
+    api = FakeGithubAPI(github_latency, github_rate_limit)
+    provider = FakeRunnerProvider(settings.runner, start_latency)
+    services = [service for service in get_services() if service is not docker]
+
+    # The capacity manager follows the fake runners instead of docker
+    capacity._source = provider
+
+    for service in services:
+        service.initialize(settings)
+
+    github.initialize(settings, transport=api.transport)
+
+    for service in services:
+        await service.start()
+
+    background = [
+        asyncio.create_task(drain_queue(runner_provider=provider)),
+        asyncio.create_task(replenish_warm_pools(runner_provider=provider)),
+    ]
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=create_app(settings)),  # type: ignore
+        base_url="http://autoscaler",
+    ) as client:
+        simulation = Simulation(client, provider, job_duration, concurrency)
+
+        try:
+            await simulation.replay(webhooks, speed)
+            replayed = time.perf_counter() - started
+            await simulation.wait(timeout)
+        finally:
+            simulation.close()
+
+            for task in background:
+                task.cancel()
+
+            provider.close()
+
+            for service in reversed(services):
+                await service.close()
+
+            await redis.close()
+            shutil.rmtree(state, ignore_errors=True)
+
+    wall = time.perf_counter() - started
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    webhook_latencies = [latency * 1000 for latency in simulation.webhook_latencies]
+
+    return BenchmarkReport(
+        webhooks=len(webhook_latencies),
+        webhooks_per_second=simulation.jobs / replayed if replayed else 0.0,
+        webhook_latency_p50=percentile(webhook_latencies, 50),
+        webhook_latency_p95=percentile(webhook_latencies, 95),
+        webhook_latency_p99=percentile(webhook_latencies, 99),
+        jobs=simulation.jobs,
+        jobs_started=len(simulation.start_latencies),
+        queued_to_started_p50=percentile(simulation.start_latencies, 50),
+        queued_to_started_p95=percentile(simulation.start_latencies, 95),
+        queued_to_started_p99=percentile(simulation.start_latencies, 99),
+        runners_started=provider.started,
+        github_requests=sum(api.requests.values()),
+        github_throttled=api.throttled,
+        wall_seconds=wall,
+        cpu_seconds=(end_usage.ru_utime + end_usage.ru_stime)
+        - (usage.ru_utime + usage.ru_stime),
+        peak_rss_mb=end_usage.ru_maxrss / 1024,
+    )
@@ -34,12 +34,19 @@ def create_token(owner: str = typer.Option(None), repo: str = "") -> None:
 @dkr.command("create-runner")
 def create_runner(owner: str = typer.Option(None), repo: str = "") -> None:
     """Create a new Github Runner."""
-    token = asyncio.new_event_loop().run_until_complete(
-        github.create_runner_token(owner, repo)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(docker.prepare_images())
+    token = loop.run_until_complete(github.create_runner_token(owner, repo))
+
+    loop.run_until_complete(
+        docker.start_runner(
+            url=f"https://github.com/{owner}/{repo}",
+            token=token,
+            owner=owner,
+            repo=repo or None,
+        )
     )
 
-    docker.start_runner(url=f"https://github.com/{owner}/{repo}", token=token)
-
 
 cli.add_typer(gh, name="gh")
 cli.add_typer(dkr, name="dkr")
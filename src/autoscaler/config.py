@@ -6,13 +6,75 @@ can be overridden by setting environment variables with
 the same name as the setting.
 """
 
+from typing import Literal
+
+from pydantic import (
+    BaseModel,
+    Field,
+)
 from pydantic_settings import (
     BaseSettings,
 )
 
 
+class DockerHost(BaseModel):
+    """
+    A docker daemon that runners can be started on.
+
+    Attributes:
+        name: The name of the host.
+        url: The URL of the docker daemon, e.g.
+            ``unix:///var/run/docker.sock`` or ``tcp://10.0.0.2:2376``.
+        tls: Whether to connect to the daemon over TLS.
+        ca_cert: The path to the CA certificate to verify the daemon
+            with, if connecting over TLS.
+        client_cert: The path to the client certificate, if connecting
+            over TLS.
+        client_key: The path to the client key, if connecting over TLS.
+        max_runners: The maximum number of runners on the host, or None
+            to only be limited by its resources.
+    """
+
+    name: str
+    url: str
+    tls: bool = False
+    ca_cert: str | None = None
+    client_cert: str | None = None
+    client_key: str | None = None
+    max_runners: int | None = None
+
+
 class DockerSettings(BaseSettings):
-    """Settings for the docker client."""
+    """
+    Settings for the docker client.
+
+    Attributes:
+        build_image: Whether to build the runner image, rather
+            than pulling it.
+        build_path: The path to the build context of the runner image.
+        runner_dockerfile: The path to the dockerfile of the runner image.
+        runner_image: The name of the runner image.
+        runner_tag: The tag of the runner image.
+        no_cache: Whether to build the runner image without the cache.
+        enabled: Whether the docker client is enabled.
+        instance_name: The name of this autoscaler, used to label the
+            runners it starts so that they can be told apart from other
+            containers on the host.
+        max_workers: The maximum number of threads used to make
+            blocking calls to each docker daemon.
+        hosts: The docker daemons to start runners on. If empty, the
+            daemon is found from the ``DOCKER_HOST`` environment, as the
+            docker CLI does.
+        placement: How to pick the host for a runner. ``least_loaded``
+            spreads the runners over the hosts, and ``best_fit`` packs
+            them onto the hosts with the least room left that fit them.
+        host_check_interval: The interval, in seconds, at which to check
+            whether hosts that were unreachable are back, and to retry the
+            runner images that no host could prepare.
+        image_refresh_interval: The interval, in seconds, at which to pull
+            the runner images again to pick up new versions, or 0 to only
+            pull them at startup. Built images are not rebuilt.
+    """
 
     build_image: bool = True
     build_path: str = "."
@@ -21,6 +83,12 @@ class DockerSettings(BaseSettings):
     runner_tag: str = "latest"
     no_cache: bool = False
     enabled: bool = True
+    instance_name: str = "autoscaler"
+    max_workers: int = 8
+    hosts: list[DockerHost] = []
+    placement: Literal["least_loaded", "best_fit"] = "least_loaded"
+    host_check_interval: int = 30
+    image_refresh_interval: int = 60 * 60
 
     class Config:  # pyright: ignore
         """Pydantic config."""
@@ -28,6 +96,63 @@ class DockerSettings(BaseSettings):
         env_prefix = "DOCKER_"
 
 
+class RunnerClass(BaseModel):
+    """
+    A kind of runner that jobs can be routed to by their labels.
+
+    Attributes:
+        name: The name of the runner class.
+        labels: The custom labels that the runners are registered with,
+            on top of the default ``self-hosted``, ``linux`` and ``x64``.
+        image: The name of the runner image.
+        tag: The tag of the runner image.
+        dockerfile: The path to the dockerfile of the runner image, in the
+            docker build path. If None, the image is pulled instead.
+        cpus: The number of CPUs that a runner may use, or None for no
+            limit. Runners are only started while the host has that many
+            CPUs that are not reserved by other runners.
+        memory: The amount of memory that a runner may use, e.g. ``2g``,
+            or None for no limit. Runners are only started while the host
+            has that much memory that is not reserved by other runners.
+        max_runners: The maximum number of runners of this class, or
+            None to only be limited by the total number of runners.
+        cost: The relative cost of a runner. A job that matches several
+            classes is routed to the cheapest one.
+    """
+
+    name: str
+    labels: list[str] = []
+    image: str
+    tag: str = "latest"
+    dockerfile: str | None = None
+    cpus: float | None = None
+    memory: str | None = None
+    max_runners: int | None = None
+    cost: float = 1.0
+
+
+class OwnerShare(BaseModel):
+    """
+    The share of the runners that an org or user gets when they are busy.
+
+    Attributes:
+        owner: The org or user that the share is for.
+        weight: The relative share of the runners. An owner with a weight
+            of 2 gets twice as many runners as an owner with a weight of 1
+            when both have jobs waiting.
+        min_runners: The number of runners that the owner gets before any
+            other owner that is over its own minimum, when it has jobs
+            waiting.
+        max_runners: The maximum number of runners of the owner, or None
+            to only be limited by the total number of runners.
+    """
+
+    owner: str
+    weight: float = Field(default=1.0, gt=0)
+    min_runners: int = 0
+    max_runners: int | None = None
+
+
 class RunnerSettings(BaseSettings):
     """
     Settings for the runner.
@@ -35,19 +160,57 @@ class RunnerSettings(BaseSettings):
     Attributes:
         max_scale_up: The maximum number of runners to scale up
             at once.
-        scale_polling_interval: The interval, in seconds, at which
-            to poll for number of runners.
+        scale_polling_interval: The interval, in seconds, to wait
+            before resubscribing to the runner events if the event
+            stream is lost.
         autoscale_timeout: The timeout, in seconds, after which
             the autoscaler will stop trying to scale up runners.
             This is set to 23 hours by default, as Github will drop
             any job that takes longer than 24 hours to be picked up
             by a runner.
+        warm_pool_size: The number of idle, registered runners to
+            keep for each of the warm pool owners.
+        warm_pool_owners: The orgs (``org``) and repos (``owner/repo``)
+            to keep warm pools of runners for.
+        classes: The runner classes that jobs are routed to, on top of
+            the ``default`` class that uses the docker runner image. A
+            class named ``default`` replaces it.
+        reserved_cpus: The number of CPUs of the host to keep free for
+            the autoscaler and the docker daemon.
+        reserved_memory: The amount of memory of the host to keep free
+            for the autoscaler and the docker daemon, e.g. ``512m``.
+        owner_shares: The shares of the runners of the orgs and users.
+            Owners that are not listed have a weight of 1, no minimum and
+            no maximum.
+        reconcile_interval: The interval, in seconds, at which to check
+            the tracked runners against the runners on the hosts, in case
+            events were missed.
+        reap_interval: The interval, in seconds, at which to look for
+            stuck runners and stale registrations, or 0 to never look.
+        registration_timeout: The time, in seconds, after which a runner
+            that hasn't registered with Github is removed.
+        idle_timeout: The time, in seconds, after which a runner that has
+            been online on Github without picking up a job is removed.
+            Warm pool runners are kept however long they wait.
+        reap_batch_size: The maximum number of offline runners of an owner
+            or repo to deregister from Github at a time.
     """
 
     max_runners: int = 5
     scale_polling_interval: int = 60
     autoscale_timeout: int = 60 * 60 * 23
     base_url: str = "https://github.com"
+    warm_pool_size: int = 0
+    warm_pool_owners: list[str] = []
+    classes: list[RunnerClass] = []
+    reserved_cpus: float = 0.5
+    reserved_memory: str = "512m"
+    owner_shares: list[OwnerShare] = []
+    reconcile_interval: int = 60
+    reap_interval: int = 60
+    registration_timeout: int = 10 * 60
+    idle_timeout: int = 60 * 60
+    reap_batch_size: int = 50
 
     class Config:  # pyright: ignore
         """Pydantic config."""
@@ -55,6 +218,189 @@ class RunnerSettings(BaseSettings):
         env_prefix = "RUNNER_"
 
 
+class GithubSettings(BaseSettings):
+    """
+    Settings for the Github client.
+
+    Attributes:
+        requests_per_second: The sustained rate of requests to the API,
+            shared by all tasks.
+        burst: The number of requests that can be made at once before
+            the sustained rate applies.
+        max_retries: The number of times to retry a throttled or failed
+            request before giving up.
+        backoff_base: The base delay, in seconds, of the exponential
+            backoff between retries.
+        backoff_max: The maximum delay, in seconds, between retries.
+        poll_owners: The orgs (``org``) and repos (``owner/repo``) to poll
+            for queued jobs, to start runners for jobs whose webhook was
+            missed. Runners for the jobs of an org's repos are registered
+            to the org.
+        poll_interval: The interval, in seconds, at which to poll for
+            queued jobs.
+        poll_min_age: The time, in seconds, that a job must have been
+            queued for before polling starts a runner for it, to leave
+            time for its webhook.
+        poll_cache_size: The number of API responses to keep for
+            conditional requests.
+    """
+
+    requests_per_second: float = 10.0
+    burst: int = 20
+    max_retries: int = 5
+    backoff_base: float = 1.0
+    backoff_max: float = 60.0
+    poll_owners: list[str] = []
+    poll_interval: int = 60
+    poll_min_age: float = 30.0
+    poll_cache_size: int = 1000
+
+    class Config:  # pyright: ignore
+        """Pydantic config."""
+
+        env_prefix = "GITHUB_"
+
+
+class QueueSettings(BaseSettings):
+    """
+    Settings for the provisioning queue.
+
+    Attributes:
+        backend: Where queued jobs are stored. ``memory`` jobs are lost
+            on restart, ``sqlite`` jobs are stored in a file that can be
+            shared by the workers on a single host, and ``redis`` jobs
+            are stored on a server that speaks the Redis protocol.
+        sqlite_path: The path of the SQLite database.
+        redis_url: The URL of the Redis server.
+        redis_prefix: The prefix of the keys used in Redis.
+        workers: The maximum number of jobs to provision at once,
+            including the jobs waiting for a runner slot. Jobs are only
+            shared fairly between owners once they are taken off the
+            queue, so this should be well over the number of runners.
+        lease_timeout: The time, in seconds, after which a job taken
+            by a worker that stopped renewing its lease is handed out
+            again.
+        poll_interval: The interval, in seconds, at which to check for
+            jobs queued by other processes.
+        max_attempts: The number of times to try to provision a runner
+            for a job before dropping it.
+        history_size: The number of webhook deliveries and started
+            jobs to remember, to ignore redelivered webhooks.
+        history_ttl: The time, in seconds, for which the queue remembers
+            the jobs that were put on it, so that a job that Github still
+            lists as queued is not queued again by polling, whichever
+            process queued it.
+        batch_size: The maximum number of jobs to take off the queue
+            at once.
+        batch_window: The time, in seconds, to wait for more jobs to
+            be queued after the first one, to handle bursts together.
+        priority_default_branch: Whether the jobs of workflows that run
+            on the default branch of their repository get runners first.
+        priority_branches: Patterns, such as ``release/*``, of the
+            branches whose jobs get runners first.
+        priority_workflows: Patterns of the names of the workflows whose
+            jobs get runners first.
+    """
+
+    backend: Literal["memory", "sqlite", "redis"] = "memory"
+    sqlite_path: str = "autoscaler.db"
+    redis_url: str = "redis://localhost:6379/0"
+    redis_prefix: str = "autoscaler"
+    workers: int = 500
+    lease_timeout: int = 60
+    poll_interval: float = 1.0
+    max_attempts: int = 5
+    history_size: int = 10000
+    history_ttl: int = 3600
+    batch_size: int = 50
+    batch_window: float = 0.05
+    priority_default_branch: bool = True
+    priority_branches: list[str] = []
+    priority_workflows: list[str] = []
+
+    class Config:  # pyright: ignore
+        """Pydantic config."""
+
+        env_prefix = "QUEUE_"
+
+
+class LeaseSettings(BaseSettings):
+    """
+    Settings for the leases shared between processes.
+
+    Every process reserves a lease before starting a runner, so that
+    several workers can share a single ``max_runners`` limit. Leases also
+    mark the warm pool runners that were claimed for a job, and the one
+    process that keeps the warm pools topped up.
+
+    Attributes:
+        backend: Where the leases are stored. ``memory`` leases are only
+            seen by a single process, ``sqlite`` leases are shared by the
+            processes on a host, and ``redis`` leases are shared by every
+            process that uses the same server.
+        sqlite_path: The path of the SQLite database.
+        redis_url: The URL of the Redis server.
+        redis_prefix: The prefix of the keys used in Redis.
+        timeout: The time, in seconds, after which a lease that was
+            never released expires.
+        retry_interval: The interval, in seconds, at which to retry
+            reserving a slot that another process took first.
+        leader_timeout: The time, in seconds, after which another process
+            takes over the background work that only one process does,
+            if the process doing it stops renewing its lease.
+    """
+
+    backend: Literal["memory", "sqlite", "redis"] = "memory"
+    sqlite_path: str = "autoscaler.db"
+    redis_url: str = "redis://localhost:6379/0"
+    redis_prefix: str = "autoscaler"
+    timeout: int = 300
+    retry_interval: float = 1.0
+    leader_timeout: int = 30
+
+    class Config:  # pyright: ignore
+        """Pydantic config."""
+
+        env_prefix = "LEASE_"
+
+
+class PrescaleSettings(BaseSettings):
+    """
+    Settings for starting runners ahead of predicted demand.
+
+    Attributes:
+        enabled: Whether to start runners ahead of predicted demand.
+        horizon: How far ahead, in seconds, to predict the jobs that
+            will be queued. This should be about the time it takes for
+            a runner to start and register.
+        max_runners: The maximum number of idle runners to start ahead
+            of demand for each owner or repo and runner class.
+        max_share: The largest share of ``runner.max_runners`` that the
+            runners started ahead of demand may take, across every owner
+            or repo and runner class, so that they don't hold the slots
+            of the jobs that are actually queued until they time out.
+        alpha: The smoothing factor of the moving averages of the
+            arrival rate, between 0 and 1. Higher values react faster.
+        interval: The interval, in seconds, at which to update the
+            predictions.
+        state_path: The path of a file to keep the arrival history in
+            across restarts, or None to keep it in memory.
+    """
+
+    enabled: bool = False
+    horizon: int = 120
+    max_runners: int = 2
+    max_share: float = 0.25
+    alpha: float = 0.3
+    interval: int = 60
+    state_path: str | None = None
+
+    class Config:  # pyright: ignore
+        """Pydantic config."""
+
+        env_prefix = "PRESCALE_"
+
+
 class Settings(BaseSettings):
     """
     Settings for the app.
@@ -69,18 +415,31 @@ class Settings(BaseSettings):
         debug: Whether the app is running in debug mode.
         secret_token: The secret token to use for authenticating
             requests to the app.
+        secret_tokens: Other secret tokens to also accept, so that the
+            secret token can be rotated.
+        max_body_size: The maximum size, in bytes, of a webhook body.
         github_pat: The Github personal access token to use for
             authenticating with the Github API.
+        github: Settings for the Github client.
         docker: Settings for the docker client.
         runner: Settings for the runner.
+        queue: Settings for the provisioning queue.
+        lease: Settings for the runner slot leases.
+        prescale: Settings for starting runners ahead of demand.
     """
 
     env: str = "dev"
     debug: bool = False
     secret_token: str = "secret"
+    secret_tokens: list[str] = []
+    max_body_size: int = 1024 * 1024
     github_pat: str = "secret"
+    github: GithubSettings = GithubSettings()
     docker: DockerSettings = DockerSettings()
     runner: RunnerSettings = RunnerSettings()
+    queue: QueueSettings = QueueSettings()
+    lease: LeaseSettings = LeaseSettings()
+    prescale: PrescaleSettings = PrescaleSettings()
 
     @property
     def openapi_url(self) -> str:  # pragma: no cover
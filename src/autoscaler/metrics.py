@@ -0,0 +1,313 @@
+"""
+A module for the metrics of the autoscaler.
+
+Metrics are kept in memory and rendered in the Prometheus text format by
+the ``/metrics`` route. Each worker process keeps its own metrics.
+"""
+
+import math
+import time
+
+from contextlib import contextmanager
+from typing import Iterator
+
+LabelValues = tuple[str, ...]
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    900.0,
+    3600.0,
+)
+
+
+class Metric:
+    """
+    The base class for metrics.
+
+    Attributes:
+        name: The name of the metric.
+        description: The help text of the metric.
+        label_names: The names of the labels of the metric.
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...] = (),
+    ) -> None:
+        """
+        Create a new metric and register it.
+
+        Args:
+            name: The name of the metric.
+            description: The help text of the metric.
+            label_names: The names of the labels of the metric.
+        """
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        """Get the label values in the order of the label names."""
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _format_labels(self, values: LabelValues, **extra: str) -> str:
+        """Format label values as a Prometheus label set."""
+        pairs = [*zip(self.label_names, values), *extra.items()]
+
+        if not pairs:
+            return ""
+
+        escaped = (
+            (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+            for name, value in pairs
+        )
+
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def samples(self) -> Iterator[str]:
+        """Render the samples of the metric."""
+        yield from ()
+
+    def render(self) -> str:
+        """Render the metric in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A metric that only goes up.
+
+    Counters are exposed with a ``_total`` suffix, which is added to their
+    name unless it already has it, so the help and type lines name the
+    same metric as the samples.
+    """
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...] = (),
+    ) -> None:
+        """Create a new counter."""
+        if not name.endswith("_total"):
+            name = f"{name}_total"
+
+        super().__init__(name, description, label_names)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """
+        Increment the counter.
+
+        Args:
+            amount: The amount to increment by.
+            labels: The label values.
+        """
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        """Render the samples of the counter."""
+        for key, value in self._values.items():
+            yield f"{self.name}{self._format_labels(key)} {value}"
+
+
+class Gauge(Metric):
+    """A metric that can go up and down."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...] = (),
+    ) -> None:
+        """Create a new gauge."""
+        super().__init__(name, description, label_names)
+        self._values: dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Set the value of the gauge.
+
+        Args:
+            value: The new value.
+            labels: The label values.
+        """
+        self._values[self._key(labels)] = value
+
+    def samples(self) -> Iterator[str]:
+        """Render the samples of the gauge."""
+        for key, value in self._values.items():
+            yield f"{self.name}{self._format_labels(key)} {value}"
+
+
+class Histogram(Metric):
+    """A metric that counts observations in buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        """
+        Create a new histogram.
+
+        Args:
+            name: The name of the metric.
+            description: The help text of the metric.
+            label_names: The names of the labels of the metric.
+            buckets: The upper bounds of the buckets.
+        """
+        super().__init__(name, description, label_names)
+        self.buckets = (*sorted(buckets), math.inf)
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record an observation.
+
+        Args:
+            value: The observed value.
+            labels: The label values.
+        """
+        key = self._key(labels)
+        counts = self._counts.setdefault(key, [0] * len(self.buckets))
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+
+        self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observe the time, in seconds, spent in a block.
+
+        Args:
+            labels: The label values.
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        """Render the cumulative buckets, sum and count of the histogram."""
+        for key, counts in self._counts.items():
+            total = 0
+
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                yield f"{self.name}_bucket{self._format_labels(key, le=le)} {total}"
+
+            yield f"{self.name}_sum{self._format_labels(key)} {self._sums[key]}"
+            yield f"{self.name}_count{self._format_labels(key)} {total}"
+
+
+registry: list[Metric] = []
+
+
+def render() -> str:
+    """
+    Render every registered metric in the Prometheus text format.
+
+    Returns:
+        The metrics.
+    """
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+webhook_duration = Histogram(
+    "autoscaler_webhook_duration_seconds",
+    "Time spent handling a webhook",
+    ("path",),
+)
+hmac_duration = Histogram(
+    "autoscaler_hmac_verification_duration_seconds",
+    "Time spent verifying the HMAC signature of a webhook",
+)
+token_request_duration = Histogram(
+    "autoscaler_github_token_request_duration_seconds",
+    "Time spent requesting a runner registration token from Github",
+)
+container_start_duration = Histogram(
+    "autoscaler_container_start_duration_seconds",
+    "Time spent starting a runner container",
+)
+queued_to_started_duration = Histogram(
+    "autoscaler_queued_to_started_duration_seconds",
+    "Time from a job being queued to a runner being started for it",
+    ("owner",),
+)
+active_runners = Gauge(
+    "autoscaler_active_runners",
+    "The number of runners that are running",
+)
+waiting_jobs = Gauge(
+    "autoscaler_waiting_jobs",
+    "The number of jobs on the provisioning queue",
+)
+warm_pool_idle_runners = Gauge(
+    "autoscaler_warm_pool_idle_runners",
+    "The number of idle runners in a warm pool",
+    ("owner", "runner_class"),
+)
+recovered_jobs = Counter(
+    "autoscaler_recovered_jobs",
+    "Queued jobs found by polling Github rather than by their webhook",
+)
+reaped_runners = Counter(
+    "autoscaler_reaped_runners",
+    "Runners removed for being stuck, idle for too long or surplus to a warm pool",
+    ("reason",),
+)
+deregistered_runners = Counter(
+    "autoscaler_deregistered_runners",
+    "Offline runners deregistered from Github",
+)
+github_rate_limit_remaining = Gauge(
+    "autoscaler_github_rate_limit_remaining",
+    "The number of requests left in the Github API rate limit window",
+)
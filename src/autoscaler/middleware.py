@@ -0,0 +1,218 @@
+"""
+A module for the middleware of the app.
+
+The middleware works on the raw ASGI messages, rather than on FastAPI
+requests, so that webhook bodies can be checked as they are received,
+before FastAPI parses them.
+"""
+
+import hashlib
+import hmac
+import time
+
+from fastapi.responses import JSONResponse
+from loguru import logger
+from starlette.requests import ClientDisconnect
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+from autoscaler import metrics
+from autoscaler.config import Settings
+
+SIGNATURE_HEADER = b"x-hub-signature-256"
+SIGNATURE_PREFIX = "sha256="
+
+
+class BodyTooLargeError(ValueError):
+    """The body of a request is larger than the configured limit."""
+
+
+class WebhookSignatureMiddleware:
+    """
+    Check the HMAC signature of the webhooks sent by Github.
+
+    Github signs the body of every webhook with a pre-shared secret. The
+    keyed HMAC state of every accepted secret is computed once, and copied
+    for each request, so that only the body itself is hashed per request.
+    The body is hashed as it is received, rejected as soon as it grows over
+    the size limit, and handed on to the app once it is verified, so that
+    it is only read once.
+
+    Several secrets can be accepted at once, so that the secret can be
+    rotated without dropping webhooks.
+    """
+
+    def __init__(self, app: ASGIApp, settings: Settings) -> None:
+        """
+        Create the middleware.
+
+        Args:
+            app: The app to hand verified requests to.
+            settings: The settings of the app.
+        """
+        self.app = app
+        self.max_body_size = settings.max_body_size
+        self._keys = [
+            hmac.new(secret.encode(), digestmod=hashlib.sha256)
+            for secret in [settings.secret_token, *settings.secret_tokens]
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Check the signature of a webhook before handing it to the app.
+
+        Args:
+            scope: The scope of the request.
+            receive: The channel to receive the body from.
+            send: The channel to send the response to.
+        """
+        if scope["type"] != "http" or not scope["path"].startswith("/webhook"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        signature = headers.get(SIGNATURE_HEADER, b"").decode("latin-1").lower()
+
+        if not signature:
+            logger.error("No HMAC signature provided!")
+            await self._reject(scope, send, 400, "No HMAC signature provided!")
+            return
+
+        if not signature.startswith(SIGNATURE_PREFIX):
+            logger.error("Invalid HMAC signature provided!")
+            await self._reject(scope, send, 400, "Invalid HMAC signature provided!")
+            return
+
+        length = headers.get(b"content-length", b"0")
+
+        if not length.isdigit() or int(length) > self.max_body_size:
+            await self._reject(scope, send, 413, "Request body is too large")
+            return
+
+        try:
+            body, verified = await self._read(
+                receive,
+                signature.removeprefix(SIGNATURE_PREFIX),
+            )
+        except BodyTooLargeError:
+            await self._reject(scope, send, 413, "Request body is too large")
+            return
+        except ClientDisconnect:
+            # Nobody is left to answer, and a partial body must not be handled
+            logger.warning("Client disconnected before sending the whole body")
+            return
+
+        if not verified:
+            logger.error("Failed HMAC authentication")
+            await self._reject(scope, send, 400, "Invalid HMAC signature provided!")
+            return
+
+        await self.app(scope, self._replay(receive, body), send)
+
+    @staticmethod
+    def _replay(receive: Receive, body: bytes) -> Receive:
+        """
+        Hand the body that was already read to the app.
+
+        Args:
+            receive: The channel to receive the rest of the messages from.
+            body: The body of the request.
+
+        Returns:
+            A channel that sends the body first, then the later messages.
+        """
+        sent = False
+
+        async def replay() -> Message:
+            nonlocal sent
+
+            if sent:
+                return await receive()
+
+            sent = True
+
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return replay
+
+    async def _read(self, receive: Receive, expected: str) -> tuple[bytes, bool]:
+        """
+        Read the body of a request, hashing it as it is received.
+
+        Args:
+            receive: The channel to receive the body from.
+            expected: The hex digest of the body, from the request headers.
+
+        Returns:
+            The body, and whether it was signed with an accepted secret.
+
+        Raises:
+            BodyTooLargeError: If the body is larger than the size limit.
+            ClientDisconnect: If the client disconnects before sending the
+                whole body.
+        """
+        digests = [key.copy() for key in self._keys]
+        chunks: list[bytes] = []
+        size = 0
+        hashing = 0.0
+        more_body = True
+
+        while more_body:
+            message = await receive()
+
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnect()
+
+            chunk: bytes = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            size += len(chunk)
+
+            if size > self.max_body_size:
+                raise BodyTooLargeError(f"Request body is over {self.max_body_size}")
+
+            started = time.perf_counter()
+
+            for digest in digests:
+                digest.update(chunk)
+
+            hashing += time.perf_counter() - started
+            chunks.append(chunk)
+
+        started = time.perf_counter()
+        verified = False
+
+        # Every secret is checked, so the time taken doesn't tell which matched
+        for digest in digests:
+            verified |= hmac.compare_digest(digest.hexdigest(), expected)
+
+        metrics.hmac_duration.observe(hashing + time.perf_counter() - started)
+
+        return b"".join(chunks), verified
+
+    async def _reject(
+        self,
+        scope: Scope,
+        send: Send,
+        status_code: int,
+        detail: str,
+    ) -> None:
+        """
+        Reject a request without handing it to the app.
+
+        Args:
+            scope: The scope of the request.
+            send: The channel to send the response to.
+            status_code: The status code of the response.
+            detail: The reason the request was rejected.
+        """
+
+        async def receive() -> Message:
+            return {"type": "http.disconnect"}
+
+        response = JSONResponse({"detail": detail}, status_code=status_code)
+        await response(scope, receive, send)
@@ -6,10 +6,17 @@ validation of the data that is passed to the app, and allows for
 serialization of the data that is returned from the app.
 """
 
-from enum import Enum
+import time
+
+from datetime import datetime
+from enum import (
+    Enum,
+    IntEnum,
+)
 
 from pydantic import (
     BaseModel,
+    Field,
 )
 
 
@@ -20,6 +27,27 @@ class WorkflowJobAction(str, Enum):
     QUEUED = "queued"
     WAITING = "waiting"
     IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+
+
+class JobPriority(IntEnum):
+    """
+    How urgently a job needs a runner, with the most urgent first.
+
+    Warm pool runners are only started for predicted jobs, so they wait
+    behind every queued job.
+    """
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class RunnerState(str, Enum):
+    """The state of a runner that the autoscaler tracks."""
+
+    STARTING = "starting"
+    RUNNING = "running"
 
 
 class StatusResponse(BaseModel):
@@ -48,50 +76,136 @@ class RegistrationTokenResponse(BaseModel):
     """
 
     token: str
-    expires_at: str
+    expires_at: datetime
 
 
-class RepositoryOwner(BaseModel):
+class RateLimitStatus(BaseModel):
     """
-    A model for the repository owner.
+    A model for the rate limit budget of the Github API.
+
+    The budget is read from the ``X-RateLimit-*`` headers of the
+    most recent API response.
 
     Attributes:
-        id: The id of the owner.
-        login: The login of the owner.
+        limit: The number of requests allowed per window.
+        remaining: The number of requests left in the current window.
+        reset: The time at which the current window resets.
     """
 
-    id: int
-    login: str
+    limit: int | None = None
+    remaining: int | None = None
+    reset: datetime | None = None
 
 
-class Repository(BaseModel):
+class GithubRunner(BaseModel):
     """
-    A model for the repository.
+    A model for a self-hosted runner registered with Github.
 
     Attributes:
-        id: The id of the repository.
-        name: The name of the repository.
-        full_name: The full name of the repository.
-        private: Whether the repository is private.
-        owner: The owner of the repository.
+        id: The id of the runner on Github.
+        name: The name of the runner.
+        status: Whether the runner is ``online`` or ``offline``.
+        busy: Whether the runner is running a job.
     """
 
     id: int
     name: str
-    full_name: str
-    private: bool
-    owner: RepositoryOwner
+    status: str
+    busy: bool = False
 
 
-class WorkflowJobWebhookPayload(BaseModel):
+class WorkflowJobEvent(BaseModel):
     """
-    A model for the workflow job webhook payload.
+    A model for the fields of a workflow job webhook that are used.
 
     Attributes:
         action: The action that triggered the webhook.
-        workflow_job: The workflow job that triggered the webhook.
+        job_id: The id of the workflow job.
+        labels: The labels of the runners that the job can run on.
+        owner: The login of the owner of the repository.
+        repo: The name of the repository.
+        organization: The login of the organization of the repository,
+            if any.
+        head_branch: The branch that the workflow runs on.
+        default_branch: The default branch of the repository.
+        workflow_name: The name of the workflow of the job.
+        created_at: The time, as a UNIX timestamp, at which Github queued
+            the job, if known.
+        conclusion: The outcome of the job, once it is completed.
+        runner_id: The id of the runner that picked up the job, if any.
     """
 
     action: WorkflowJobAction
-    repository: Repository
-    organization: RepositoryOwner | None
+    job_id: int
+    labels: list[str] = []
+    owner: str
+    repo: str
+    organization: str | None = None
+    head_branch: str | None = None
+    default_branch: str | None = None
+    workflow_name: str | None = None
+    created_at: float | None = None
+    conclusion: str | None = None
+    runner_id: int | None = None
+
+    @property
+    def cancelled_before_start(self) -> bool:
+        """Whether the job was cancelled before any runner picked it up."""
+        return (
+            self.action == WorkflowJobAction.COMPLETED
+            and self.conclusion == "cancelled"
+            and self.runner_id is None
+        )
+
+
+class ProvisioningJob(BaseModel):
+    """
+    A model for a job waiting for a runner to be provisioned.
+
+    Attributes:
+        id: The id of the workflow job.
+        owner: The owner that the runner should be registered to.
+        repo: The repo that the runner should be registered to, or
+            None if the runner should be registered to the org.
+        attempts: The number of failed attempts to provision a runner.
+        queued_at: The time, as a UNIX timestamp, at which the job was
+            queued.
+        runner_class: The name of the runner class that the job was
+            routed to.
+        priority: How urgently the job needs a runner.
+    """
+
+    id: int
+    owner: str
+    repo: str | None = None
+    attempts: int = 0
+    queued_at: float = Field(default_factory=time.time)
+    runner_class: str = "default"
+    priority: JobPriority = JobPriority.NORMAL
+
+
+class RunnerRecord(BaseModel):
+    """
+    A model for a runner that the autoscaler started.
+
+    Attributes:
+        id: The id of the runner's container.
+        owner: The owner that the runner is registered to, if known.
+        repo: The repo that the runner is registered to, or None if the
+            runner is registered to an org.
+        runner_class: The name of the runner class of the runner.
+        started_at: The time, as a UNIX timestamp, at which the runner
+            was started.
+        state: Whether the runner has been seen running on its host yet.
+        name: The name that the runner registers under on Github, if known.
+        warm: Whether the runner was started for a warm pool.
+    """
+
+    id: str
+    owner: str | None = None
+    repo: str | None = None
+    runner_class: str = "default"
+    started_at: float = Field(default_factory=time.time)
+    state: RunnerState = RunnerState.RUNNING
+    name: str | None = None
+    warm: bool = False
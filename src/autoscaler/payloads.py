@@ -0,0 +1,136 @@
+"""
+A module for parsing the webhook payloads sent by Github.
+
+Workflow job payloads are several kilobytes of JSON, of which only a
+handful of fields are used, and most of them are for actions that are
+ignored. Rather than validating the whole payload, the action is read
+from the start of the body when possible, so that ignored webhooks are
+never parsed, and only the fields that are used are picked out of the
+rest. If ``orjson`` is installed, it is used to decode the body.
+"""
+
+import json
+import re
+
+from datetime import datetime
+from typing import (
+    Any,
+    Callable,
+)
+
+from autoscaler.models import (
+    WorkflowJobAction,
+    WorkflowJobEvent,
+)
+
+HANDLED_ACTIONS = frozenset(
+    {
+        WorkflowJobAction.QUEUED,
+        WorkflowJobAction.IN_PROGRESS,
+        WorkflowJobAction.COMPLETED,
+    }
+)
+
+# Github sends the action as the first key of the payload
+ACTION_PREFIX = re.compile(rb'\s*\{\s*"action"\s*:\s*"([a-z_]+)"')
+
+
+class PayloadError(ValueError):
+    """The payload of a webhook is not a valid workflow job event."""
+
+
+def _json_loads() -> Callable[[bytes], Any]:
+    """Get the fastest available JSON decoder."""
+    try:
+        import orjson
+    except ImportError:  # pragma: no cover
+        return json.loads
+
+    return orjson.loads
+
+
+loads = _json_loads()
+
+
+def peek_action(body: bytes) -> str | None:
+    """
+    Read the action of a webhook without decoding the body.
+
+    Args:
+        body: The body of the webhook.
+
+    Returns:
+        The action, or None if it is not the first key of the payload.
+    """
+    match = ACTION_PREFIX.match(body)
+
+    return None if match is None else match.group(1).decode()
+
+
+def parse_timestamp(value: str | None) -> float | None:
+    """
+    Parse a timestamp of the Github API.
+
+    Github marks UTC with a ``Z``, which ``datetime.fromisoformat`` only
+    accepts from Python 3.11, so it is replaced with the UTC offset.
+
+    Args:
+        value: The timestamp, in ISO 8601 format, if any.
+
+    Returns:
+        The timestamp as a UNIX timestamp, or None if there is none.
+    """
+    if value is None:
+        return None
+
+    if value.endswith(("Z", "z")):
+        value = f"{value[:-1]}+00:00"
+
+    return datetime.fromisoformat(value).timestamp()
+
+
+def parse_workflow_job(body: bytes) -> WorkflowJobEvent | None:
+    """
+    Parse the fields of a workflow job webhook that the autoscaler uses.
+
+    Args:
+        body: The body of the webhook.
+
+    Returns:
+        The event, or None if its action is ignored.
+
+    Raises:
+        PayloadError: If the body is not a valid workflow job payload.
+    """
+    action = peek_action(body)
+
+    if action is not None and action not in HANDLED_ACTIONS:
+        return None
+
+    try:
+        payload = loads(body)
+        action = payload["action"]
+
+        if action not in HANDLED_ACTIONS:
+            return None
+
+        job = payload["workflow_job"]
+        repository = payload["repository"]
+        organization = payload.get("organization")
+
+        return WorkflowJobEvent(
+            action=WorkflowJobAction(action),
+            job_id=job["id"],
+            labels=job.get("labels") or [],
+            owner=repository["owner"]["login"],
+            repo=repository["name"],
+            organization=None if organization is None else organization["login"],
+            head_branch=job.get("head_branch"),
+            default_branch=repository.get("default_branch"),
+            workflow_name=job.get("workflow_name"),
+            created_at=parse_timestamp(job.get("created_at")),
+            conclusion=job.get("conclusion"),
+            runner_id=job.get("runner_id"),
+        )
+    except (ValueError, KeyError, TypeError) as e:
+        raise PayloadError(f"Invalid workflow job payload: {e}") from e
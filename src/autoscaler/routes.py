@@ -8,24 +8,27 @@ that they can be defined independently of the app.
 
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
-    Depends,
+    Header,
     HTTPException,
+    Request,
 )
+from fastapi.responses import PlainTextResponse
 
-from autoscaler.dependencies import (
-    check_hmac,
-)
+from autoscaler import metrics
 from autoscaler.models import (
     StatusResponse,
-    WorkflowJobAction,
-    WorkflowJobWebhookPayload,
+    WorkflowJobEvent,
 )
-from autoscaler.tasks import (
-    start_runner,
+from autoscaler.payloads import (
+    PayloadError,
+    parse_workflow_job,
 )
 from autoscaler.services import (
-    docker,
+    capacity,
+    github,
+    queue,
+    warm_pools,
+    webhooks,
 )
 
 
@@ -48,35 +51,96 @@ async def heartbeat() -> StatusResponse:
     return StatusResponse(msg="Service is up and running")
 
 
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    summary="Get the metrics of the app",
+    description="A route for scraping the metrics of the app with Prometheus.",
+)
+async def get_metrics() -> PlainTextResponse:
+    """
+    Render the metrics of the app in the Prometheus text format.
+
+    Returns:
+        The metrics.
+    """
+    metrics.active_runners.set(capacity.live)
+    metrics.waiting_jobs.set(await queue.size())
+
+    for (owner, repo, runner_class), pool in warm_pools.pools.items():
+        metrics.warm_pool_idle_runners.set(
+            pool.idle,
+            owner=owner if repo is None else f"{owner}/{repo}",
+            runner_class=runner_class,
+        )
+
+    if github.rate_limit.remaining is not None:
+        metrics.github_rate_limit_remaining.set(github.rate_limit.remaining)
+
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def read_workflow_job(
+    request: Request,
+    x_github_event: str | None,
+) -> WorkflowJobEvent | None:
+    """
+    Read the workflow job event of a webhook.
+
+    Args:
+        request: The webhook request.
+        x_github_event: The type of the webhook event.
+
+    Returns:
+        The event, or None if the webhook is ignored.
+
+    Raises:
+        HTTPException: If the payload is not a valid workflow job event.
+    """
+    if x_github_event is not None and x_github_event != "workflow_job":
+        return None
+
+    try:
+        return parse_workflow_job(await request.body())
+    except PayloadError as e:
+        raise HTTPException(detail=str(e), status_code=422)
+
+
 @router.post(
     "/webhook/repo/docker",
     summary="Handle a webhook from Github",
     description="A route for handling webhooks from Github.",
     response_model=StatusResponse,
-    dependencies=[Depends(check_hmac)],
 )
 async def webhook(
-    payload: WorkflowJobWebhookPayload,
-    tasks: BackgroundTasks,
+    request: Request,
+    x_github_delivery: str | None = Header(default=None),
+    x_github_event: str | None = Header(default=None),
 ) -> StatusResponse:
     """
     Handle a webhook from Github.
 
     Args:
-        payload: The payload of the webhook.
-        tasks: A background tasks object.
+        request: The webhook request. This is injected by FastAPI.
+        x_github_delivery: The unique id of the webhook delivery.
+            This is injected by FastAPI.
+        x_github_event: The type of the webhook event. This is
+            injected by FastAPI.
 
     Returns:
         A status response message.
     """
-    if payload.action == WorkflowJobAction.QUEUED:
-        tasks.add_task(
-            start_runner,
-            runner_provider=docker,
-            owner=payload.repository.owner.login,
-            repo=payload.repository.name,
-        )
-    return StatusResponse(msg="Webhook received")
+    event = await read_workflow_job(request, x_github_event)
+
+    if event is None:
+        return StatusResponse(msg="Webhook ignored")
+
+    return await webhooks.handle(
+        event,
+        x_github_delivery,
+        owner=event.owner,
+        repo=event.repo,
+    )
 
 
 @router.post(
@@ -84,30 +148,36 @@ async def webhook(
     summary="Handle an org webhook from Github",
     description="A route for handling org webhooks from Github.",
     response_model=StatusResponse,
-    dependencies=[Depends(check_hmac)],
 )
 async def org_webhook(
-    payload: WorkflowJobWebhookPayload,
-    tasks: BackgroundTasks,
+    request: Request,
+    x_github_delivery: str | None = Header(default=None),
+    x_github_event: str | None = Header(default=None),
 ) -> StatusResponse:
     """
     Handle an org webhook from Github.
 
     Args:
-        payload: The payload of the webhook.
-        tasks: A background tasks object.
+        request: The webhook request. This is injected by FastAPI.
+        x_github_delivery: The unique id of the webhook delivery.
+            This is injected by FastAPI.
+        x_github_event: The type of the webhook event. This is
+            injected by FastAPI.
 
     Returns:
         A status response message.
     """
-    if payload.organization is None:
+    event = await read_workflow_job(request, x_github_event)
+
+    if event is None:
+        return StatusResponse(msg="Webhook ignored")
+
+    if event.organization is None:
         raise HTTPException(detail="No organization in payload", status_code=400)
 
-    if payload.action == WorkflowJobAction.QUEUED:
-        tasks.add_task(
-            start_runner,
-            runner_provider=docker,
-            owner=payload.organization.login,
-            repo=None,
-        )
-    return StatusResponse(msg="Webhook received")
+    return await webhooks.handle(
+        event,
+        x_github_delivery,
+        owner=event.organization,
+        repo=None,
+    )
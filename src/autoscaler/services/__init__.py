@@ -2,21 +2,59 @@
 
 
 from autoscaler.services.github import GithubClient
-from autoscaler.services.docker import DockerClient
-from autoscaler.services.protocols import Service, RunnerProvider
+from autoscaler.services.hosts import DockerHostPool
+from autoscaler.services.capacity import CapacityManager
+from autoscaler.services.classes import RunnerClassRegistry
+from autoscaler.services.leases import LeaderLease
+from autoscaler.services.forecast import DemandForecaster
+from autoscaler.services.pool import WarmPoolManager
+from autoscaler.services.queue import ProvisioningQueue
+from autoscaler.services.jobs import JobTracker
+from autoscaler.services.webhooks import WorkflowJobHandler
+from autoscaler.services.protocols import (
+    Service,
+    AsyncRunnerProvider,
+)
 
 __all__ = [
+    "runner_classes",
     "docker",
     "github",
+    "capacity",
+    "leader",
+    "warm_pools",
+    "forecaster",
+    "queue",
+    "jobs",
+    "webhooks",
     "get_services",
     "Service",
-    "RunnerProvider",
+    "AsyncRunnerProvider",
 ]
 
-docker = DockerClient()
+runner_classes = RunnerClassRegistry()
+docker = DockerHostPool()
 github = GithubClient()
+capacity = CapacityManager(docker)
+leader = LeaderLease()
+warm_pools = WarmPoolManager(capacity, runner_classes)
+forecaster = DemandForecaster(warm_pools, runner_classes, leader)
+queue = ProvisioningQueue()
+jobs = JobTracker()
+webhooks = WorkflowJobHandler(runner_classes, jobs, queue, forecaster)
 
 
 def get_services() -> list[Service]:
     """Return a list of services."""
-    return [docker, github]
+    return [
+        runner_classes,
+        docker,
+        github,
+        capacity,
+        leader,
+        warm_pools,
+        forecaster,
+        queue,
+        jobs,
+        webhooks,
+    ]
@@ -0,0 +1,738 @@
+"""A module for tracking the live runner capacity."""
+
+import asyncio
+
+from collections import (
+    Counter,
+    deque,
+)
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Iterator,
+    Protocol,
+)
+
+from loguru import logger
+
+from autoscaler.config import (
+    RunnerClass,
+    Settings,
+)
+from autoscaler.models import (
+    JobPriority,
+    RunnerRecord,
+    RunnerState,
+)
+from autoscaler.services.classes import (
+    load_runner_classes,
+    resource_requests,
+)
+from autoscaler.services.docker import runner_record
+from autoscaler.services.leases import (
+    LeaseStore,
+    create_lease_store,
+)
+from autoscaler.services.scheduler import FairShareScheduler
+
+
+class RunnerEventSource(Protocol):
+    """A protocol for providers that can stream runner lifecycle events."""
+
+    async def runner_events(self) -> Iterator[dict[str, Any]]:
+        """Subscribe to the start/die events of runner containers."""
+        ...
+
+    async def list_runner_records(self) -> dict[str, RunnerRecord]:
+        """List the ids of the running runners with their records."""
+        ...
+
+    async def allocatable_resources(self) -> tuple[float, int]:
+        """Get the CPUs and bytes of memory that runners may reserve."""
+        ...
+
+    def can_place(self, runner_class: RunnerClass, reserved: Counter[str]) -> bool:
+        """Check whether a host would have room for one more runner."""
+        ...
+
+
+class CapacityManager:
+    """
+    Track the number of live runners from the docker events stream.
+
+    Rather than having every waiting job poll the runner provider, the
+    manager keeps an in-memory registry of live runners fed by container
+    start/die events, and hands out free slots to waiting jobs one at a
+    time, shared fairly between their owners by weight, and most urgent
+    first for each owner.
+
+    The registry is rebuilt from the labels of the runners on the hosts
+    at startup, so runners started before a restart are still counted,
+    and checked against them periodically in case events were missed.
+
+    Every slot that is handed out is also leased from a lease store, which
+    can be shared by several processes so that they don't each enforce
+    ``max_runners`` on their own. Once the runner has started, its lease is
+    held under the id of its container until it exits, and every process
+    that follows the runner keeps renewing it, so that a process can only
+    take a slot if fewer than ``max_runners`` runners, started by any of
+    the processes, are starting or running.
+
+    Runner classes with a ``max_runners`` of their own are also limited
+    to that many live runners. A job waiting for a full class doesn't hold
+    up the jobs behind it that are waiting for other classes.
+
+    Runners are also packed onto the hosts by the CPUs and memory that
+    their class reserves: a runner is only started if its reservation fits
+    in what one of the hosts has left, once the runners that were admitted
+    before it are placed, so they admit as many small runners as they can
+    hold and no more large ones than they can run.
+    """
+
+    max_runners: int
+    cpus: float | None
+    memory: int | None
+    resubscribe_interval: int
+    reconcile_interval: int
+    lease_timeout: int
+    lease_retry_interval: float
+    is_enabled: bool
+    _leases: LeaseStore
+
+    def __init__(self, source: RunnerEventSource) -> None:
+        """
+        Create a new capacity manager.
+
+        Args:
+            source: The provider to read the runner events from.
+        """
+        self._source = source
+        self._runners: dict[str, RunnerRecord] = {}
+        self._exited: deque[str] = deque(maxlen=64)
+        self._missing: set[str] = set()
+        self._listing_exits: set[str] | None = None
+        self._reserved = 0
+        self._reserved_classes: Counter[str] = Counter()
+        self._reserved_owners: Counter[str] = Counter()
+        self._pending: set[str] = set()
+        self._background: set[asyncio.Task[None]] = set()
+        self._scheduler = FairShareScheduler()
+        self._resources: dict[str, tuple[float, int]] = {}
+        self._start_listeners: list[Callable[[RunnerRecord], None]] = []
+        self._exit_listeners: list[Callable[[str], None]] = []
+        self._stream: Any = None
+        self._task: asyncio.Task[None] | None = None
+        self._reconciler: asyncio.Task[None] | None = None
+        self._renewer: asyncio.Task[None] | None = None
+        self.cpus = None
+        self.memory = None
+        self.is_enabled = False
+
+    @property
+    def available(self) -> int:
+        """Get the number of runner slots that are currently free."""
+        return self.max_runners - len(self._runners) - self._reserved
+
+    @property
+    def live(self) -> int:
+        """Get the number of runners that are currently running."""
+        return len(self._runners)
+
+    @property
+    def runners(self) -> list[RunnerRecord]:
+        """Get the records of the runners that are currently running."""
+        return list(self._runners.values())
+
+    def count(self, runner_class: str) -> int:
+        """
+        Count the live and reserved runners of a runner class.
+
+        Args:
+            runner_class: The name of the runner class.
+
+        Returns:
+            The number of runners.
+        """
+        live = sum(
+            1
+            for record in self._runners.values()
+            if record.runner_class == runner_class
+        )
+
+        return live + self._reserved_classes[runner_class]
+
+    def owner_usage(self) -> Counter[str]:
+        """
+        Count the live and reserved runners of each owner.
+
+        Returns:
+            The number of runners of each owner.
+        """
+        owners = Counter(
+            record.owner for record in self._runners.values() if record.owner
+        )
+
+        return owners + self._reserved_owners
+
+    def usage(self) -> tuple[float, int]:
+        """
+        Get the resources reserved by the live and reserved runners.
+
+        Returns:
+            The number of CPUs and the bytes of memory.
+        """
+        cpus, memory = 0.0, 0
+
+        names = [record.runner_class for record in self._runners.values()]
+
+        for name in [*names, *self._reserved_classes.elements()]:
+            runner_cpus, runner_memory = self._resources.get(name, (0.0, 0))
+            cpus += runner_cpus
+            memory += runner_memory
+
+        return cpus, memory
+
+    def _fits(self, runner_class: RunnerClass) -> bool:
+        """
+        Check whether a runner of a class can be started now.
+
+        Args:
+            runner_class: The runner class.
+
+        Returns:
+            True if there is a free slot for the runner.
+        """
+        if self.available <= 0:
+            return False
+
+        if (
+            runner_class.max_runners is not None
+            and self.count(runner_class.name) >= runner_class.max_runners
+        ):
+            return False
+
+        cpus, memory = resource_requests(runner_class)
+
+        if cpus or memory:
+            used_cpus, used_memory = self.usage()
+
+            if self.cpus is not None and used_cpus + cpus > self.cpus:
+                return False
+
+            if self.memory is not None and used_memory + memory > self.memory:
+                return False
+
+        # The totals can fit a runner that none of the hosts has room for
+        return self._source.can_place(runner_class, self._reserved_classes)
+
+    def is_live(self, runner_id: str) -> bool:
+        """
+        Check whether a runner is currently running.
+
+        Args:
+            runner_id: The id of the runner.
+
+        Returns:
+            True if the runner is running.
+        """
+        return runner_id in self._runners
+
+    def add_start_listener(self, listener: Callable[[RunnerRecord], None]) -> None:
+        """
+        Register a callback for when a runner is seen running.
+
+        The callback is called for the runners that start, and for the
+        runners that are found on the hosts, such as the runners that were
+        started before a restart, or by another process.
+
+        Args:
+            listener: The callback, called with the record of the runner.
+        """
+        self._start_listeners.append(listener)
+
+    def add_exit_listener(self, listener: Callable[[str], None]) -> None:
+        """
+        Register a callback for when a runner exits.
+
+        Args:
+            listener: The callback, called with the id of the runner.
+        """
+        self._exit_listeners.append(listener)
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Initialize the manager.
+
+        Args:
+            settings: The settings to use for the manager.
+        """
+        self.max_runners = settings.runner.max_runners
+        self.resubscribe_interval = settings.runner.scale_polling_interval
+        self.reconcile_interval = settings.runner.reconcile_interval
+        self.lease_timeout = settings.lease.timeout
+        self.lease_retry_interval = settings.lease.retry_interval
+        self.is_enabled = settings.docker.enabled
+        self._resources = {
+            runner_class.name: resource_requests(runner_class)
+            for runner_class in load_runner_classes(settings)
+        }
+        self._scheduler.configure(settings.runner.owner_shares)
+        self._leases = create_lease_store(settings.lease, "runners")
+
+    async def start(self) -> None:
+        """Start following the runner events in the background."""
+        if not self.is_enabled:
+            logger.debug("Capacity manager disabled")
+            return
+
+        self._task = asyncio.create_task(self._watch())
+        self._renewer = asyncio.create_task(self._renew_leases())
+
+        if self.reconcile_interval > 0:
+            self._reconciler = asyncio.create_task(self._reconcile_periodically())
+
+    async def close(self) -> None:
+        """Stop following the runner events."""
+        if self._stream is not None:
+            self._stream.close()
+
+        for task in (self._task, self._reconciler, self._renewer):
+            if task is not None:
+                task.cancel()
+
+        # Let the lease releases and hand-overs in flight finish, so that
+        # no slot stays taken until its lease expires.
+        await asyncio.gather(*self._background, return_exceptions=True)
+        await self._leases.close()
+
+    async def acquire(
+        self,
+        runner_class: RunnerClass,
+        owner: str,
+        timeout: float | None = None,
+        priority: JobPriority = JobPriority.NORMAL,
+    ) -> str | None:
+        """
+        Wait for a free runner slot and reserve it.
+
+        The reservation is held until it is either confirmed with the id
+        of the started runner, or released.
+
+        Args:
+            runner_class: The class of the runner to start.
+            owner: The org or user that the runner is for.
+            timeout: The maximum time, in seconds, to wait for a slot.
+            priority: How urgently the runner is needed.
+
+        Returns:
+            The id of the lease of the slot, to confirm or release it with,
+            or None if the wait timed out.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        while True:
+            if not await self._wait_turn(runner_class, owner, priority, deadline):
+                return None
+
+            try:
+                lease_id = await self._leases.reserve(
+                    self.max_runners,
+                    self.lease_timeout,
+                )
+            except BaseException:
+                self._unreserve(runner_class, owner)
+                raise
+
+            if lease_id is not None:
+                self._pending.add(lease_id)
+                return lease_id
+
+            # Another process leased the slot first
+            self._unreserve(runner_class, owner)
+
+            if deadline is not None and loop.time() >= deadline:
+                return None
+
+            await asyncio.sleep(
+                self.lease_retry_interval
+                if deadline is None
+                else min(self.lease_retry_interval, deadline - loop.time())
+            )
+
+    async def _wait_turn(
+        self,
+        runner_class: RunnerClass,
+        owner: str,
+        priority: JobPriority,
+        deadline: float | None,
+    ) -> bool:
+        """
+        Wait until this process has a free slot for the caller.
+
+        Args:
+            runner_class: The class of the runner to start.
+            owner: The org or user that the runner is for.
+            priority: How urgently the runner is needed.
+            deadline: The event loop time at which to stop waiting, or
+                None to wait until there is a slot.
+
+        Returns:
+            True if a slot was reserved locally, False if the wait timed out.
+        """
+        # Serve the jobs that are already waiting first
+        self._wake()
+
+        # A job that waited in the queue past its timeout doesn't get a slot
+        if deadline is not None and deadline <= asyncio.get_running_loop().time():
+            return False
+
+        if self._fits(runner_class) and not self._scheduler.is_capped(
+            owner, self.owner_usage()[owner]
+        ):
+            self._reserve(runner_class, owner)
+            return True
+
+        waiter = self._scheduler.add(owner, runner_class, priority, deadline)
+
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self._unreserve(runner_class, owner)
+            raise
+
+    def confirm(
+        self,
+        lease_id: str,
+        runner_id: str,
+        runner_class: RunnerClass,
+        owner: str,
+        repo: str | None = None,
+    ) -> None:
+        """
+        Turn a reservation into a live runner.
+
+        The lease of the reservation is handed over to the runner, and held
+        until the runner exits.
+
+        Args:
+            lease_id: The id of the lease of the reservation.
+            runner_id: The id of the runner that was started.
+            runner_class: The class of the runner.
+            owner: The org or user that the runner is for.
+            repo: The repo that the runner is for, if any.
+        """
+        self._pending.discard(lease_id)
+        self._reserved -= 1
+        self._reserved_classes[runner_class.name] -= 1
+        self._reserved_owners[owner] -= 1
+
+        # The runner may have already exited before it could be confirmed
+        if runner_id in self._exited:
+            self._release_lease(lease_id)
+            self._wake()
+            return
+
+        self._runners.setdefault(
+            runner_id,
+            RunnerRecord(
+                id=runner_id,
+                owner=owner,
+                repo=repo,
+                runner_class=runner_class.name,
+                state=RunnerState.STARTING,
+            ),
+        )
+        self._run_in_background(
+            self._hand_over_lease(lease_id, runner_id),
+            f"hand lease {lease_id} over to runner {runner_id}",
+        )
+
+    def release(self, lease_id: str, runner_class: RunnerClass, owner: str) -> None:
+        """
+        Give back a reservation that was not used to start a runner.
+
+        Args:
+            lease_id: The id of the lease of the reservation.
+            runner_class: The class of the runner that was not started.
+            owner: The org or user that the runner was for.
+        """
+        self._pending.discard(lease_id)
+        self._release_lease(lease_id)
+        self._unreserve(runner_class, owner)
+
+    def _reserve(self, runner_class: RunnerClass, owner: str) -> None:
+        """Take a local reservation for a runner of a class and owner."""
+        self._reserved += 1
+        self._reserved_classes[runner_class.name] += 1
+        self._reserved_owners[owner] += 1
+
+    def _unreserve(self, runner_class: RunnerClass, owner: str) -> None:
+        """Give back a local reservation that holds no lease."""
+        self._reserved -= 1
+        self._reserved_classes[runner_class.name] -= 1
+        self._reserved_owners[owner] -= 1
+        self._wake()
+
+    def _run_in_background(
+        self,
+        coroutine: Coroutine[Any, Any, None],
+        action: str,
+    ) -> None:
+        """
+        Run a call to the lease store in the background, logging failures.
+
+        Args:
+            coroutine: The call.
+            action: What the call does, for the log.
+        """
+
+        async def run() -> None:
+            try:
+                await coroutine
+            except Exception as e:
+                logger.error(f"Failed to {action}: {e}")
+
+        task = asyncio.create_task(run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _release_lease(self, lease_id: str) -> None:
+        """
+        Give back a lease in the background.
+
+        Args:
+            lease_id: The id of the lease.
+        """
+        self._run_in_background(
+            self._leases.release(lease_id),
+            f"release lease {lease_id}",
+        )
+
+    def _hold_leases(self, runner_ids: list[str]) -> None:
+        """
+        Take or renew the leases of runners in the background.
+
+        Args:
+            runner_ids: The ids of the runners.
+        """
+        if runner_ids:
+            self._run_in_background(
+                self._leases.hold(runner_ids, self.lease_timeout),
+                f"hold the leases of {len(runner_ids)} runners",
+            )
+
+    async def _hand_over_lease(self, lease_id: str, runner_id: str) -> None:
+        """
+        Move the lease of a reservation to the runner that was started.
+
+        Args:
+            lease_id: The id of the lease of the reservation.
+            runner_id: The id of the runner.
+        """
+        await self._leases.hold([runner_id], self.lease_timeout)
+        await self._leases.release(lease_id)
+
+        # The runner may have exited while its lease was being taken
+        if runner_id not in self._runners:
+            await self._leases.release(runner_id)
+
+    async def _renew_leases(self) -> None:
+        """Keep renewing the leases of the reservations and live runners."""
+        while True:
+            await asyncio.sleep(self.lease_timeout / 3)
+
+            try:
+                await self._leases.hold(
+                    [*self._pending, *self._runners],
+                    self.lease_timeout,
+                )
+            except Exception as e:
+                logger.error(f"Failed to renew the runner leases: {e}")
+
+    def _wake(self) -> None:
+        """Hand out the free slots to the waiting jobs that fit, fairly."""
+        usage = self.owner_usage()
+
+        while self.available > 0:
+            job = self._scheduler.pop(usage, self._fits)
+
+            if job is None:
+                return
+
+            owner, runner_class = job
+            self._reserve(runner_class, owner)
+            usage[owner] += 1
+
+    def _handle_event(self, event: dict[str, Any]) -> None:
+        """
+        Update the live runners from a container event.
+
+        Args:
+            event: The decoded docker event.
+        """
+        runner_id = event["Actor"]["ID"]
+
+        if event["Action"] == "start":
+            self._track(
+                runner_record(
+                    runner_id,
+                    event["Actor"].get("Attributes", {}),
+                    event.get("time"),
+                )
+            )
+            self._missing.discard(runner_id)
+            return
+
+        if self._listing_exits is not None:
+            self._listing_exits.add(runner_id)
+
+        self._exit(runner_id)
+
+    def _track(self, record: RunnerRecord) -> None:
+        """
+        Track a runner that is running, and tell the start listeners.
+
+        Args:
+            record: The record of the runner.
+        """
+        self._runners[record.id] = record
+
+        for listener in self._start_listeners:
+            listener(record)
+
+    def _exit(self, runner_id: str) -> None:
+        """
+        Forget a runner that exited, and hand its slot out.
+
+        Every process that sees the runner exit gives back its lease, so the
+        lease goes even if the process that started the runner is gone.
+
+        Args:
+            runner_id: The id of the runner.
+        """
+        self._release_lease(runner_id)
+
+        if self._runners.pop(runner_id, None) is not None:
+            logger.debug(f"Runner {runner_id} exited, {self.available} slots free")
+            self._wake()
+        else:
+            self._exited.append(runner_id)
+
+        for listener in self._exit_listeners:
+            listener(runner_id)
+
+    async def _resync(self) -> None:
+        """
+        Reset the live runners and the host resources from the provider.
+
+        The runners on the hosts are leased, in case they were started
+        before a restart, and the runners that exited while the events
+        were not followed are forgotten. Runners that are still starting
+        are kept, as they may have started after the listing.
+        """
+        self.cpus, self.memory = await self._source.allocatable_resources()
+
+        listed = await self._source.list_runner_records()
+        previous, self._runners = self._runners, {}
+        self._missing.clear()
+        self._hold_leases(list(listed))
+
+        for record in listed.values():
+            self._track(record)
+
+        for runner_id, record in previous.items():
+            if runner_id in listed:
+                continue
+
+            if record.state == RunnerState.STARTING:
+                self._runners[runner_id] = record
+            else:
+                self._exit(runner_id)
+
+        logger.debug(
+            f"Tracking {len(self._runners)} live runners on hosts with "
+            f"{self.cpus} CPUs and {self.memory} bytes of memory to spare"
+        )
+        self._wake()
+
+    async def _reconcile(self) -> None:
+        """
+        Check the tracked runners against the runners on the hosts.
+
+        Runners on the hosts that aren't tracked are added. Tracked runners
+        are only dropped once two listings in a row have missed them, as a
+        runner that has just started may not be in a listing that was
+        already under way.
+        """
+        self._listing_exits = set()
+
+        try:
+            listed = await self._source.list_runner_records()
+        finally:
+            exited, self._listing_exits = self._listing_exits, None
+
+        untracked: list[str] = []
+
+        for runner_id, record in listed.items():
+            if runner_id in exited:
+                continue
+
+            tracked = self._runners.get(runner_id)
+
+            if tracked is None:
+                logger.warning(f"Tracking runner {runner_id} that was never seen")
+                self._track(record)
+                untracked.append(runner_id)
+            elif tracked.state == RunnerState.STARTING:
+                self._runners[runner_id] = record
+
+        self._hold_leases(untracked)
+
+        missing = self._runners.keys() - listed.keys()
+
+        for runner_id in missing & self._missing:
+            logger.warning(f"Runner {runner_id} is gone without an exit event")
+            self._exit(runner_id)
+
+        self._missing = missing - self._missing
+        self._wake()
+
+    async def _reconcile_periodically(self) -> None:
+        """Reconcile the tracked runners with the hosts at an interval."""
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+
+            try:
+                await self._reconcile()
+            except Exception as e:
+                logger.error(f"Failed to reconcile the runners: {e}")
+
+    def _consume(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Forward the events from the stream to the event loop.
+
+        This blocks until the stream is closed, so it must run in a thread.
+
+        Args:
+            loop: The event loop to forward the events to.
+        """
+        for event in self._stream:
+            loop.call_soon_threadsafe(self._handle_event, event)
+
+    async def _watch(self) -> None:
+        """Follow the runner events, resubscribing if the stream drops."""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                # Subscribe before listing so that no event can be missed
+                self._stream = await self._source.runner_events()
+                await self._resync()
+                await asyncio.to_thread(self._consume, loop)
+            except Exception as e:
+                logger.error(f"Lost the docker events stream: {e}")
+
+            await asyncio.sleep(self.resubscribe_interval)
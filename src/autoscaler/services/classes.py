@@ -0,0 +1,165 @@
+"""A module for routing jobs to runner classes by their labels."""
+
+from typing import Iterable
+
+from docker.utils import parse_bytes
+from loguru import logger
+
+from autoscaler.config import (
+    RunnerClass,
+    Settings,
+)
+
+DEFAULT_CLASS = "default"
+DEFAULT_LABELS = ("self-hosted", "linux", "x64")
+
+
+def load_runner_classes(settings: Settings) -> list[RunnerClass]:
+    """
+    Get the configured runner classes, cheapest first.
+
+    The ``default`` class runs the docker runner image, unless a class
+    with that name is configured.
+
+    Args:
+        settings: The settings of the app.
+
+    Returns:
+        The runner classes.
+    """
+    classes = {
+        DEFAULT_CLASS: RunnerClass(
+            name=DEFAULT_CLASS,
+            image=settings.docker.runner_image,
+            tag=settings.docker.runner_tag,
+            dockerfile=(
+                settings.docker.runner_dockerfile
+                if settings.docker.build_image
+                else None
+            ),
+        ),
+    }
+
+    for runner_class in settings.runner.classes:
+        classes[runner_class.name] = runner_class
+
+    # Ties go to the class with the fewest labels, which is the closest fit
+    return sorted(
+        classes.values(),
+        key=lambda runner_class: (runner_class.cost, len(runner_class.labels)),
+    )
+
+
+def resource_requests(runner_class: RunnerClass) -> tuple[float, int]:
+    """
+    Get the resources that a runner of a class reserves on its host.
+
+    Args:
+        runner_class: The runner class.
+
+    Returns:
+        The number of CPUs and the bytes of memory.
+    """
+    return (
+        runner_class.cpus or 0.0,
+        0 if runner_class.memory is None else parse_bytes(runner_class.memory),
+    )
+
+
+class RunnerClassRegistry:
+    """
+    Route jobs to the cheapest runner class that can run them.
+
+    A job can run on a runner that has every one of the job's labels. To
+    avoid checking every class for every job, the registry keeps an index
+    of the classes that have each label, as bitmasks in order of cost, so
+    the classes that can run a job are the intersection of the masks of
+    its labels, and the cheapest one is the lowest set bit.
+    """
+
+    classes: list[RunnerClass]
+
+    def __init__(self) -> None:
+        """Create a new runner class registry."""
+        self.classes = []
+        self._by_name: dict[str, RunnerClass] = {}
+        self._index: dict[str, int] = {}
+        self._all = 0
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Initialize the registry.
+
+        Args:
+            settings: The settings to use for the registry.
+        """
+        self.classes = load_runner_classes(settings)
+        self._by_name = {
+            runner_class.name: runner_class for runner_class in self.classes
+        }
+        self._index = {}
+        self._all = (1 << len(self.classes)) - 1
+
+        for bit, runner_class in enumerate(self.classes):
+            for label in {*DEFAULT_LABELS, *runner_class.labels}:
+                key = label.lower()
+                self._index[key] = self._index.get(key, 0) | 1 << bit
+
+        logger.debug(
+            "Runner classes: "
+            + ", ".join(runner_class.name for runner_class in self.classes)
+        )
+
+    async def start(self) -> None:
+        """Start the registry."""
+
+    async def close(self) -> None:
+        """Close the registry."""
+
+    @property
+    def default(self) -> RunnerClass:
+        """Get the default runner class."""
+        return self._by_name[DEFAULT_CLASS]
+
+    def get(self, name: str) -> RunnerClass:
+        """
+        Get a runner class by name.
+
+        Jobs that were queued for a class that is no longer configured
+        fall back to the default class.
+
+        Args:
+            name: The name of the runner class.
+
+        Returns:
+            The runner class.
+        """
+        runner_class = self._by_name.get(name)
+
+        if runner_class is None:
+            logger.warning(f"Unknown runner class {name}, using the default")
+            return self.default
+
+        return runner_class
+
+    def match(self, labels: Iterable[str]) -> RunnerClass | None:
+        """
+        Find the cheapest runner class that can run a job.
+
+        Labels are matched case-insensitively, as they are by Github.
+
+        Args:
+            labels: The labels of the job.
+
+        Returns:
+            The runner class, or None if no class has all of the labels.
+        """
+        mask = self._all
+
+        for label in labels:
+            mask &= self._index.get(label.lower(), 0)
+
+            if not mask:
+                return None
+
+        return self.classes[(mask & -mask).bit_length() - 1]
@@ -1,30 +1,181 @@
 """A module for interacting with the docker client."""
 
+import asyncio
+import fcntl
+import hashlib
+import os
+import secrets
+import tempfile
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 import docker  # pyright: reportMissingTypeStubs=false
 
-from docker.errors import BuildError
+from docker.errors import (
+    BuildError,
+    DockerException,
+    NotFound,
+)
 
 from docker.models.containers import Container
 from docker.models.images import Image
+from docker.utils.build import exclude_paths
 
 from loguru import logger
 
+from autoscaler import metrics
 from autoscaler.config import (
     Settings,
+    RunnerClass,
     RunnerSettings,
 )
+from autoscaler.models import RunnerRecord
+from autoscaler.services.classes import DEFAULT_CLASS
 
 from typing import (
     cast,
     Any,
+    Callable,
+    Iterator,
+    TypeVar,
 )
 
+T = TypeVar("T")
+
+INSTANCE_LABEL = "autoscaler.instance"
+OWNER_LABEL = "autoscaler.owner"
+REPO_LABEL = "autoscaler.repo"
+IMAGE_LABEL = "autoscaler.image"
+CLASS_LABEL = "autoscaler.class"
+BUILD_HASH_LABEL = "autoscaler.build-hash"
+NAME_LABEL = "autoscaler.name"
+WARM_LABEL = "autoscaler.warm"
+
+
+def runner_name_prefix(instance_name: str) -> str:
+    """
+    Get the start of the names that an autoscaler registers runners under.
+
+    Args:
+        instance_name: The name of the autoscaler.
+
+    Returns:
+        The prefix of the names of the runners.
+    """
+    return f"{instance_name}-"
+
+
+def runner_record(
+    runner_id: str,
+    labels: dict[str, str],
+    started_at: float | None = None,
+) -> RunnerRecord:
+    """
+    Describe a runner from the labels of its container.
+
+    Args:
+        runner_id: The id of the container.
+        labels: The labels of the container.
+        started_at: The time, as a UNIX timestamp, at which the container
+            was started, or None if it was just started.
+
+    Returns:
+        The record of the runner.
+    """
+    record = RunnerRecord(
+        id=runner_id,
+        owner=labels.get(OWNER_LABEL) or None,
+        repo=labels.get(REPO_LABEL) or None,
+        runner_class=labels.get(CLASS_LABEL, DEFAULT_CLASS),
+        name=labels.get(NAME_LABEL) or None,
+        warm=labels.get(WARM_LABEL) == "true",
+    )
+
+    if started_at is not None:
+        record.started_at = started_at
+
+    return record
+
+
+def hash_build_context(path: str, dockerfile: str) -> str:
+    """
+    Hash the files of a build context and its dockerfile.
+
+    Only the files that docker would send to the daemon are hashed, so the
+    files left out by the ``.dockerignore`` file don't change the hash.
+
+    Args:
+        path: The path to the build context.
+        dockerfile: The path to the dockerfile, in the build context.
+
+    Returns:
+        The hex digest of the build context.
+    """
+    patterns: list[str] = []
+    ignore_file = os.path.join(path, ".dockerignore")
+
+    if os.path.exists(ignore_file):
+        with open(ignore_file) as f:
+            patterns = [
+                line.strip()
+                for line in f.read().splitlines()
+                if line.strip() and not line.strip().startswith("#")
+            ]
+
+    digest = hashlib.sha256()
+
+    for name in sorted(exclude_paths(path, patterns, dockerfile=dockerfile)):
+        full_path = os.path.join(path, name)
+        digest.update(name.encode() + b"\0")
+
+        if os.path.islink(full_path):
+            digest.update(os.readlink(full_path).encode())
+        elif os.path.isfile(full_path):
+            digest.update(oct(os.stat(full_path).st_mode).encode())
+
+            with open(full_path, "rb") as f:
+                for chunk in iter(partial(f.read, 1 << 20), b""):
+                    digest.update(chunk)
+
+    # The dockerfile may be outside of the build context
+    with open(os.path.join(path, dockerfile), "rb") as f:
+        digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+@contextmanager
+def build_lock(build_hash: str) -> Iterator[None]:
+    """
+    Hold a lock on a build, shared by every process on the machine.
+
+    Args:
+        build_hash: The hash of the build context.
+    """
+    lock_path = os.path.join(
+        tempfile.gettempdir(),
+        f"autoscaler-build-{build_hash[:16]}.lock",
+    )
+
+    with open(lock_path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
 
 class DockerClient:
     """A class for interacting with the docker client."""
 
     _client: docker.DockerClient
-    image: Image
+    _executor: ThreadPoolExecutor | None
+    images: dict[str, Image]
+    instance_name: str
     settings: RunnerSettings
     is_enabled: bool
 
@@ -45,6 +196,7 @@ class DockerClient:
         self._client = (
             client or docker.from_env()
         )  # pyright: reportUnknownMemberType=false,reportUnknownVariableType=false
+        self._executor = None
 
         if settings is not None:
             self.initialize(settings)
@@ -57,57 +209,157 @@ class DockerClient:
             settings: The settings to use for the client.
         """
         self.is_enabled = settings.docker.enabled
+        self.instance_name = settings.docker.instance_name
         self.settings = settings.runner
+        self.images = {}
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.docker.max_workers,
+            thread_name_prefix="docker",
+        )
 
         if not self.is_enabled:
             logger.debug("Docker client disabled")
             return
 
-        if settings.docker.build_image:
+        logger.debug("Docker client initialized")
+
+    async def update_image(
+        self,
+        runner_class: RunnerClass,
+        *,
+        path: str,
+        no_cache: bool = False,
+    ) -> bool:
+        """
+        Build or pull the image of a runner class, and switch to it.
+
+        New runners keep using the previous image until the new one is on
+        the host. The image is prepared in a thread of its own, rather than
+        in the client's thread pool, so that a long build or pull doesn't
+        hold up starting runners.
+
+        Args:
+            runner_class: The runner class.
+            path: The path to the build context of the image.
+            no_cache: Whether to build the image without the cache.
+
+        Returns:
+            True if the runner class has a new image.
+        """
+        image = await asyncio.to_thread(
+            self.prepare_image,
+            runner_class,
+            path=path,
+            no_cache=no_cache,
+        )
+        current = self.images.get(runner_class.name)
+
+        if current is not None and current.id == image.id:
+            return False
+
+        self.images[runner_class.name] = image
+        logger.info(
+            f"Runner class {runner_class.name} now uses image {image.id} "
+            f"({', '.join(image.attrs.get('RepoDigests') or image.tags)})"
+        )
+
+        return True
+
+    def prepare_image(
+        self,
+        runner_class: RunnerClass,
+        *,
+        path: str,
+        no_cache: bool = False,
+    ) -> Image:
+        """
+        Build or pull the image of a runner class.
+
+        Args:
+            runner_class: The runner class.
+            path: The path to the build context of the image.
+            no_cache: Whether to build the image without the cache.
+
+        Returns:
+            The image.
+        """
+        if runner_class.dockerfile is not None:
             logger.debug(
-                "Building runner image "
-                f"{settings.docker.runner_image}:{settings.docker.runner_tag}"
-                f" from {settings.docker.runner_dockerfile} in "
-                f"{settings.docker.build_path}"
+                f"Building {runner_class.name} runner image "
+                f"{runner_class.image}:{runner_class.tag}"
+                f" from {runner_class.dockerfile} in {path}"
             )
-            self.build_image(
-                path=settings.docker.build_path,
-                dockerfile=settings.docker.runner_dockerfile,
-                image=settings.docker.runner_image,
-                tag=settings.docker.runner_tag,
-                no_cache=settings.docker.no_cache,
+            image = self.build_image(
+                path=path,
+                dockerfile=runner_class.dockerfile,
+                image=runner_class.image,
+                tag=runner_class.tag,
+                no_cache=no_cache,
             )
         else:
             logger.debug(
-                "Pulling runner image "
-                f"{settings.docker.runner_image}:{settings.docker.runner_tag}"
-            )
-            self.pull_image(
-                image=settings.docker.runner_image,
-                tag=settings.docker.runner_tag,
+                f"Pulling {runner_class.name} runner image "
+                f"{runner_class.image}:{runner_class.tag}"
             )
+            image = self.pull_image(image=runner_class.image, tag=runner_class.tag)
 
-        logger.debug("Docker client initialized")
-        logger.debug(f"Runner image ID: {self.image.id}")
-        logger.debug(f"Runner image tags: {self.image.tags}")
+        logger.debug(f"Runner image ID: {image.id}")
+        logger.debug(f"Runner image tags: {image.tags}")
+
+        return image
+
+    async def start(self) -> None:
+        """Start the client."""
 
     async def close(self) -> None:
         """Close the client."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
         self._client.close()
 
-    def pull_image(self, *, image: str, tag: str = "latest") -> None:
+    def pull_image(self, *, image: str, tag: str = "latest") -> Image:
         """
         Pull an image.
 
+        The progress of every layer is logged as the pull goes on.
+
         Args:
             image: The name of the image.
+            tag: The tag of the image.
+
+        Returns:
+            The image that was pulled.
 
         Raises:
             `docker.errors.APIError`: If the image could not be pulled.
         """
-        self.image = cast(
+        layers: dict[str, str] = {}
+
+        for progress in self._client.api.pull(image, tag=tag, stream=True, decode=True):
+            if "error" in progress:
+                raise DockerException(
+                    f"Failed to pull {image}:{tag}: {progress['error']}"
+                )
+
+            layer = progress.get("id", "")
+            status = progress.get("status", "")
+
+            # Only log when a layer moves on, rather than every chunk
+            if layers.get(layer) != status:
+                layers[layer] = status
+                logger.debug(
+                    " ".join(part for part in (f"{image}:{tag}", layer, status) if part)
+                )
+
+        return cast(
             Image,
-            self._client.images.pull(image, tag=tag),
+            self._client.images.get(f"{image}:{tag}"),
         )
 
     def build_image(
@@ -118,84 +370,362 @@ class DockerClient:
         image: str,
         tag: str = "latest",
         no_cache: bool = False,
-    ) -> None:
+    ) -> Image:
         """
-        Build an image.
+        Build an image, unless it was already built from the same context.
+
+        Images are labelled with the hash of their build context, so that
+        an image built from the same files is reused instead of rebuilt.
+        The build is locked, so that when several workers start at once,
+        only one of them builds the image and the others reuse it.
 
         Args:
+            path: The path to the build context.
             dockerfile: The path to the dockerfile.
             image: The name of the image.
+            tag: The tag of the image.
+            no_cache: Whether to build the image without the cache, even if
+                it was already built.
 
         Returns:
             The image that was built.
         """
+        build_hash = hash_build_context(path, dockerfile)
+
+        if no_cache:
+            return self._build_image(
+                path=path,
+                dockerfile=dockerfile,
+                image=image,
+                tag=tag,
+                build_hash=build_hash,
+                no_cache=True,
+            )
+
+        with build_lock(build_hash):
+            cached = cast(
+                list[Image],
+                self._client.images.list(
+                    filters={"label": f"{BUILD_HASH_LABEL}={build_hash}"},
+                ),
+            )
+
+            if cached:
+                logger.debug(
+                    f"Reusing image {cached[0].id} for {image}:{tag}, "
+                    f"built from the same context ({build_hash[:12]})"
+                )
+                cached[0].tag(image, tag=tag)
+
+                return cached[0]
+
+            return self._build_image(
+                path=path,
+                dockerfile=dockerfile,
+                image=image,
+                tag=tag,
+                build_hash=build_hash,
+            )
+
+    def _build_image(
+        self,
+        *,
+        path: str,
+        dockerfile: str,
+        image: str,
+        tag: str,
+        build_hash: str,
+        no_cache: bool = False,
+    ) -> Image:
+        """Build an image labelled with the hash of its build context."""
         try:
-            self.image, logs = cast(
+            built, logs = cast(
                 tuple[Image, Any],
                 self._client.images.build(
                     path=path,
                     dockerfile=dockerfile,
                     tag=f"{image}:{tag}",
                     nocache=no_cache,
+                    labels={BUILD_HASH_LABEL: build_hash},
                 ),
             )
             for log in logs:
                 logger.debug(log.get("stream", "").strip())
+
+            return built
         except BuildError as error:
             for log in error.build_log:
                 logger.error(log)  # pyright: reportUnknownArgumentType=false
 
             raise
 
-    def list_runners(self) -> list[Container]:
+    async def _run(
+        self,
+        func: Callable[..., T],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        """
+        Run a blocking docker call in the client's thread pool.
+
+        The docker library is synchronous, so every call that talks to the
+        docker daemon is run in a bounded pool of threads to avoid stalling
+        the event loop.
+
+        Args:
+            func: The blocking function to call.
+            args: The positional arguments for the function.
+            kwargs: The keyword arguments for the function.
+
+        Returns:
+            The result of the function.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            partial(func, *args, **kwargs),
+        )
+
+    @property
+    def _runner_filters(self) -> dict[str, Any]:
+        """Get the filters that match the runners of this autoscaler."""
+        return {"label": [f"{INSTANCE_LABEL}={self.instance_name}"]}
+
+    def _list_runners(self) -> list[Container]:
+        """List the runners, blocking until the docker daemon responds."""
+        return cast(
+            list[Container],
+            self._client.containers.list(
+                sparse=True,
+                filters=self._runner_filters,
+            ),
+        )
+
+    async def list_runners(self) -> list[Container]:
         """
         List the runners.
 
+        Runners are found with a label filter on the docker daemon, so
+        this is a single API call regardless of the number of unrelated
+        containers on the host. The containers are sparse, so only the
+        attributes returned by the list call are available.
+
         Returns:
             A list of the runners.
         """
-        containers = cast(list[Container], self._client.containers.list())
+        return await self._run(self._list_runners)
+
+    async def list_runner_ids(self) -> list[str]:
+        """
+        List the ids of the runners.
 
-        return [
-            container
-            for container in containers
-            if cast(Image, container.image).id == self.image.id
-        ]
+        Returns:
+            A list of the container ids of the runners.
+        """
+        return [cast(str, container.id) for container in await self.list_runners()]
 
-    def start_runner(self, *, url: str, token: str) -> None:
+    async def ping(self) -> None:
         """
-        Start a new runner.
+        Check that the docker daemon is reachable.
 
-        Args:
-            url: The URL of the runner.
-            token: The registration token for the runner.
+        Raises:
+            `docker.errors.APIError`: If the daemon returned an error.
+        """
+        await self._run(self._client.ping)
+
+    async def host_resources(self) -> tuple[float, int]:
+        """
+        Get the resources of the docker host.
 
         Returns:
-            The container that was started.
+            The number of CPUs and the amount of memory, in bytes, of the
+            host, as reported by ``docker info``.
+        """
+        info = await self._run(self._client.info)
+
+        return float(info["NCPU"]), int(info["MemTotal"])
+
+    async def list_runner_records(self) -> dict[str, RunnerRecord]:
         """
+        List the runners with what their labels say about them.
+
+        Returns:
+            A mapping of the container ids of the runners to their records.
+        """
+        return {
+            cast(str, container.id): runner_record(
+                cast(str, container.id),
+                container.attrs["Labels"],
+                container.attrs.get("Created"),
+            )
+            for container in await self.list_runners()
+        }
+
+    async def runner_events(self) -> Iterator[dict[str, Any]]:
+        """
+        Subscribe to the start and die events of the runners.
+
+        The returned stream blocks while waiting for new events, so it
+        should be consumed from a dedicated thread. It can be closed from
+        another thread to stop it.
+
+        Returns:
+            A stream of decoded docker events.
+        """
+        return cast(
+            Iterator[dict[str, Any]],
+            await self._run(
+                self._client.events,
+                decode=True,
+                filters={
+                    "type": "container",
+                    "event": ["start", "die"],
+                    **self._runner_filters,
+                },
+            ),
+        )
+
+    def _start_runner(
+        self,
+        *,
+        url: str,
+        token: str,
+        owner: str,
+        repo: str | None,
+        runner_class: RunnerClass | None,
+        warm: bool,
+    ) -> str:
+        """Start a new runner, blocking until the container is running."""
+        name = DEFAULT_CLASS if runner_class is None else runner_class.name
+        image = self.images[name]
+        # The runner registers under the hostname of its container
+        hostname = runner_name_prefix(self.instance_name) + secrets.token_hex(6)
+        labels = {
+            INSTANCE_LABEL: self.instance_name,
+            OWNER_LABEL: owner,
+            IMAGE_LABEL: cast(str, image.id),
+            CLASS_LABEL: name,
+            NAME_LABEL: hostname,
+        }
+        environment = {
+            "URL": url,
+            "TOKEN": token,
+        }
+        limits: dict[str, Any] = {}
+
+        if repo is not None:
+            labels[REPO_LABEL] = repo
+
+        if warm:
+            labels[WARM_LABEL] = "true"
+
+        if runner_class is not None:
+            if runner_class.labels:
+                environment["LABELS"] = ",".join(runner_class.labels)
+
+            if runner_class.cpus is not None:
+                limits["nano_cpus"] = int(runner_class.cpus * 1e9)
+
+            if runner_class.memory is not None:
+                limits["mem_limit"] = runner_class.memory
+
         container = cast(
             Container,
             self._client.containers.run(
-                self.image,
+                image,
                 remove=True,
                 detach=True,
-                environment={
-                    "URL": url,
-                    "TOKEN": token,
-                },
+                hostname=hostname,
+                labels=labels,
+                environment=environment,
                 volumes=["/var/run/docker.sock:/var/run/docker.sock"],
+                **limits,
             ),
         )
 
         logger.debug(f"Started runner {container.name}")
         logger.debug(f"CID: {container.id}")
-        logger.debug(f"Logs: {container.logs()}")
 
-    def count_runners(self) -> int:
+        return cast(str, container.id)
+
+    async def start_runner(
+        self,
+        *,
+        url: str,
+        token: str,
+        owner: str,
+        repo: str | None = None,
+        runner_class: RunnerClass | None = None,
+        warm: bool = False,
+    ) -> str:
+        """
+        Start a new runner.
+
+        The container is labelled with the autoscaler instance, owner,
+        repo, image and runner class, and whether it is a warm pool
+        runner, so that it can later be found with a label filter. Its
+        hostname, which the runner registers under, is the name of the
+        autoscaler and a random suffix, and is labelled too, so that the
+        runner can be matched with its registration.
+
+        Args:
+            url: The URL of the runner.
+            token: The registration token for the runner.
+            owner: The owner that the runner is registered to.
+            repo: The repo that the runner is registered to, or None if
+                the runner is registered to an org.
+            runner_class: The class of the runner, or None for the
+                default class.
+            warm: Whether the runner is started for a warm pool.
+
+        Returns:
+            The id of the container that was started.
+        """
+        with metrics.container_start_duration.time():
+            return await self._run(
+                self._start_runner,
+                url=url,
+                token=token,
+                owner=owner,
+                repo=repo,
+                runner_class=runner_class,
+                warm=warm,
+            )
+
+    def _remove_runner(self, runner_id: str) -> None:
+        """Kill and remove a runner, blocking until it is removed."""
+        try:
+            self._client.containers.get(runner_id).remove(force=True)
+        except NotFound:
+            logger.debug(f"Runner {runner_id} was already removed")
+
+    async def remove_runner(self, runner_id: str) -> None:
+        """
+        Stop a runner and remove it.
+
+        Args:
+            runner_id: The id of the container of the runner.
+        """
+        await self._run(self._remove_runner, runner_id)
+
+    async def count_runners(self) -> int:
         """
         Count the number of runners.
 
         Returns:
             The number of runners.
         """
-        return len(self.list_runners())
+        return len(await self.list_runners())
+
+    async def count_runners_by_owner(self) -> dict[str, int]:
+        """
+        Count the number of runners for each owner.
+
+        Returns:
+            A mapping of owner to the number of runners for that owner.
+        """
+        return dict(
+            Counter(
+                container.attrs["Labels"].get(OWNER_LABEL, "")
+                for container in await self.list_runners()
+            )
+        )
@@ -0,0 +1,371 @@
+"""A module for predicting job arrivals to start runners ahead of demand."""
+
+import asyncio
+import json
+import math
+import os
+import uuid
+
+from collections import Counter
+from datetime import (
+    datetime,
+    timedelta,
+)
+from typing import Any
+
+from loguru import logger
+
+from autoscaler.config import (
+    PrescaleSettings,
+    Settings,
+)
+from autoscaler.services.classes import RunnerClassRegistry
+from autoscaler.services.leases import (
+    LeaderLease,
+    LeaseStore,
+    create_lease_store,
+)
+from autoscaler.services.pool import WarmPoolManager
+
+HOURS_PER_WEEK = 7 * 24
+
+# Each hour of the week only gets one sample a week, so it learns faster
+SEASONAL_ALPHA = 0.5
+
+# The number of intervals that a job is kept for if nobody counts it
+ARRIVAL_INTERVALS = 3
+
+# The key of a forecast: the owner, repo and runner class of the jobs
+ForecastKey = tuple[str, str | None, str]
+
+
+def hour_of_week(at: datetime) -> int:
+    """
+    Get the hour of the week of a time, from Monday midnight.
+
+    Args:
+        at: The time.
+
+    Returns:
+        The hour of the week.
+    """
+    return at.weekday() * 24 + at.hour
+
+
+class ArrivalModel:
+    """
+    A model of the rate at which jobs arrive.
+
+    The model keeps an exponentially weighted moving average of the number
+    of jobs per interval, and one for each hour of the week, updated with
+    the mean of the hour once it is over. Both recent bursts and recurring
+    busy hours, like morning pushes or nightly builds, are predicted.
+
+    Attributes:
+        alpha: The smoothing factor of the recent moving average.
+        level: The average number of jobs per interval.
+        seasonal: The average number of jobs per interval, for each hour
+            of the week.
+    """
+
+    def __init__(self, alpha: float) -> None:
+        """
+        Create a new, empty model.
+
+        Args:
+            alpha: The smoothing factor of the moving averages.
+        """
+        self.alpha = alpha
+        self.level = 0.0
+        self.seasonal = [0.0] * HOURS_PER_WEEK
+        self._hour: int | None = None
+        self._hour_jobs = 0
+        self._hour_intervals = 0
+
+    def observe(self, jobs: int, at: datetime) -> None:
+        """
+        Record the number of jobs that arrived in an interval.
+
+        Args:
+            jobs: The number of jobs.
+            at: The time of the interval.
+        """
+        hour = hour_of_week(at)
+        self.level += self.alpha * (jobs - self.level)
+
+        if self._hour is not None and hour != self._hour:
+            mean = self._hour_jobs / self._hour_intervals
+            seasonal = self.seasonal[self._hour]
+            self.seasonal[self._hour] += SEASONAL_ALPHA * (mean - seasonal)
+            self._hour_jobs = self._hour_intervals = 0
+
+        self._hour = hour
+        self._hour_jobs += jobs
+        self._hour_intervals += 1
+
+    def predict(self, at: datetime) -> float:
+        """
+        Predict the number of jobs per interval at a time.
+
+        Args:
+            at: The time.
+
+        Returns:
+            The number of jobs per interval.
+        """
+        return max(self.level, self.seasonal[hour_of_week(at)])
+
+    @property
+    def is_idle(self) -> bool:
+        """Check whether the model no longer predicts any jobs."""
+        return self._hour_jobs == 0 and max(self.level, *self.seasonal) < 0.01
+
+
+class DemandForecaster:
+    """
+    Start runners ahead of the jobs that are predicted to be queued.
+
+    Every queued job is counted by owner or repo and runner class. At
+    every interval the counts are fed to an arrival model, and the warm
+    pool of the owner or repo and class is asked to keep enough idle
+    runners for the jobs predicted over the horizon, within bounds.
+
+    Every process records the jobs it queues as leases of their own in a
+    lease store, which can be shared by several processes. Only the leader
+    process counts and releases them, updates the models, and keeps the
+    arrival history, so the predictions are made from the jobs of every
+    process, and only once.
+    """
+
+    settings: PrescaleSettings
+    max_predicted: int
+    _arrival_leases: LeaseStore
+
+    def __init__(
+        self,
+        warm_pools: WarmPoolManager,
+        runner_classes: RunnerClassRegistry,
+        leader: LeaderLease,
+    ) -> None:
+        """
+        Create a new demand forecaster.
+
+        Args:
+            warm_pools: The warm pools to keep the runners in.
+            runner_classes: The registry of the runner classes.
+            leader: The lease of the process that makes the predictions.
+        """
+        self._warm_pools = warm_pools
+        self._runner_classes = runner_classes
+        self._leader = leader
+        self._models: dict[ForecastKey, ArrivalModel] = {}
+        self._arrivals: Counter[ForecastKey] = Counter()
+        self._task: asyncio.Task[None] | None = None
+        self._is_leading = False
+        self.is_enabled = False
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Initialize the forecaster.
+
+        Args:
+            settings: The settings to use for the forecaster.
+        """
+        self.settings = settings.prescale
+        self.is_enabled = settings.prescale.enabled and settings.docker.enabled
+        self.max_predicted = math.floor(
+            settings.prescale.max_share * settings.runner.max_runners
+        )
+        self._models = {}
+        self._arrivals = Counter()
+        self._is_leading = False
+        self._arrival_leases = create_lease_store(settings.lease, "arrivals")
+
+    async def start(self) -> None:
+        """Start updating the predictions in the background."""
+        if not self.is_enabled:
+            return
+
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop updating the predictions, saving the arrival history."""
+        if self._task is not None:
+            self._task.cancel()
+
+        if self._is_leading and self.settings.state_path is not None:
+            self._save(self.settings.state_path)
+
+        await self._arrival_leases.close()
+
+    async def record(self, owner: str, repo: str | None, runner_class: str) -> None:
+        """
+        Record a queued job, for the leader to count.
+
+        Args:
+            owner: The owner that the runner should be registered to.
+            repo: The repo that the runner should be registered to, or
+                None if the runner should be registered to the org.
+            runner_class: The name of the runner class of the job.
+        """
+        if not self.is_enabled:
+            return
+
+        arrival_id = json.dumps([owner, repo, runner_class, uuid.uuid4().hex])
+
+        try:
+            await self._arrival_leases.take(
+                arrival_id,
+                self.settings.interval * ARRIVAL_INTERVALS,
+            )
+        except Exception as e:
+            logger.error(f"Failed to record a job arrival: {e}")
+
+    async def collect(self) -> None:
+        """Count the jobs recorded by every process since the last time."""
+        for arrival_id in await self._arrival_leases.held():
+            owner, repo, runner_class, _ = json.loads(arrival_id)
+            self._arrivals[(owner, repo, runner_class)] += 1
+            await self._arrival_leases.release(arrival_id)
+
+    def update(self, now: datetime) -> None:
+        """
+        Feed the counted jobs to the models, and update the warm pools.
+
+        Args:
+            now: The current time.
+        """
+        arrivals, self._arrivals = self._arrivals, Counter()
+        ahead = now + timedelta(seconds=self.settings.horizon)
+        intervals = self.settings.horizon / self.settings.interval
+        predicted: dict[ForecastKey, int] = {}
+
+        for key in self._models.keys() | arrivals.keys():
+            model = self._models.setdefault(key, ArrivalModel(self.settings.alpha))
+            model.observe(arrivals[key], now)
+            predicted[key] = min(
+                math.floor(model.predict(ahead) * intervals + 0.5),
+                self.settings.max_runners,
+            )
+
+            if model.is_idle:
+                del self._models[key]
+
+        for key, jobs in self._cap(predicted).items():
+            owner, repo, name = key
+            pool = self._warm_pools.pools.get(key)
+
+            if pool is None and jobs > 0:
+                runner_class = self._runner_classes.get(name)
+                pool = self._warm_pools.get(owner, repo, runner_class)
+
+            if pool is not None:
+                pool.predict(jobs)
+
+    def _cap(self, predicted: dict[ForecastKey, int]) -> dict[ForecastKey, int]:
+        """
+        Scale the predicted jobs down to the share of the runner slots.
+
+        Only the runners that the pools keep on top of their configured
+        size count towards the share, and each pool is scaled down by the
+        same factor.
+
+        Args:
+            predicted: The number of jobs predicted for each pool.
+
+        Returns:
+            The number of jobs to keep idle runners for, for each pool.
+        """
+        pools = self._warm_pools.pools
+        sizes = {key: pools[key].size if key in pools else 0 for key in predicted}
+        extra = sum(max(jobs - sizes[key], 0) for key, jobs in predicted.items())
+
+        if extra <= self.max_predicted:
+            return predicted
+
+        scale = self.max_predicted / extra
+
+        return {
+            key: sizes[key] + math.floor(max(jobs - sizes[key], 0) * scale)
+            for key, jobs in predicted.items()
+        }
+
+    async def _run(self) -> None:
+        """Update the predictions at every interval, while the leader."""
+        while True:
+            await asyncio.sleep(self.settings.interval)
+
+            if not self._leader.is_leader:
+                self._is_leading = False
+                continue
+
+            try:
+                await self._lead()
+            except Exception as e:
+                logger.error(f"Failed to update the demand forecasts: {e}")
+
+    async def _lead(self) -> None:
+        """Count the recorded jobs, update the predictions and save them."""
+        path = self.settings.state_path
+
+        # Pick up from the history that the previous leader saved
+        if not self._is_leading:
+            self._is_leading = True
+            self._models = {}
+
+            if path is not None:
+                await asyncio.to_thread(self._load, path)
+
+        await self.collect()
+        self.update(datetime.now())
+
+        if path is not None:
+            await asyncio.to_thread(self._save, path)
+
+    def _load(self, path: str) -> None:
+        """
+        Load the models from a file, if it exists.
+
+        Args:
+            path: The path of the file.
+        """
+        if not os.path.exists(path):
+            return
+
+        try:
+            with open(path) as f:
+                state: list[dict[str, Any]] = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load the arrival history from {path}: {e}")
+            return
+
+        for entry in state:
+            model = ArrivalModel(self.settings.alpha)
+            model.level = entry["level"]
+            model.seasonal = entry["seasonal"]
+            self._models[(entry["owner"], entry["repo"], entry["class"])] = model
+
+        logger.debug(f"Loaded the arrival history of {len(self._models)} pools")
+
+    def _save(self, path: str) -> None:
+        """
+        Save the models to a file, replacing it at once.
+
+        Args:
+            path: The path of the file.
+        """
+        state = [
+            {
+                "owner": owner,
+                "repo": repo,
+                "class": runner_class,
+                "level": model.level,
+                "seasonal": model.seasonal,
+            }
+            for (owner, repo, runner_class), model in list(self._models.items())
+        ]
+
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state, f)
+
+        os.replace(f"{path}.tmp", path)
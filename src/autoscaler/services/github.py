@@ -1,17 +1,140 @@
 """A module for the github client."""
 
+import asyncio
+import random
+import time
+
+from collections import OrderedDict
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from typing import Any
+
 import httpx
 
-from autoscaler.config import Settings
+from loguru import logger
+
+from autoscaler import metrics
+from autoscaler.config import (
+    GithubSettings,
+    Settings,
+)
 from autoscaler.models import (
+    GithubRunner,
+    RateLimitStatus,
     RegistrationTokenResponse,
+    WorkflowJobAction,
+    WorkflowJobEvent,
 )
+from autoscaler.payloads import parse_timestamp
+
+# Registration tokens are reused until this long before they expire, so
+# that a runner never starts with a token that expires while registering
+TOKEN_EXPIRY_MARGIN = timedelta(minutes=5)
+
+# Runs that are in progress can still have jobs waiting for a runner
+POLLED_RUN_STATUSES = ("queued", "in_progress")
+
+# A cached response: its ETag, decoded body and the URL of the next page
+CachedResponse = tuple[str, Any, str | None]
+
+
+class GithubAPIError(ValueError):
+    """
+    An error returned by the Github API.
+
+    Attributes:
+        status_code: The status code of the response, or None if no
+            response was received.
+    """
+
+    status_code: int | None
+
+    def __init__(self, message: str, status_code: int | None = None) -> None:
+        """
+        Create a new API error.
+
+        Args:
+            message: The error message.
+            status_code: The status code of the response.
+        """
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class GithubRateLimitError(GithubAPIError):
+    """The Github API kept rate limiting the request after all retries."""
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter.
+
+    The bucket is shared by every request to the API, so that concurrent
+    tasks back off together when the API throttles the client, rather than
+    each of them independently retrying against a throttled API.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """
+        Create a new token bucket.
+
+        Args:
+            rate: The number of tokens added to the bucket per second.
+            burst: The maximum number of tokens in the bucket.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop handing out tokens for a while.
+
+        Args:
+            seconds: The number of seconds to pause for.
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        """Wait for a token, in the order in which the tokens were requested."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
 
 
 class GithubClient:
     """A client for interacting with the Github API."""
 
     __client: httpx.AsyncClient | None
+    settings: GithubSettings
+    rate_limit: RateLimitStatus
+    _tokens: dict[tuple[str, str | None], RegistrationTokenResponse]
+    _token_requests: dict[
+        tuple[str, str | None], asyncio.Future[RegistrationTokenResponse]
+    ]
+    _responses: OrderedDict[str, CachedResponse]
 
     def __init__(self, settings: Settings | None = None) -> None:
         """
@@ -25,6 +148,10 @@ class GithubClient:
             settings: The settings to use for the client.
         """
         self.__client = None
+        self.rate_limit = RateLimitStatus()
+        self._tokens = {}
+        self._token_requests = {}
+        self._responses = OrderedDict()
 
         if settings is not None:
             self.initialize(settings)
@@ -37,18 +164,42 @@ class GithubClient:
 
         return self.__client
 
-    def initialize(self, settings: Settings) -> None:
-        """Initialize the client."""
+    def initialize(
+        self,
+        settings: Settings,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        """
+        Initialize the client.
+
+        Args:
+            settings: The settings to use for the client.
+            transport: The transport to send the requests with, or None to
+                send them over the network.
+        """
+        self.settings = settings.github
+        self._limiter = TokenBucket(
+            settings.github.requests_per_second,
+            settings.github.burst,
+        )
         self.__client = httpx.AsyncClient(
             headers={
                 "Authorization": f"token {settings.github_pat}",
                 "Accept": "application/vnd.github.v3+json",
             },
             base_url="https://api.github.com",
+            transport=transport,
         )
 
+    async def start(self) -> None:
+        """Start the client."""
+
     async def create_runner_token(self, owner: str, repo: str | None = None) -> str:
-        """Create a new runner token for a repo.
+        """Get a runner token for a repo.
+
+        Registration tokens can be used for multiple runners, so tokens are
+        cached and reused until shortly before they expire. Concurrent calls
+        for the same repo share a single request to the API.
 
         Args:
             owner: The owner of the repo.
@@ -57,17 +208,423 @@ class GithubClient:
         Returns:
             A registration token for a new runner.
         """
+        key = (owner, repo)
+        cached = self._tokens.get(key)
+
+        if cached is not None and cached.expires_at > (
+            datetime.now(timezone.utc) + TOKEN_EXPIRY_MARGIN
+        ):
+            return cached.token
+
+        request = self._token_requests.get(key)
+
+        if request is None:
+            request = asyncio.ensure_future(self._request_runner_token(owner, repo))
+            self._token_requests[key] = request
+            request.add_done_callback(lambda _: self._token_requests.pop(key))
+
+        # Shielded so that a cancelled caller doesn't fail the other callers
+        return (await asyncio.shield(request)).token
+
+    async def _request_runner_token(
+        self,
+        owner: str,
+        repo: str | None,
+    ) -> RegistrationTokenResponse:
+        """Request a new runner token for a repo from the API.
+
+        Args:
+            owner: The owner of the repo.
+            repo: The name of the repo, or None if the token is for an org.
+
+        Returns:
+            The registration token response.
+        """
         if repo is None:
             suffix = f"/orgs/{owner}/actions/runners/registration-token"
         else:
             suffix = f"/repos/{owner}/{repo}/actions/runners/registration-token"
 
-        res = await self._client.post(suffix)
+        with metrics.token_request_duration.time():
+            res = await self._request("POST", suffix)
 
         if res.status_code >= 300:
-            raise ValueError("Something went wrong in the API call")
+            raise GithubAPIError(
+                f"Failed to create a runner token: {res.status_code}",
+                res.status_code,
+            )
+
+        response = RegistrationTokenResponse.parse_raw(res.content)
+        self._tokens[(owner, repo)] = response
+
+        return response
+
+    async def list_runners(
+        self,
+        owner: str,
+        repo: str | None = None,
+    ) -> list[GithubRunner]:
+        """
+        List the self-hosted runners registered to an org or repo.
+
+        Args:
+            owner: The owner of the repo, or the org.
+            repo: The name of the repo, or None for the runners of the org.
+
+        Returns:
+            The runners.
+        """
+        runners = await self._get_all(
+            self._runners_path(owner, repo),
+            {"per_page": 100},
+            "runners",
+        )
+
+        return [GithubRunner.model_validate(runner) for runner in runners]
+
+    async def delete_runner(
+        self,
+        owner: str,
+        repo: str | None,
+        runner_id: int,
+    ) -> None:
+        """
+        Deregister a self-hosted runner from an org or repo.
+
+        Args:
+            owner: The owner of the repo, or the org.
+            repo: The name of the repo, or None for a runner of the org.
+            runner_id: The id of the runner on Github.
+
+        Raises:
+            GithubAPIError: If the runner could not be deregistered.
+        """
+        res = await self._request(
+            "DELETE",
+            f"{self._runners_path(owner, repo)}/{runner_id}",
+        )
+
+        # Runners that are already gone are fine
+        if res.status_code >= 300 and res.status_code != 404:
+            raise GithubAPIError(
+                f"Failed to deregister runner {runner_id}: {res.status_code}",
+                res.status_code,
+            )
+
+    @staticmethod
+    def _runners_path(owner: str, repo: str | None) -> str:
+        """Get the path of the self-hosted runners of an org or repo."""
+        if repo is None:
+            return f"/orgs/{owner}/actions/runners"
+
+        return f"/repos/{owner}/{repo}/actions/runners"
+
+    async def list_org_repos(self, org: str) -> dict[str, str | None]:
+        """
+        List the repos of an org that can run workflows.
+
+        Args:
+            org: The org.
+
+        Returns:
+            The default branch of each repo that isn't archived, by name.
+        """
+        repos = await self._get_all(
+            f"/orgs/{org}/repos",
+            {"per_page": 100},
+        )
+
+        return {
+            repo["name"]: repo.get("default_branch")
+            for repo in repos
+            if not repo.get("archived")
+        }
+
+    async def get_default_branch(self, owner: str, repo: str) -> str | None:
+        """
+        Get the default branch of a repo, with a conditional request.
+
+        Args:
+            owner: The owner of the repo.
+            repo: The name of the repo.
+
+        Returns:
+            The default branch, if the repo has one.
+        """
+        url = str(self._client.build_request("GET", f"/repos/{owner}/{repo}").url)
+        page, _ = await self._get(url)
+
+        return page.get("default_branch")
+
+    async def list_queued_jobs(
+        self,
+        owner: str,
+        repo: str,
+        default_branch: str | None = None,
+    ) -> list[WorkflowJobEvent]:
+        """
+        List the jobs of a repo that are waiting for a runner.
+
+        The runs of the repo that are queued or in progress are listed, and
+        then the jobs of each run, with conditional requests, so that polling
+        a repo whose runs haven't changed doesn't use up the rate limit.
+
+        Args:
+            owner: The owner of the repo.
+            repo: The name of the repo.
+            default_branch: The default branch of the repo, so that the jobs
+                get the same priority as from their webhooks.
+
+        Returns:
+            The queued jobs, as the events of their webhooks.
+        """
+        events: list[WorkflowJobEvent] = []
+
+        for status in POLLED_RUN_STATUSES:
+            runs = await self._get_all(
+                f"/repos/{owner}/{repo}/actions/runs",
+                {"status": status, "per_page": 100},
+                "workflow_runs",
+            )
+
+            for run in runs:
+                jobs = await self._get_all(
+                    f"/repos/{owner}/{repo}/actions/runs/{run['id']}/jobs",
+                    {"filter": "latest", "per_page": 100},
+                    "jobs",
+                )
+                events.extend(
+                    WorkflowJobEvent(
+                        action=WorkflowJobAction.QUEUED,
+                        job_id=job["id"],
+                        labels=job.get("labels") or [],
+                        owner=owner,
+                        repo=repo,
+                        head_branch=job.get("head_branch"),
+                        default_branch=default_branch,
+                        workflow_name=job.get("workflow_name"),
+                        created_at=parse_timestamp(job.get("created_at")),
+                    )
+                    for job in jobs
+                    if job["status"] == "queued"
+                )
+
+        return events
+
+    async def _get_all(
+        self,
+        url: str,
+        params: dict[str, Any],
+        key: str | None = None,
+    ) -> list[Any]:
+        """
+        Get every page of a list from the API.
+
+        Args:
+            url: The URL, relative to the API base URL.
+            params: The query parameters.
+            key: The key of the list in each page, or None if the pages
+                are lists.
+
+        Returns:
+            The items of every page.
+        """
+        items: list[Any] = []
+        next_url: str | None = str(
+            self._client.build_request("GET", url, params=params).url
+        )
+
+        while next_url is not None:
+            page, next_url = await self._get(next_url)
+            items.extend(page if key is None else page[key])
+
+        return items
+
+    async def _get(self, url: str) -> tuple[Any, str | None]:
+        """
+        Get a page from the API, with a conditional request if possible.
+
+        Responses are cached with their ETag, and asked for again with
+        ``If-None-Match``. Github answers with a 304, which doesn't count
+        against the rate limit, if the page hasn't changed.
+
+        Args:
+            url: The URL of the page.
+
+        Returns:
+            The decoded page, and the URL of the next page, if any.
+
+        Raises:
+            GithubAPIError: If the request failed.
+        """
+        cached = self._responses.get(url)
+        headers = {} if cached is None else {"If-None-Match": cached[0]}
+        res = await self._request("GET", url, headers=headers)
+
+        if res.status_code == 304 and cached is not None:
+            self._responses.move_to_end(url)
+
+            return cached[1], cached[2]
+
+        if res.status_code >= 300:
+            raise GithubAPIError(
+                f"Failed to get {res.url.path}: {res.status_code}",
+                res.status_code,
+            )
+
+        page = res.json()
+        next_url = res.links.get("next", {}).get("url")
+        etag = res.headers.get("ETag")
+
+        if etag is not None:
+            self._responses[url] = (etag, page, next_url)
+            self._responses.move_to_end(url)
+
+            if len(self._responses) > self.settings.poll_cache_size:
+                self._responses.popitem(last=False)
+
+        return page, next_url
+
+    async def _request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """
+        Make a request to the API, retrying when throttled or failing.
+
+        Requests go through the shared token bucket. Throttled requests
+        pause the bucket until the API allows requests again, and other
+        failures are retried with jittered exponential backoff.
+
+        Args:
+            method: The HTTP method.
+            url: The URL, relative to the API base URL.
+            kwargs: Extra arguments for the request.
+
+        Returns:
+            The first response that wasn't throttled or a server error.
+
+        Raises:
+            GithubRateLimitError: If the request was still throttled after
+                all retries.
+            GithubAPIError: If the request still failed after all retries.
+        """
+        error: GithubAPIError = GithubAPIError("No request was made")
+
+        for attempt in range(self.settings.max_retries + 1):
+            await self._limiter.acquire()
+
+            try:
+                res = await self._client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                error = GithubAPIError(f"Request to {url} failed: {e}")
+                delay = self._backoff(attempt)
+            else:
+                self._update_rate_limit(res)
+
+                if self._is_throttled(res):
+                    error = GithubRateLimitError(
+                        f"Rate limited by the API: {res.status_code}",
+                        res.status_code,
+                    )
+                    delay = self._throttled_delay(res, attempt)
+                    self._limiter.pause(delay)
+                elif res.status_code >= 500:
+                    error = GithubAPIError(
+                        f"Server error from the API: {res.status_code}",
+                        res.status_code,
+                    )
+                    delay = self._backoff(attempt)
+                else:
+                    return res
+
+            if attempt < self.settings.max_retries:
+                logger.warning(f"{error}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        raise error
+
+    def _update_rate_limit(self, res: httpx.Response) -> None:
+        """
+        Record the rate limit budget reported by a response.
+
+        If the budget is used up, the token bucket is paused until it resets.
+
+        Args:
+            res: The response from the API.
+        """
+        if "X-RateLimit-Remaining" not in res.headers:
+            return
+
+        self.rate_limit = RateLimitStatus(
+            limit=int(res.headers.get("X-RateLimit-Limit", 0)),
+            remaining=int(res.headers["X-RateLimit-Remaining"]),
+            reset=datetime.fromtimestamp(
+                int(res.headers.get("X-RateLimit-Reset", 0)),
+                timezone.utc,
+            ),
+        )
+
+        if self.rate_limit.remaining == 0 and self.rate_limit.reset is not None:
+            self._limiter.pause(self._seconds_until(self.rate_limit.reset))
+
+    def _is_throttled(self, res: httpx.Response) -> bool:
+        """
+        Check whether a response is a primary or secondary rate limit.
+
+        Args:
+            res: The response from the API.
+
+        Returns:
+            True if the request was throttled.
+        """
+        if res.status_code == 429:
+            return True
+
+        return res.status_code == 403 and (
+            "Retry-After" in res.headers or self.rate_limit.remaining == 0
+        )
+
+    def _throttled_delay(self, res: httpx.Response, attempt: int) -> float:
+        """
+        Get the time to wait before retrying a throttled request.
+
+        Args:
+            res: The throttled response.
+            attempt: The number of the attempt, starting at 0.
+
+        Returns:
+            The delay, in seconds.
+        """
+        retry_after = res.headers.get("Retry-After", "")
+
+        if retry_after.isdigit():
+            return float(retry_after)
+
+        if self.rate_limit.remaining == 0 and self.rate_limit.reset is not None:
+            return self._seconds_until(self.rate_limit.reset)
+
+        # Secondary rate limits without a hint should wait at least a minute
+        return max(60.0, self._backoff(attempt))
+
+    def _backoff(self, attempt: int) -> float:
+        """
+        Get a jittered exponential backoff delay.
+
+        Args:
+            attempt: The number of the attempt, starting at 0.
+
+        Returns:
+            The delay, in seconds.
+        """
+        ceiling = min(
+            self.settings.backoff_max,
+            self.settings.backoff_base * 2**attempt,
+        )
+
+        return random.uniform(0, ceiling)  # nosec B311
 
-        return RegistrationTokenResponse.parse_raw(res.content).token
+    @staticmethod
+    def _seconds_until(moment: datetime) -> float:
+        """Get the number of seconds until a moment, or 0 if it has passed."""
+        return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
 
     async def close(self) -> None:
         """Close the client."""
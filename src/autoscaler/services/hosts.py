@@ -0,0 +1,822 @@
+"""A module for starting runners on a pool of docker hosts."""
+
+import asyncio
+import math
+import queue
+import threading
+
+from collections import Counter
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    TypeVar,
+)
+
+import docker  # pyright: reportMissingTypeStubs=false
+
+from docker.constants import DEFAULT_DOCKER_API_VERSION
+from docker.errors import (
+    APIError,
+    DockerException,
+)
+from docker.tls import TLSConfig
+from docker.utils import parse_bytes
+from loguru import logger
+
+from autoscaler.config import (
+    DockerHost,
+    RunnerClass,
+    RunnerSettings,
+    Settings,
+)
+from autoscaler.models import RunnerRecord
+from autoscaler.services.classes import (
+    DEFAULT_CLASS,
+    load_runner_classes,
+    resource_requests,
+)
+from autoscaler.services.docker import (
+    CLASS_LABEL,
+    DockerClient,
+)
+
+# The errors that mean a docker daemon could not be talked to. The errors
+# of the HTTP client that the docker library uses are all OSErrors.
+HOST_ERRORS = (DockerException, OSError)
+
+T = TypeVar("T")
+
+
+class NoHostAvailableError(RuntimeError):
+    """None of the reachable hosts has room for a runner."""
+
+
+class RunnerHost:
+    """
+    A docker host and the runners that are running on it.
+
+    Attributes:
+        name: The name of the host.
+        client: The client for the docker daemon of the host.
+        max_runners: The maximum number of runners on the host, or None
+            to only be limited by its resources.
+        cpus: The number of CPUs that runners may reserve on the host, or
+            None if it is not known yet.
+        memory: The bytes of memory that runners may reserve on the host,
+            or None if it is not known yet.
+        runners: The runner classes of the runners on the host, by id.
+        starting: The number of runners of each class being started.
+        is_up: Whether the host was reachable when last used.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client: DockerClient,
+        max_runners: int | None = None,
+    ) -> None:
+        """
+        Create a new runner host.
+
+        Args:
+            name: The name of the host.
+            client: The client for the docker daemon of the host.
+            max_runners: The maximum number of runners on the host.
+        """
+        self.name = name
+        self.client = client
+        self.max_runners = max_runners
+        self.cpus: float | None = None
+        self.memory: int | None = None
+        self.runners: dict[str, str] = {}
+        self.starting: Counter[str] = Counter()
+        self.is_up = True
+
+    @property
+    def load(self) -> int:
+        """Get the number of runners that are running or starting."""
+        return len(self.runners) + sum(self.starting.values())
+
+
+class MergedEventStream:
+    """
+    Merge the runner event streams of several hosts into a single stream.
+
+    Each stream is read by its own thread. The merged stream ends as soon
+    as any of the streams ends, so that the consumer resubscribes to all
+    of the hosts that are still reachable.
+    """
+
+    def __init__(
+        self,
+        streams: dict[str, Any],
+        on_event: Callable[[str, dict[str, Any]], None],
+    ) -> None:
+        """
+        Start reading the streams.
+
+        Args:
+            streams: The event streams, by host name.
+            on_event: A callback for every event, with the host name.
+        """
+        self._streams = streams
+        self._on_event = on_event
+        self._events: queue.Queue[tuple[str, dict[str, Any]] | None] = queue.Queue()
+        self._closed = False
+
+        for name, stream in streams.items():
+            threading.Thread(
+                target=self._forward,
+                args=(name, stream),
+                name=f"docker-events-{name}",
+                daemon=True,
+            ).start()
+
+    def _forward(self, name: str, stream: Iterator[dict[str, Any]]) -> None:
+        """Put the events of a stream on the merged stream until it ends."""
+        try:
+            for event in stream:
+                self._events.put((name, event))
+        except Exception as e:
+            logger.error(f"Lost the docker events stream of {name}: {e}")
+        finally:
+            self._events.put(None)
+
+    def __iter__(self) -> "MergedEventStream":
+        """Iterate over the merged events."""
+        return self
+
+    def __next__(self) -> dict[str, Any]:
+        """Wait for the next event of any of the streams."""
+        item = self._events.get()
+
+        if item is None:
+            self.close()
+            raise StopIteration
+
+        name, event = item
+        self._on_event(name, event)
+
+        return event
+
+    def close(self) -> None:
+        """Close every stream."""
+        if self._closed:
+            return
+
+        self._closed = True
+
+        for stream in self._streams.values():
+            stream.close()
+
+        self._events.put(None)
+
+
+class DockerHostPool:
+    """
+    Start runners on a pool of docker hosts.
+
+    The pool tracks the runners on each host, and places every new runner
+    on one of the reachable hosts that has room for it, either spreading
+    the runners out (``least_loaded``) or packing them onto the fullest
+    hosts that fit them (``best_fit``). If a host can't be reached, the
+    runner is started on the next best host instead, and the host is left
+    out until it answers again.
+
+    The pool also merges the events and runners of its hosts, so that the
+    capacity manager can track all of them as if they were on one host.
+
+    The runner images are prepared on every host in the background, and
+    pulled again from time to time to pick up new versions. A host only
+    gets runners of a class once the image of the class is on the host.
+    """
+
+    hosts: list[RunnerHost]
+    classes: list[RunnerClass]
+    settings: RunnerSettings
+    placement: str
+    check_interval: int
+    refresh_interval: int
+    build_path: str
+    no_cache: bool
+    reserved_cpus: float
+    reserved_memory: int
+    is_enabled: bool
+
+    def __init__(self) -> None:
+        """Create a new, empty pool of docker hosts."""
+        self.hosts = []
+        self.classes = []
+        self._ready: dict[str, asyncio.Event] = {}
+        self._preparing = asyncio.Lock()
+        self._lock = threading.Lock()
+        self._stream: MergedEventStream | None = None
+        self._tasks: list[asyncio.Task[None]] = []
+        self.is_enabled = False
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Set up the clients of the docker hosts.
+
+        The clients ask their daemons for the API version to use, so a host
+        that can't be reached is marked as down, and is brought back by the
+        host check once it answers.
+
+        Args:
+            settings: The settings to use for the pool.
+        """
+        self.settings = settings.runner
+        self.placement = settings.docker.placement
+        self.check_interval = settings.docker.host_check_interval
+        self.refresh_interval = settings.docker.image_refresh_interval
+        self.build_path = settings.docker.build_path
+        self.no_cache = settings.docker.no_cache
+        self.reserved_cpus = settings.runner.reserved_cpus
+        self.reserved_memory = parse_bytes(settings.runner.reserved_memory)
+        self.is_enabled = settings.docker.enabled
+        self.classes = load_runner_classes(settings)
+        self._default_class = next(
+            runner_class
+            for runner_class in self.classes
+            if runner_class.name == DEFAULT_CLASS
+        )
+        self._resources = {
+            runner_class.name: resource_requests(runner_class)
+            for runner_class in self.classes
+        }
+        self._ready = {
+            runner_class.name: asyncio.Event() for runner_class in self.classes
+        }
+        self._preparing = asyncio.Lock()
+        self.hosts = []
+
+        if not self.is_enabled:
+            logger.debug("Docker client disabled")
+            return
+
+        if not settings.docker.hosts:
+            self.hosts.append(self._connect_local(settings))
+            return
+
+        for endpoint in settings.docker.hosts:
+            self.hosts.append(self._connect(endpoint, settings))
+
+    def _connect_local(self, settings: Settings) -> RunnerHost:
+        """Connect to the docker daemon found from the environment."""
+        return self._open("local", docker.from_env, settings)
+
+    def _connect(self, endpoint: DockerHost, settings: Settings) -> RunnerHost:
+        """
+        Set up the client of a docker host.
+
+        Args:
+            endpoint: The settings of the host.
+            settings: The settings of the app.
+
+        Returns:
+            The host.
+        """
+        tls: TLSConfig | bool = False
+
+        if endpoint.tls:
+            tls = TLSConfig(
+                client_cert=(
+                    (endpoint.client_cert, endpoint.client_key)
+                    if endpoint.client_cert and endpoint.client_key
+                    else None
+                ),
+                ca_cert=endpoint.ca_cert,
+                verify=True,
+            )
+
+        return self._open(
+            endpoint.name,
+            partial(docker.DockerClient, base_url=endpoint.url, tls=tls),
+            settings,
+            endpoint.max_runners,
+        )
+
+    def _open(
+        self,
+        name: str,
+        connect: Callable[..., docker.DockerClient],
+        settings: Settings,
+        max_runners: int | None = None,
+    ) -> RunnerHost:
+        """
+        Create the client of a docker host.
+
+        Creating a docker client asks the daemon for its API version. If
+        the daemon can't be reached, the client is created with the default
+        API version instead, which sends nothing, and the host starts out
+        as down.
+
+        Args:
+            name: The name of the host.
+            connect: Creates the docker client, with the given keywords.
+            settings: The settings of the app.
+            max_runners: The maximum number of runners on the host.
+
+        Returns:
+            The host.
+        """
+        try:
+            client, is_up = connect(), True
+        except HOST_ERRORS as e:
+            logger.error(f"Docker host {name} is down: {e}")
+            client, is_up = connect(version=DEFAULT_DOCKER_API_VERSION), False
+
+        host = RunnerHost(name, DockerClient(client=client), max_runners)
+        host.client.initialize(settings)
+        host.is_up = is_up
+
+        return host
+
+    async def start(self) -> None:
+        """
+        Start preparing the runner images and checking on the hosts.
+
+        This doesn't wait for the images, so the app can take webhooks
+        while they are being built or pulled.
+        """
+        for host in self.hosts:
+            await host.client.start()
+
+        if not self.hosts:
+            return
+
+        self._tasks.append(asyncio.create_task(self.prepare_images()))
+
+        if self.refresh_interval > 0:
+            self._tasks.append(asyncio.create_task(self._refresh_images()))
+
+        # Even a single host must be brought back once it answers again
+        self._tasks.append(asyncio.create_task(self._check_hosts()))
+
+    async def close(self) -> None:
+        """Close the connections to the hosts."""
+        for task in self._tasks:
+            task.cancel()
+
+        for host in self.hosts:
+            await host.client.close()
+
+    async def prepare_images(self, *, refresh: bool = False) -> None:
+        """
+        Prepare the runner images on every reachable host at once.
+
+        Once every host has tried, the runners that are waiting for an
+        image are let through, even if no host could prepare it, so that
+        they fail rather than wait for good.
+
+        Args:
+            refresh: Whether to pull the images that are already on the
+                hosts again, to pick up new versions.
+        """
+        async with self._preparing:
+            await asyncio.gather(
+                *(
+                    self._prepare_image(host, runner_class, refresh=refresh)
+                    for host in self.hosts
+                    if host.is_up
+                    for runner_class in self.classes
+                )
+            )
+
+        for ready in self._ready.values():
+            ready.set()
+
+    async def _prepare_image(
+        self,
+        host: RunnerHost,
+        runner_class: RunnerClass,
+        *,
+        refresh: bool,
+    ) -> None:
+        """
+        Prepare the image of a runner class on a host.
+
+        Args:
+            host: The host.
+            runner_class: The runner class.
+            refresh: Whether to pull the image again if it is already on
+                the host. Built images are never rebuilt.
+        """
+        if runner_class.name in host.client.images and (
+            not refresh or runner_class.dockerfile is not None
+        ):
+            return
+
+        try:
+            await host.client.update_image(
+                runner_class,
+                path=self.build_path,
+                no_cache=self.no_cache,
+            )
+        except HOST_ERRORS as e:
+            logger.error(
+                f"Failed to prepare the {runner_class.name} runner image "
+                f"on {host.name}: {e}"
+            )
+            return
+
+        self._ready[runner_class.name].set()
+
+    async def _refresh_images(self) -> None:
+        """Pull the runner images again from time to time."""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.prepare_images(refresh=True)
+
+    def _mark_down(self, host: RunnerHost, error: Exception) -> None:
+        """
+        Leave a host out until it can be reached again.
+
+        Args:
+            host: The host.
+            error: The error that the host failed with.
+        """
+        if host.is_up:
+            logger.error(f"Docker host {host.name} is down: {error}")
+
+        with self._lock:
+            host.is_up = False
+            host.runners = {}
+
+    async def _check_hosts(self) -> None:
+        """
+        Bring back the hosts that are reachable again.
+
+        The images that no host could prepare are tried again too.
+        """
+        while True:
+            await asyncio.sleep(self.check_interval)
+
+            try:
+                revived = await self._revive_hosts()
+                await self.prepare_images()
+            except Exception as e:
+                logger.error(f"Failed to check the docker hosts: {e}")
+                continue
+
+            # Resubscribe, so that the events of the hosts are followed
+            if revived and self._stream is not None:
+                self._stream.close()
+
+    async def _revive_hosts(self) -> bool:
+        """
+        Ping the hosts that are down, and mark those that answer as up.
+
+        Returns:
+            True if any host is back up.
+        """
+        revived = False
+
+        for host in self.hosts:
+            if host.is_up:
+                continue
+
+            try:
+                await host.client.ping()
+            except HOST_ERRORS as e:
+                logger.debug(f"Docker host {host.name} is still down: {e}")
+                continue
+
+            logger.info(f"Docker host {host.name} is back up")
+            host.is_up = True
+            revived = True
+
+        return revived
+
+    def _on_event(self, name: str, event: dict[str, Any]) -> None:
+        """
+        Update the runners of a host from one of its events.
+
+        This is called from the thread that reads the merged event stream.
+
+        Args:
+            name: The name of the host.
+            event: The decoded docker event.
+        """
+        host = next(host for host in self.hosts if host.name == name)
+        runner_id = event["Actor"]["ID"]
+
+        with self._lock:
+            if event["Action"] == "start":
+                attributes = event["Actor"].get("Attributes", {})
+                host.runners[runner_id] = attributes.get(CLASS_LABEL, DEFAULT_CLASS)
+            else:
+                host.runners.pop(runner_id, None)
+
+    async def runner_events(self) -> MergedEventStream:
+        """
+        Subscribe to the start and die events of the runners on every host.
+
+        Returns:
+            The merged stream of decoded docker events.
+
+        Raises:
+            NoHostAvailableError: If none of the hosts could be reached.
+        """
+        streams: dict[str, Any] = {}
+
+        for host in self.hosts:
+            if not host.is_up:
+                continue
+
+            try:
+                streams[host.name] = await host.client.runner_events()
+            except HOST_ERRORS as e:
+                self._mark_down(host, e)
+
+        if not streams:
+            raise NoHostAvailableError("None of the docker hosts are reachable")
+
+        self._stream = MergedEventStream(streams, self._on_event)
+
+        return self._stream
+
+    async def list_runner_records(self) -> dict[str, RunnerRecord]:
+        """
+        List the runners on every reachable host with their records.
+
+        Returns:
+            A mapping of the container ids of the runners to their records.
+        """
+        runners: dict[str, RunnerRecord] = {}
+
+        for host in self.hosts:
+            if not host.is_up:
+                continue
+
+            try:
+                host_runners = await host.client.list_runner_records()
+            except HOST_ERRORS as e:
+                self._mark_down(host, e)
+                continue
+
+            with self._lock:
+                host.runners = {
+                    runner_id: record.runner_class
+                    for runner_id, record in host_runners.items()
+                }
+
+            runners.update(host_runners)
+
+        return runners
+
+    async def allocatable_resources(self) -> tuple[float, int]:
+        """
+        Get the resources that runners may reserve on the reachable hosts.
+
+        Returns:
+            The number of CPUs and the bytes of memory.
+        """
+        cpus, memory = 0.0, 0
+
+        for host in self.hosts:
+            if not host.is_up:
+                continue
+
+            try:
+                host_cpus, host_memory = await host.client.host_resources()
+            except HOST_ERRORS as e:
+                self._mark_down(host, e)
+                continue
+
+            host.cpus = max(host_cpus - self.reserved_cpus, 0.0)
+            host.memory = max(host_memory - self.reserved_memory, 0)
+            cpus += host.cpus
+            memory += host.memory
+
+        return cpus, memory
+
+    def _usage(self, host: RunnerHost) -> tuple[float, int]:
+        """Get the resources reserved by the runners on a host."""
+        cpus, memory = 0.0, 0
+
+        for name in [*host.runners.values(), *host.starting.elements()]:
+            runner_cpus, runner_memory = self._resources.get(name, (0.0, 0))
+            cpus += runner_cpus
+            memory += runner_memory
+
+        return cpus, memory
+
+    def _free(self, host: RunnerHost) -> tuple[float, float, float]:
+        """Get the CPUs, memory and runners that a host has room for."""
+        used_cpus, used_memory = self._usage(host)
+
+        return (
+            math.inf if host.cpus is None else host.cpus - used_cpus,
+            math.inf if host.memory is None else host.memory - used_memory,
+            math.inf if host.max_runners is None else host.max_runners - host.load,
+        )
+
+    def _rank(
+        self,
+        options: list[tuple[float, float, int, T]],
+    ) -> list[T]:
+        """Sort the hosts that fit a runner by the placement strategy."""
+        if self.placement == "best_fit":
+            options.sort(key=lambda option: (option[0], option[1], option[2]))
+        else:
+            options.sort(key=lambda option: (option[2], -option[0], -option[1]))
+
+        return [option[3] for option in options]
+
+    def place(self, runner_class: RunnerClass) -> list[RunnerHost]:
+        """
+        Rank the hosts that have room for a runner.
+
+        Args:
+            runner_class: The class of the runner.
+
+        Returns:
+            The reachable hosts that have room for the runner, best first.
+        """
+        cpus, memory = resource_requests(runner_class)
+        options: list[tuple[float, float, int, RunnerHost]] = []
+
+        with self._lock:
+            for host in self.hosts:
+                if not host.is_up or runner_class.name not in host.client.images:
+                    continue
+
+                free_cpus, free_memory, free_runners = self._free(host)
+
+                if free_runners <= 0 or free_cpus < cpus or free_memory < memory:
+                    continue
+
+                options.append(
+                    (free_cpus - cpus, free_memory - memory, host.load, host)
+                )
+
+        return self._rank(options)
+
+    def can_place(self, runner_class: RunnerClass, reserved: Counter[str]) -> bool:
+        """
+        Check whether a host would have room for one more runner.
+
+        Runners are admitted before they are started, so the runners that
+        were admitted but are not being started yet are first placed on
+        a copy of the hosts, largest first, as ``start_runner`` would place
+        them. Images are not checked, as ``start_runner`` waits for them.
+
+        Args:
+            runner_class: The class of the runner.
+            reserved: The number of admitted runners of each class that
+                haven't started yet.
+
+        Returns:
+            True if a reachable host would have room for the runner.
+        """
+        with self._lock:
+            hosts = [
+                [*self._free(host), host.load] for host in self.hosts if host.is_up
+            ]
+            pending = reserved - sum(
+                (host.starting for host in self.hosts),
+                Counter[str](),
+            )
+
+        requests = sorted(
+            (self._resources.get(name, (0.0, 0)) for name in pending.elements()),
+            reverse=True,
+        )
+
+        # An admitted runner that fits nowhere fails to start, so is skipped
+        for cpus, memory in requests:
+            self._place_on(hosts, cpus, memory)
+
+        return self._place_on(hosts, *resource_requests(runner_class))
+
+    def _place_on(self, hosts: list[list[float]], cpus: float, memory: int) -> bool:
+        """Place a runner on the best of a copy of the hosts, if one fits."""
+        fitting = self._rank(
+            [
+                (host[0] - cpus, host[1] - memory, int(host[3]), host)
+                for host in hosts
+                if host[2] > 0 and host[0] >= cpus and host[1] >= memory
+            ]
+        )
+
+        if not fitting:
+            return False
+
+        host = fitting[0]
+        host[0] -= cpus
+        host[1] -= memory
+        host[2] -= 1
+        host[3] += 1
+
+        return True
+
+    async def start_runner(
+        self,
+        *,
+        url: str,
+        token: str,
+        owner: str,
+        repo: str | None = None,
+        runner_class: RunnerClass | None = None,
+        warm: bool = False,
+    ) -> str:
+        """
+        Start a new runner on the best host that has room for it.
+
+        If the image of the runner class isn't on any host yet, this waits
+        until every host has tried to prepare it.
+
+        Args:
+            url: The URL of the runner.
+            token: The registration token for the runner.
+            owner: The owner that the runner is registered to.
+            repo: The repo that the runner is registered to, or None if
+                the runner is registered to an org.
+            runner_class: The class of the runner, or None for the
+                default class.
+            warm: Whether the runner is started for a warm pool.
+
+        Returns:
+            The id of the container that was started.
+
+        Raises:
+            NoHostAvailableError: If no reachable host has the image of
+                the runner class, or could start the runner.
+        """
+        if runner_class is None:
+            runner_class = self._default_class
+
+        ready = self._ready.get(runner_class.name)
+
+        if ready is not None and not ready.is_set():
+            logger.info(f"Waiting for the {runner_class.name} runner image")
+            await ready.wait()
+
+        if not any(
+            host.is_up and runner_class.name in host.client.images
+            for host in self.hosts
+        ):
+            raise NoHostAvailableError(
+                f"No docker host has the {runner_class.name} runner image"
+            )
+
+        for host in self.place(runner_class):
+            host.starting[runner_class.name] += 1
+
+            try:
+                runner_id = await host.client.start_runner(
+                    url=url,
+                    token=token,
+                    owner=owner,
+                    repo=repo,
+                    runner_class=runner_class,
+                    warm=warm,
+                )
+            except HOST_ERRORS as e:
+                if isinstance(e, APIError) and e.is_client_error():
+                    logger.error(f"Failed to start a runner on {host.name}: {e}")
+                else:
+                    self._mark_down(host, e)
+
+                continue
+            finally:
+                host.starting[runner_class.name] -= 1
+
+            with self._lock:
+                host.runners[runner_id] = runner_class.name
+
+            logger.debug(f"Started runner {runner_id} on {host.name}")
+
+            return runner_id
+
+        raise NoHostAvailableError(
+            f"No docker host has room for a {runner_class.name} runner"
+        )
+
+    async def remove_runner(self, runner_id: str) -> None:
+        """
+        Stop a runner and remove it from its host.
+
+        Args:
+            runner_id: The id of the container of the runner.
+        """
+        with self._lock:
+            hosts = [host for host in self.hosts if runner_id in host.runners]
+
+        for host in hosts or [host for host in self.hosts if host.is_up]:
+            try:
+                await host.client.remove_runner(runner_id)
+            except HOST_ERRORS as e:
+                self._mark_down(host, e)
+
+    async def count_runners(self) -> int:
+        """
+        Count the number of runners on the reachable hosts.
+
+        Returns:
+            The number of runners.
+        """
+        return len(await self.list_runner_records())
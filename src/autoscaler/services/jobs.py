@@ -0,0 +1,191 @@
+"""A module for tracking the workflow jobs seen by the autoscaler."""
+
+import asyncio
+
+from collections import OrderedDict
+
+from loguru import logger
+
+from autoscaler.config import Settings
+
+
+class RecentSet:
+    """A set that only remembers its most recently added items."""
+
+    def __init__(self, size: int) -> None:
+        """
+        Create a new set.
+
+        Args:
+            size: The maximum number of items to remember.
+        """
+        self.size = size
+        self._items: OrderedDict[str | int, None] = OrderedDict()
+
+    def __contains__(self, item: str | int) -> bool:
+        """Check whether an item was recently added."""
+        return item in self._items
+
+    def add(self, item: str | int) -> None:
+        """
+        Add an item, forgetting the oldest item if the set is full.
+
+        Args:
+            item: The item to add.
+        """
+        self._items[item] = None
+        self._items.move_to_end(item)
+
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def discard(self, item: str | int) -> None:
+        """
+        Forget an item, if it was added.
+
+        Args:
+            item: The item to forget.
+        """
+        self._items.pop(item, None)
+
+
+class JobTracker:
+    """
+    Track workflow jobs to make webhook handling idempotent.
+
+    Redelivered webhooks are recognised by their delivery id, and queued
+    events for jobs that were already queued, or that already started or
+    finished, are ignored, however they were received. The tasks
+    provisioning runners are indexed by job id, so that they can be
+    cancelled when the job no longer needs a runner.
+    """
+
+    def __init__(self) -> None:
+        """Create a new job tracker."""
+        self._deliveries = RecentSet(0)
+        self._queued = RecentSet(0)
+        self._finished = RecentSet(0)
+        self._pending: dict[int, asyncio.Task[None]] = {}
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Initialize the tracker.
+
+        Args:
+            settings: The settings to use for the tracker.
+        """
+        self._deliveries = RecentSet(settings.queue.history_size)
+        self._queued = RecentSet(settings.queue.history_size)
+        self._finished = RecentSet(settings.queue.history_size)
+
+    async def start(self) -> None:
+        """Start the tracker."""
+
+    async def close(self) -> None:
+        """Close the tracker."""
+
+    def is_redelivery(self, delivery_id: str | None) -> bool:
+        """
+        Check whether a webhook was already delivered and handled.
+
+        Args:
+            delivery_id: The value of the ``X-GitHub-Delivery`` header.
+
+        Returns:
+            True if the webhook was already handled.
+        """
+        return delivery_id is not None and delivery_id in self._deliveries
+
+    def mark_delivered(self, delivery_id: str | None) -> None:
+        """
+        Record that a webhook was handled.
+
+        Webhooks are only recorded once they were handled, so that a
+        webhook that failed is handled again when Github redelivers it.
+
+        Args:
+            delivery_id: The value of the ``X-GitHub-Delivery`` header.
+        """
+        if delivery_id is not None:
+            self._deliveries.add(delivery_id)
+
+    def mark_queued(self, job_id: int) -> bool:
+        """
+        Record that a job was queued, unless it already was.
+
+        Args:
+            job_id: The id of the workflow job.
+
+        Returns:
+            False if the job was already queued.
+        """
+        if job_id in self._queued:
+            return False
+
+        self._queued.add(job_id)
+
+        return True
+
+    def unmark_queued(self, job_id: int) -> None:
+        """
+        Forget that a job was queued, after it failed to be queued.
+
+        Args:
+            job_id: The id of the workflow job.
+        """
+        self._queued.discard(job_id)
+
+    def is_finished(self, job_id: int) -> bool:
+        """
+        Check whether a job has already started or finished.
+
+        Args:
+            job_id: The id of the workflow job.
+
+        Returns:
+            True if the job no longer needs a runner.
+        """
+        return job_id in self._finished
+
+    def mark_started(self, job_id: int) -> None:
+        """
+        Mark a job as picked up by a runner.
+
+        Its provisioning is left running, as Github hands jobs to any idle
+        runner that matches: the runner that took the job may have been
+        started for another job, which then needs this job's runner.
+
+        Args:
+            job_id: The id of the workflow job.
+        """
+        self._finished.add(job_id)
+
+    def track(self, job_id: int, task: asyncio.Task[None]) -> None:
+        """
+        Index the task that is provisioning a runner for a job.
+
+        Args:
+            job_id: The id of the workflow job.
+            task: The task.
+        """
+        self._pending[job_id] = task
+        task.add_done_callback(lambda _: self._untrack(job_id, task))
+
+    def _untrack(self, job_id: int, task: asyncio.Task[None]) -> None:
+        """Forget a task that is done, unless a newer task replaced it."""
+        if self._pending.get(job_id) is task:
+            del self._pending[job_id]
+
+    def finish(self, job_id: int) -> None:
+        """
+        Mark a job as started or finished, cancelling its provisioning.
+
+        Args:
+            job_id: The id of the workflow job.
+        """
+        self._finished.add(job_id)
+        task = self._pending.pop(job_id, None)
+
+        if task is not None:
+            logger.info(f"Job {job_id} no longer needs a runner, cancelling")
+            task.cancel()
@@ -0,0 +1,593 @@
+"""A module for leases shared between processes."""
+
+import asyncio
+import sqlite3
+import threading
+import time
+import uuid
+
+from typing import Protocol
+
+from loguru import logger
+
+from autoscaler.config import (
+    LeaseSettings,
+    Settings,
+)
+from autoscaler.services.resp import RespClient
+
+
+class LeaseStore(Protocol):
+    """
+    A protocol for stores of leases.
+
+    A runner slot lease reserves a slot from the moment a process decides
+    to start a runner until the runner exits, first under an id of its own,
+    then under the id of the runner once it has started. Leases expire on
+    their own unless they are held again, so a process that dies can't hold
+    slots forever.
+
+    Every store holds the leases of one namespace, such as the runner
+    slots, the claims on warm pool runners, or the leadership of the
+    processes, so that the leases of one don't count against another.
+    """
+
+    async def reserve(self, limit: int, timeout: float) -> str | None:
+        """Take a lease if fewer than `limit` leases are held."""
+        ...
+
+    async def hold(self, lease_ids: list[str], timeout: float) -> None:
+        """Take or renew leases, however many leases are held."""
+        ...
+
+    async def take(self, lease_id: str, timeout: float) -> bool:
+        """Take a lease with a given id, unless it is already held."""
+        ...
+
+    async def renew(self, lease_id: str, timeout: float) -> bool:
+        """Renew a lease, unless it has expired or was released."""
+        ...
+
+    async def held(self) -> list[str]:
+        """List the ids of the leases that are held."""
+        ...
+
+    async def release(self, lease_id: str) -> None:
+        """Give back a lease."""
+        ...
+
+    async def close(self) -> None:
+        """Close the store."""
+        ...
+
+
+class MemoryLeaseStore:
+    """A lease store for a single process."""
+
+    def __init__(self) -> None:
+        """Create a new in-memory lease store."""
+        self._leases: dict[str, float] = {}
+
+    def _expire(self) -> float:
+        """Forget the expired leases, returning the current time."""
+        now = time.time()
+        self._leases = {
+            lease_id: expires
+            for lease_id, expires in self._leases.items()
+            if expires >= now
+        }
+
+        return now
+
+    async def reserve(self, limit: int, timeout: float) -> str | None:
+        """
+        Take a lease if fewer than `limit` leases are held.
+
+        Args:
+            limit: The maximum number of leases.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            The id of the lease, or None if too many leases are held.
+        """
+        now = self._expire()
+
+        if len(self._leases) >= limit:
+            return None
+
+        lease_id = uuid.uuid4().hex
+        self._leases[lease_id] = now + timeout
+
+        return lease_id
+
+    async def hold(self, lease_ids: list[str], timeout: float) -> None:
+        """
+        Take or renew leases, however many leases are held.
+
+        Args:
+            lease_ids: The ids of the leases.
+            timeout: The time, in seconds, until the leases expire.
+        """
+        expires = time.time() + timeout
+
+        for lease_id in lease_ids:
+            self._leases[lease_id] = expires
+
+    async def take(self, lease_id: str, timeout: float) -> bool:
+        """
+        Take a lease with a given id, unless it is already held.
+
+        Args:
+            lease_id: The id of the lease.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            True if the lease was taken.
+        """
+        now = self._expire()
+
+        if lease_id in self._leases:
+            return False
+
+        self._leases[lease_id] = now + timeout
+
+        return True
+
+    async def renew(self, lease_id: str, timeout: float) -> bool:
+        """
+        Renew a lease, unless it has expired or was released.
+
+        Args:
+            lease_id: The id of the lease.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            True if the lease was renewed.
+        """
+        now = self._expire()
+
+        if lease_id not in self._leases:
+            return False
+
+        self._leases[lease_id] = now + timeout
+
+        return True
+
+    async def held(self) -> list[str]:
+        """List the ids of the leases that are held."""
+        self._expire()
+
+        return list(self._leases)
+
+    async def release(self, lease_id: str) -> None:
+        """
+        Give back a lease.
+
+        Args:
+            lease_id: The id of the lease.
+        """
+        self._leases.pop(lease_id, None)
+
+    async def close(self) -> None:
+        """Close the store."""
+
+
+class SqliteLeaseStore:
+    """A lease store in a SQLite database shared by the processes on a host."""
+
+    def __init__(self, path: str, namespace: str) -> None:
+        """
+        Open the database, creating the leases table if needed.
+
+        Args:
+            path: The path of the database file.
+            namespace: The namespace of the leases.
+        """
+        self._namespace = namespace
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " namespace TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, id)"
+            ")"
+        )
+
+    def _delete_expired(self, now: float) -> None:
+        """Delete the expired leases of the namespace."""
+        self._db.execute(
+            "DELETE FROM leases WHERE namespace = ? AND expires_at < ?",
+            (self._namespace, now),
+        )
+
+    def _reserve(self, limit: int, timeout: float) -> str | None:
+        """Take a lease in a single transaction, blocking on the database."""
+        now = time.time()
+        lease_id: str | None = None
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+
+            try:
+                self._delete_expired(now)
+                held = self._db.execute(
+                    "SELECT COUNT(*) FROM leases WHERE namespace = ?",
+                    (self._namespace,),
+                ).fetchone()[0]
+
+                if held < limit:
+                    lease_id = uuid.uuid4().hex
+                    self._db.execute(
+                        "INSERT INTO leases (namespace, id, expires_at)"
+                        " VALUES (?, ?, ?)",
+                        (self._namespace, lease_id, now + timeout),
+                    )
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._db.execute("COMMIT")
+
+        return lease_id
+
+    async def reserve(self, limit: int, timeout: float) -> str | None:
+        """
+        Take a lease if fewer than `limit` leases are held.
+
+        Args:
+            limit: The maximum number of leases.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            The id of the lease, or None if too many leases are held.
+        """
+        return await asyncio.to_thread(self._reserve, limit, timeout)
+
+    def _hold(self, lease_ids: list[str], timeout: float) -> None:
+        """Insert or renew leases, blocking on the database."""
+        expires = time.time() + timeout
+
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO leases (namespace, id, expires_at)"
+                " VALUES (?, ?, ?)",
+                [(self._namespace, lease_id, expires) for lease_id in lease_ids],
+            )
+
+    async def hold(self, lease_ids: list[str], timeout: float) -> None:
+        """
+        Take or renew leases, however many leases are held.
+
+        Args:
+            lease_ids: The ids of the leases.
+            timeout: The time, in seconds, until the leases expire.
+        """
+        await asyncio.to_thread(self._hold, lease_ids, timeout)
+
+    def _take(self, lease_id: str, timeout: float) -> bool:
+        """Insert a lease unless it is held, blocking on the database."""
+        now = time.time()
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+
+            try:
+                self._delete_expired(now)
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO leases (namespace, id, expires_at)"
+                    " VALUES (?, ?, ?)",
+                    (self._namespace, lease_id, now + timeout),
+                )
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._db.execute("COMMIT")
+
+        return cursor.rowcount > 0
+
+    async def take(self, lease_id: str, timeout: float) -> bool:
+        """
+        Take a lease with a given id, unless it is already held.
+
+        Args:
+            lease_id: The id of the lease.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            True if the lease was taken.
+        """
+        return await asyncio.to_thread(self._take, lease_id, timeout)
+
+    def _renew(self, lease_id: str, timeout: float) -> bool:
+        """Extend a lease that is still held, blocking on the database."""
+        now = time.time()
+
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE leases SET expires_at = ?"
+                " WHERE namespace = ? AND id = ? AND expires_at >= ?",
+                (now + timeout, self._namespace, lease_id, now),
+            )
+
+        return cursor.rowcount > 0
+
+    async def renew(self, lease_id: str, timeout: float) -> bool:
+        """
+        Renew a lease, unless it has expired or was released.
+
+        Args:
+            lease_id: The id of the lease.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            True if the lease was renewed.
+        """
+        return await asyncio.to_thread(self._renew, lease_id, timeout)
+
+    def _held(self) -> list[str]:
+        """List the leases that are held, blocking on the database."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM leases WHERE namespace = ? AND expires_at >= ?",
+                (self._namespace, time.time()),
+            ).fetchall()
+
+        return [row[0] for row in rows]
+
+    async def held(self) -> list[str]:
+        """List the ids of the leases that are held."""
+        return await asyncio.to_thread(self._held)
+
+    def _release(self, lease_id: str) -> None:
+        """Delete a lease, blocking on the database."""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM leases WHERE namespace = ? AND id = ?",
+                (self._namespace, lease_id),
+            )
+
+    async def release(self, lease_id: str) -> None:
+        """
+        Give back a lease.
+
+        Args:
+            lease_id: The id of the lease.
+        """
+        await asyncio.to_thread(self._release, lease_id)
+
+    async def close(self) -> None:
+        """Close the database."""
+        self._db.close()
+
+
+class RedisLeaseStore:
+    """
+    A lease store on a server speaking the Redis protocol.
+
+    Leases are kept in a sorted set scored by their expiry time. A lease is
+    added first and removed again if that puts the set over the limit, so
+    concurrent reservations may both fail, but never both succeed past it.
+    """
+
+    def __init__(self, url: str, prefix: str, namespace: str) -> None:
+        """
+        Create a new Redis lease store.
+
+        Args:
+            url: The URL of the server.
+            prefix: The prefix of the keys used for the leases.
+            namespace: The namespace of the leases.
+        """
+        self._client = RespClient(url)
+        self._leases = f"{prefix}:leases:{namespace}"
+
+    async def reserve(self, limit: int, timeout: float) -> str | None:
+        """
+        Take a lease if fewer than `limit` leases are held.
+
+        Args:
+            limit: The maximum number of leases.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            The id of the lease, or None if too many leases are held.
+        """
+        if limit <= 0:
+            return None
+
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+
+        await self._client.execute("ZREMRANGEBYSCORE", self._leases, "-inf", now)
+        await self._client.execute("ZADD", self._leases, now + timeout, lease_id)
+
+        if await self._client.execute("ZCARD", self._leases) > limit:
+            await self._client.execute("ZREM", self._leases, lease_id)
+            return None
+
+        return lease_id
+
+    async def hold(self, lease_ids: list[str], timeout: float) -> None:
+        """
+        Take or renew leases, however many leases are held.
+
+        Args:
+            lease_ids: The ids of the leases.
+            timeout: The time, in seconds, until the leases expire.
+        """
+        if not lease_ids:
+            return
+
+        expires = time.time() + timeout
+        members: list[str | float] = []
+
+        for lease_id in lease_ids:
+            members += [expires, lease_id]
+
+        await self._client.execute("ZADD", self._leases, *members)
+
+    async def take(self, lease_id: str, timeout: float) -> bool:
+        """
+        Take a lease with a given id, unless it is already held.
+
+        Args:
+            lease_id: The id of the lease.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            True if the lease was taken.
+        """
+        now = time.time()
+        await self._client.execute("ZREMRANGEBYSCORE", self._leases, "-inf", now)
+
+        return bool(
+            await self._client.execute(
+                "ZADD", self._leases, "NX", now + timeout, lease_id
+            )
+        )
+
+    async def renew(self, lease_id: str, timeout: float) -> bool:
+        """
+        Renew a lease, unless it has expired or was released.
+
+        Args:
+            lease_id: The id of the lease.
+            timeout: The time, in seconds, until the lease expires.
+
+        Returns:
+            True if the lease was renewed.
+        """
+        now = time.time()
+        await self._client.execute("ZREMRANGEBYSCORE", self._leases, "-inf", now)
+
+        return bool(
+            await self._client.execute(
+                "ZADD", self._leases, "XX", "CH", now + timeout, lease_id
+            )
+        )
+
+    async def held(self) -> list[str]:
+        """List the ids of the leases that are held."""
+        return list(
+            await self._client.execute(
+                "ZRANGEBYSCORE", self._leases, time.time(), "+inf"
+            )
+        )
+
+    async def release(self, lease_id: str) -> None:
+        """
+        Give back a lease.
+
+        Args:
+            lease_id: The id of the lease.
+        """
+        await self._client.execute("ZREM", self._leases, lease_id)
+
+    async def close(self) -> None:
+        """Close the connection to the server."""
+        await self._client.close()
+
+
+def create_lease_store(settings: LeaseSettings, namespace: str) -> LeaseStore:
+    """
+    Create the configured lease store.
+
+    Args:
+        settings: The settings for the lease store.
+        namespace: The namespace of the leases, such as ``runners``.
+
+    Returns:
+        The lease store.
+    """
+    if settings.backend == "sqlite":
+        return SqliteLeaseStore(settings.sqlite_path, namespace)
+
+    if settings.backend == "redis":
+        return RedisLeaseStore(settings.redis_url, settings.redis_prefix, namespace)
+
+    return MemoryLeaseStore()
+
+
+class LeaderLease:
+    """
+    Elect one process to do the background work that is only done once.
+
+    Every process tries to take the single lease of the ``leader``
+    namespace, and the process that holds it keeps renewing it. If that
+    process dies, its lease expires and another process takes over. With
+    the ``memory`` backend, every process is its own leader.
+    """
+
+    timeout: int
+    is_leader: bool
+    _leases: LeaseStore
+
+    def __init__(self) -> None:
+        """Create a new leader lease."""
+        self._lease_id: str | None = None
+        self._task: asyncio.Task[None] | None = None
+        self.is_leader = False
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Initialize the lease.
+
+        Args:
+            settings: The settings of the app.
+        """
+        self.timeout = settings.lease.leader_timeout
+        self._leases = create_lease_store(settings.lease, "leader")
+        self._lease_id = None
+        self.is_leader = False
+
+    async def start(self) -> None:
+        """Start trying to become the leader in the background."""
+        await self._campaign()
+        self._task = asyncio.create_task(self._campaign_periodically())
+
+    async def close(self) -> None:
+        """Give up the lease, so that another process can take over."""
+        if self._task is not None:
+            self._task.cancel()
+
+        if self._lease_id is not None:
+            try:
+                await self._leases.release(self._lease_id)
+            except Exception as e:
+                logger.error(f"Failed to release the leader lease: {e}")
+
+        self._lease_id = None
+        self.is_leader = False
+        await self._leases.close()
+
+    async def _campaign(self) -> None:
+        """Take the lease if nobody holds it, or renew it if this does."""
+        try:
+            if self._lease_id is None:
+                self._lease_id = await self._leases.reserve(1, self.timeout)
+            elif not await self._leases.renew(self._lease_id, self.timeout):
+                logger.warning("Lost the leader lease")
+                self._lease_id = None
+        except Exception as e:
+            logger.error(f"Failed to renew the leader lease: {e}")
+
+        if self.is_leader != (self._lease_id is not None):
+            self.is_leader = self._lease_id is not None
+            logger.info(
+                "Became the leader" if self.is_leader else "No longer the leader"
+            )
+
+    async def _campaign_periodically(self) -> None:
+        """Keep taking or renewing the lease, well before it expires."""
+        while True:
+            await asyncio.sleep(self.timeout / 3)
+            await self._campaign()
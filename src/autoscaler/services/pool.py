@@ -0,0 +1,417 @@
+"""A module for keeping warm pools of idle runners."""
+
+import asyncio
+
+from loguru import logger
+
+from autoscaler.config import (
+    RunnerClass,
+    Settings,
+)
+from autoscaler.models import RunnerRecord
+from autoscaler.services.capacity import CapacityManager
+from autoscaler.services.classes import RunnerClassRegistry
+from autoscaler.services.leases import (
+    LeaseStore,
+    create_lease_store,
+)
+
+
+class WarmPool:
+    """
+    A pool of idle runners registered to a single owner or repo.
+
+    The pool can't tell which of its runners GitHub hands a job to, so each
+    job that is served from the pool claims one of its runners. A runner
+    stays claimed until it exits, as runners only pick up a single job.
+
+    On top of its configured size, a pool can be asked to keep idle runners
+    for the jobs that are predicted to be queued soon. Once fewer jobs are
+    predicted, the idle runners above the target are its surplus.
+    """
+
+    owner: str
+    repo: str | None
+    size: int
+    predicted: int
+    runner_class: RunnerClass
+
+    def __init__(
+        self,
+        owner: str,
+        repo: str | None,
+        size: int,
+        runner_class: RunnerClass,
+    ) -> None:
+        """
+        Create a new warm pool.
+
+        Args:
+            owner: The owner that the runners are registered to.
+            repo: The repo that the runners are registered to, or None
+                if the runners are registered to an org.
+            size: The number of idle runners to keep.
+            runner_class: The class of the runners.
+        """
+        self.owner = owner
+        self.repo = repo
+        self.size = size
+        self.predicted = 0
+        self.runner_class = runner_class
+        self._members: set[str] = set()
+        self._claimed: set[str] = set()
+        self._changed = asyncio.Event()
+
+    @property
+    def target(self) -> int:
+        """Get the number of idle runners that the pool should keep."""
+        return max(self.size, self.predicted)
+
+    @property
+    def idle(self) -> int:
+        """Get the number of runners that are waiting for a job."""
+        return len(self._members) - len(self._claimed)
+
+    @property
+    def surplus(self) -> int:
+        """Get the number of idle runners that the pool keeps above its target."""
+        return max(self.idle - self.target, 0)
+
+    def is_waiting(self, runner_id: str) -> bool:
+        """
+        Check whether a runner of the pool is waiting for a job.
+
+        Args:
+            runner_id: The id of the runner.
+
+        Returns:
+            True if the runner is in the pool and wasn't claimed for a job.
+        """
+        return runner_id in self._members and runner_id not in self._claimed
+
+    @property
+    def unclaimed(self) -> list[str]:
+        """Get the ids of the runners that no job was claimed from."""
+        return list(self._members - self._claimed)
+
+    @property
+    def claimed(self) -> list[str]:
+        """Get the ids of the runners that were claimed for a job."""
+        return list(self._claimed)
+
+    def mark_claimed(self, runner_ids: set[str]) -> None:
+        """
+        Mark runners of the pool as claimed for a job.
+
+        Args:
+            runner_ids: The ids of the runners, which may include runners
+                of other pools.
+        """
+        claimed = runner_ids & self._members
+
+        if not claimed <= self._claimed:
+            self._claimed |= claimed
+            self._changed.set()
+
+    def predict(self, jobs: int) -> None:
+        """
+        Set the number of jobs that are predicted to be queued soon.
+
+        Args:
+            jobs: The number of jobs.
+        """
+        if jobs != self.predicted:
+            self.predicted = jobs
+            self._changed.set()
+
+    def add(self, runner_id: str) -> None:
+        """
+        Add a runner that was started for the pool.
+
+        Args:
+            runner_id: The id of the runner.
+        """
+        self._members.add(runner_id)
+
+    def remove(self, runner_id: str) -> bool:
+        """
+        Remove a runner that exited from the pool.
+
+        Args:
+            runner_id: The id of the runner.
+
+        Returns:
+            True if the runner was claimed for a job.
+        """
+        if runner_id not in self._members:
+            return False
+
+        claimed = runner_id in self._claimed
+        self._members.discard(runner_id)
+        self._claimed.discard(runner_id)
+        self._changed.set()
+
+        return claimed
+
+    async def wait_for_deficit(self) -> None:
+        """Wait until the pool has fewer idle runners than its target."""
+        while self.idle >= self.target:
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class WarmPoolManager:
+    """
+    Keep warm pools of idle, already registered runners.
+
+    Queued jobs for an owner or repo with a warm pool are served by one of
+    its idle runners, and the pool is then topped back up in the background,
+    so the job doesn't have to wait for a container to boot and register.
+    The configured warm pools are of the default runner class, so they
+    only serve the jobs that are routed to it.
+
+    Warm runners are labelled as such, so the pools are rebuilt from the
+    runners that the capacity manager finds on the hosts, including the
+    runners started before a restart or by another process. The claims on
+    the runners are leased from a lease store, which can be shared by
+    several processes, so that a runner is only claimed for one job
+    whichever process handles it. Every process keeps renewing the claims
+    on the runners of its pools until they exit.
+
+    A pool only grows to its target on its own. The runners that a pool
+    keeps above its target, such as once a predicted burst has passed, are
+    retired by the reaper, which can tell from Github that they are idle.
+    """
+
+    pools: dict[tuple[str, str | None, str], WarmPool]
+    claim_timeout: int
+    _claims: LeaseStore
+
+    def __init__(
+        self,
+        capacity: CapacityManager,
+        runner_classes: RunnerClassRegistry,
+    ) -> None:
+        """
+        Create a new warm pool manager.
+
+        Args:
+            capacity: The capacity manager that reports started and exited
+                runners.
+            runner_classes: The registry of the runner classes.
+        """
+        self.pools = {}
+        self._runner_classes = runner_classes
+        self._added: asyncio.Queue[WarmPool] = asyncio.Queue()
+        self._renewer: asyncio.Task[None] | None = None
+        self._background: set[asyncio.Task[None]] = set()
+        capacity.add_start_listener(self._add)
+        capacity.add_exit_listener(self._remove)
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Initialize the warm pools.
+
+        Args:
+            settings: The settings to use for the pools.
+        """
+        self.pools = {}
+        self._added = asyncio.Queue()
+        self.claim_timeout = settings.lease.timeout
+        self._claims = create_lease_store(settings.lease, "claims")
+
+        if settings.runner.warm_pool_size <= 0 or not settings.docker.enabled:
+            return
+
+        for target in settings.runner.warm_pool_owners:
+            owner, _, repo = target.partition("/")
+            logger.debug(
+                f"Keeping {settings.runner.warm_pool_size} warm runners for {target}"
+            )
+            pool = self.get(owner, repo or None, self._runner_classes.default)
+            pool.size = settings.runner.warm_pool_size
+
+    async def start(self) -> None:
+        """Start renewing the claims on the warm runners."""
+        self._renewer = asyncio.create_task(self._renew_claims())
+
+    async def close(self) -> None:
+        """Close the warm pools."""
+        if self._renewer is not None:
+            self._renewer.cancel()
+
+        await asyncio.gather(*self._background, return_exceptions=True)
+        await self._claims.close()
+
+    def get(self, owner: str, repo: str | None, runner_class: RunnerClass) -> WarmPool:
+        """
+        Get the warm pool of an owner or repo and runner class.
+
+        A new pool starts empty, and is handed to :meth:`added` so that it
+        can be replenished.
+
+        Args:
+            owner: The owner that the runners are registered to.
+            repo: The repo that the runners are registered to, or None
+                if the runners are registered to an org.
+            runner_class: The class of the runners.
+
+        Returns:
+            The warm pool.
+        """
+        key = (owner, repo, runner_class.name)
+        pool = self.pools.get(key)
+
+        if pool is None:
+            pool = self.pools[key] = WarmPool(owner, repo, 0, runner_class)
+            self._added.put_nowait(pool)
+
+        return pool
+
+    async def added(self) -> WarmPool:
+        """
+        Wait for a new warm pool.
+
+        Returns:
+            The warm pool.
+        """
+        return await self._added.get()
+
+    async def claim(
+        self,
+        owner: str,
+        repo: str | None,
+        runner_class: RunnerClass,
+    ) -> bool:
+        """
+        Claim an idle runner for a queued job.
+
+        Args:
+            owner: The owner of the job.
+            repo: The repo of the job, or None for an org job.
+            runner_class: The runner class that the job was routed to.
+
+        Returns:
+            True if an idle runner from a warm pool will pick up the job.
+        """
+        pool = self.pools.get((owner, repo, runner_class.name))
+
+        if pool is None:
+            return False
+
+        for runner_id in pool.unclaimed:
+            try:
+                claimed = await self._claims.take(runner_id, self.claim_timeout)
+            except Exception as e:
+                logger.error(f"Failed to claim warm runner {runner_id}: {e}")
+                return False
+
+            # Either way, the runner is no longer free for the next job
+            pool.mark_claimed({runner_id})
+
+            if claimed:
+                return True
+
+        return False
+
+    def waiting_pool(self, runner_id: str) -> WarmPool | None:
+        """
+        Get the pool that a runner is waiting in for a job.
+
+        Args:
+            runner_id: The id of the runner.
+
+        Returns:
+            The pool, or None if the runner isn't an unclaimed warm runner.
+        """
+        for pool in self.pools.values():
+            if pool.is_waiting(runner_id):
+                return pool
+
+        return None
+
+    async def retire(self, runner_id: str) -> bool:
+        """
+        Take a runner out of its pool, if the pool has a surplus.
+
+        The runner is claimed like for a job, so that no process serves a
+        job from it while it is stopped. The claim is released once the
+        runner exits.
+
+        Args:
+            runner_id: The id of the runner.
+
+        Returns:
+            True if the runner was taken out, and should be stopped.
+        """
+        pool = self.waiting_pool(runner_id)
+
+        if pool is None or pool.surplus <= 0:
+            return False
+
+        try:
+            claimed = await self._claims.take(runner_id, self.claim_timeout)
+        except Exception as e:
+            logger.error(f"Failed to retire warm runner {runner_id}: {e}")
+            return False
+
+        # Either way, the runner is no longer free for the next job
+        pool.mark_claimed({runner_id})
+
+        return claimed
+
+    def _add(self, record: RunnerRecord) -> None:
+        """
+        Add a warm runner that was seen running to its pool.
+
+        Args:
+            record: The record of the runner.
+        """
+        if not record.warm or record.owner is None:
+            return
+
+        runner_class = self._runner_classes.get(record.runner_class)
+        self.get(record.owner, record.repo, runner_class).add(record.id)
+
+    def _remove(self, runner_id: str) -> None:
+        """
+        Remove an exited runner from its pool, and release its claim.
+
+        Args:
+            runner_id: The id of the runner.
+        """
+        for pool in self.pools.values():
+            if pool.remove(runner_id):
+                task = asyncio.create_task(self._release_claim(runner_id))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+
+    async def _release_claim(self, runner_id: str) -> None:
+        """
+        Release the claim on a runner that exited.
+
+        Args:
+            runner_id: The id of the runner.
+        """
+        try:
+            await self._claims.release(runner_id)
+        except Exception as e:
+            logger.error(f"Failed to release the claim on runner {runner_id}: {e}")
+
+    async def _renew_claims(self) -> None:
+        """Keep the claims of every process in sync, and renew them."""
+        while True:
+            await asyncio.sleep(self.claim_timeout / 3)
+
+            try:
+                held = set(await self._claims.held())
+                claimed: list[str] = []
+
+                for pool in self.pools.values():
+                    pool.mark_claimed(held)
+                    claimed.extend(pool.claimed)
+
+                if claimed:
+                    await self._claims.hold(claimed, self.claim_timeout)
+            except Exception as e:
+                logger.error(f"Failed to renew the warm runner claims: {e}")
@@ -2,6 +2,7 @@
 
 from autoscaler.config import (
     Settings,
+    RunnerClass,
     RunnerSettings,
 )
 
@@ -15,20 +16,43 @@ class Service(Protocol):
         """Initialize the service."""
         ...
 
+    async def start(self) -> None:
+        """Start the background work of the service."""
+        ...
+
     async def close(self) -> None:
         """Close the service."""
         ...
 
 
-class RunnerProvider(Protocol):
-    """A protocol for runner providers."""
+class AsyncRunnerProvider(Protocol):
+    """
+    A protocol for runner providers with a non-blocking API.
+
+    Providers that talk to their backend over the network implement it
+    with async methods, so that calls to the backend don't stall the event
+    loop while the app handles other requests.
+    """
 
     settings: RunnerSettings
 
-    def start_runner(self, *, url: str, token: str) -> None:
+    async def start_runner(
+        self,
+        *,
+        url: str,
+        token: str,
+        owner: str,
+        repo: str | None = None,
+        runner_class: RunnerClass | None = None,
+        warm: bool = False,
+    ) -> str:
         """Start a runner."""
         ...
 
-    def count_runners(self) -> int:
+    async def remove_runner(self, runner_id: str) -> None:
+        """Stop a runner and remove it."""
+        ...
+
+    async def count_runners(self) -> int:
         """Count the number of runners."""
         ...
@@ -0,0 +1,962 @@
+"""A module for the queue of jobs waiting for a runner."""
+
+import asyncio
+import fnmatch
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+
+from typing import Protocol
+
+from loguru import logger
+
+from autoscaler.config import (
+    QueueSettings,
+    Settings,
+)
+from autoscaler.models import (
+    JobPriority,
+    ProvisioningJob,
+    WorkflowJobEvent,
+)
+from autoscaler.services.resp import RespClient
+
+
+class QueueBackend(Protocol):
+    """
+    A protocol for the storage of the provisioning queue.
+
+    Jobs are keyed by the id of the workflow job, and the ids of the jobs
+    that were queued are remembered for a while after they leave the queue,
+    so a job can't be queued twice, even once a runner was started for it.
+    Jobs are handed out most urgent first, and in the order they were queued
+    for the same priority. Jobs are leased to the worker that takes them,
+    and handed out again if the lease expires before the job is
+    acknowledged, so that every job is provisioned at least once. Jobs that
+    are cancelled are marked as such for a while, so that the worker that
+    leased the job, in whichever process, notices it.
+    """
+
+    async def put(self, job: ProvisioningJob, history_ttl: float) -> bool:
+        """Queue a job, returning False if it was queued recently."""
+        ...
+
+    async def claim(self, lease_timeout: float, limit: int) -> list[ProvisioningJob]:
+        """Lease up to a number of the most urgent available jobs."""
+        ...
+
+    async def ack(self, job_id: int) -> None:
+        """Remove a job that was handled."""
+        ...
+
+    async def nack(self, job: ProvisioningJob) -> None:
+        """Give a job back to the queue to be handled again."""
+        ...
+
+    async def renew(self, job_ids: list[int], lease_timeout: float) -> None:
+        """Extend the leases of jobs that are still being handled."""
+        ...
+
+    async def cancel(self, job_id: int, history_ttl: float) -> None:
+        """Remove a job, marking it as cancelled for a while."""
+        ...
+
+    async def cancelled(self, job_ids: list[int]) -> set[int]:
+        """Find the jobs, out of some, that were cancelled."""
+        ...
+
+    async def size(self) -> int:
+        """Count the queued and leased jobs."""
+        ...
+
+    async def close(self) -> None:
+        """Close the backend."""
+        ...
+
+
+class MemoryQueueBackend:
+    """A queue backend that keeps the jobs in memory."""
+
+    def __init__(self) -> None:
+        """Create a new in-memory queue."""
+        self._jobs: dict[int, ProvisioningJob] = {}
+        self._pending: list[tuple[JobPriority, int, int]] = []
+        self._order = itertools.count()
+        self._leases: dict[int, float] = {}
+        self._history: dict[int, float] = {}
+        self._cancelled: dict[int, float] = {}
+
+    async def put(self, job: ProvisioningJob, history_ttl: float) -> bool:
+        """
+        Queue a job.
+
+        Args:
+            job: The job to queue.
+            history_ttl: The time, in seconds, for which to remember it.
+
+        Returns:
+            False if the job was queued recently.
+        """
+        now = time.time()
+
+        # The jobs are remembered in order, so the expired ones come first
+        for job_id, expires in list(self._history.items()):
+            if expires >= now:
+                break
+
+            del self._history[job_id]
+
+        # A job remembered for less time than the ones before it may expire first
+        if job.id in self._jobs or self._history.get(job.id, 0.0) >= now:
+            return False
+
+        self._history.pop(job.id, None)
+        self._history[job.id] = now + history_ttl
+        self._jobs[job.id] = job
+        self._push(job)
+
+        return True
+
+    def _push(self, job: ProvisioningJob) -> None:
+        """Make a job available, behind the jobs of the same priority."""
+        heapq.heappush(self._pending, (job.priority, next(self._order), job.id))
+
+    async def claim(self, lease_timeout: float, limit: int) -> list[ProvisioningJob]:
+        """
+        Lease up to a number of the most urgent available jobs.
+
+        Args:
+            lease_timeout: The time, in seconds, until the leases expire.
+            limit: The maximum number of jobs to lease.
+
+        Returns:
+            The jobs, most urgent first, and oldest first for the same
+            priority.
+        """
+        now = time.time()
+        jobs: list[ProvisioningJob] = []
+
+        for job_id, expires in list(self._leases.items()):
+            if expires < now:
+                del self._leases[job_id]
+
+                if job_id in self._jobs:
+                    self._push(self._jobs[job_id])
+
+        while self._pending and len(jobs) < limit:
+            _, _, job_id = heapq.heappop(self._pending)
+
+            # Jobs removed or handed out while they were waiting are skipped
+            if job_id in self._jobs and job_id not in self._leases:
+                self._leases[job_id] = now + lease_timeout
+                jobs.append(self._jobs[job_id])
+
+        return jobs
+
+    async def ack(self, job_id: int) -> None:
+        """
+        Remove a job that was handled.
+
+        Args:
+            job_id: The id of the job.
+        """
+        self._leases.pop(job_id, None)
+        self._jobs.pop(job_id, None)
+
+    async def nack(self, job: ProvisioningJob) -> None:
+        """
+        Give a job back to the queue.
+
+        Args:
+            job: The job, with its updated number of attempts.
+        """
+        if self._leases.pop(job.id, None) is not None:
+            self._jobs[job.id] = job
+            self._push(job)
+
+    async def renew(self, job_ids: list[int], lease_timeout: float) -> None:
+        """
+        Extend the leases of jobs that are still being handled.
+
+        Args:
+            job_ids: The ids of the jobs.
+            lease_timeout: The time, in seconds, until the leases expire.
+        """
+        for job_id in job_ids:
+            if job_id in self._leases:
+                self._leases[job_id] = time.time() + lease_timeout
+
+    async def cancel(self, job_id: int, history_ttl: float) -> None:
+        """
+        Remove a job, marking it as cancelled.
+
+        Args:
+            job_id: The id of the job.
+            history_ttl: The time, in seconds, for which to remember it.
+        """
+        now = time.time()
+
+        for cancelled_id, expires in list(self._cancelled.items()):
+            if expires < now:
+                del self._cancelled[cancelled_id]
+
+        self._cancelled[job_id] = now + history_ttl
+        await self.ack(job_id)
+
+    async def cancelled(self, job_ids: list[int]) -> set[int]:
+        """
+        Find the jobs that were cancelled.
+
+        Args:
+            job_ids: The ids of the jobs.
+
+        Returns:
+            The ids of the cancelled jobs.
+        """
+        now = time.time()
+
+        return {job_id for job_id in job_ids if self._cancelled.get(job_id, 0.0) >= now}
+
+    async def size(self) -> int:
+        """Count the queued and leased jobs."""
+        return len(self._jobs)
+
+    async def close(self) -> None:
+        """Close the backend."""
+
+
+class SqliteQueueBackend:
+    """
+    A queue backend that stores the jobs in a SQLite database.
+
+    The database can be shared by every worker process on a host, and
+    jobs survive restarts. Jobs whose lease has expired are available
+    again, so jobs held by a process that died are handed out again.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open the database, creating the jobs table if needed.
+
+        Args:
+            path: The path of the database file.
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " enqueued_at REAL NOT NULL,"
+            " leased_until REAL,"
+            f" priority INTEGER NOT NULL DEFAULT {JobPriority.NORMAL.value}"
+            ")"
+        )
+
+        # Databases created before jobs had a priority don't have its column
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+
+        if "priority" not in columns:
+            self._db.execute(
+                "ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL"
+                f" DEFAULT {JobPriority.NORMAL.value}"
+            )
+
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_priority_enqueued_at"
+            " ON jobs (priority, enqueued_at)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " id INTEGER PRIMARY KEY,"
+            " expires REAL NOT NULL"
+            ")"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS history_expires ON history (expires)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cancelled ("
+            " id INTEGER PRIMARY KEY,"
+            " expires REAL NOT NULL"
+            ")"
+        )
+
+    def _put(self, job: ProvisioningJob, history_ttl: float) -> bool:
+        """Insert a job unless it was queued recently, in one transaction."""
+        now = time.time()
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+
+            try:
+                self._db.execute("DELETE FROM history WHERE expires < ?", (now,))
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO history (id, expires) VALUES (?, ?)",
+                    (job.id, now + history_ttl),
+                )
+                queued = cursor.rowcount > 0
+
+                if queued:
+                    cursor = self._db.execute(
+                        "INSERT OR IGNORE INTO jobs"
+                        " (id, payload, enqueued_at, priority) VALUES (?, ?, ?, ?)",
+                        (job.id, job.model_dump_json(), now, job.priority.value),
+                    )
+                    queued = cursor.rowcount > 0
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._db.execute("COMMIT")
+
+        return queued
+
+    async def put(self, job: ProvisioningJob, history_ttl: float) -> bool:
+        """
+        Queue a job.
+
+        Args:
+            job: The job to queue.
+            history_ttl: The time, in seconds, for which to remember it.
+
+        Returns:
+            False if the job was queued recently.
+        """
+        return await asyncio.to_thread(self._put, job, history_ttl)
+
+    def _claim(self, lease_timeout: float, limit: int) -> list[ProvisioningJob]:
+        """Lease the most urgent available jobs in one transaction."""
+        now = time.time()
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+
+            try:
+                rows = self._db.execute(
+                    "SELECT id, payload FROM jobs"
+                    " WHERE leased_until IS NULL OR leased_until < ?"
+                    " ORDER BY priority, enqueued_at LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+
+                self._db.executemany(
+                    "UPDATE jobs SET leased_until = ? WHERE id = ?",
+                    [(now + lease_timeout, row[0]) for row in rows],
+                )
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._db.execute("COMMIT")
+
+        return [ProvisioningJob.model_validate_json(row[1]) for row in rows]
+
+    async def claim(self, lease_timeout: float, limit: int) -> list[ProvisioningJob]:
+        """
+        Lease up to a number of the most urgent available jobs.
+
+        Args:
+            lease_timeout: The time, in seconds, until the leases expire.
+            limit: The maximum number of jobs to lease.
+
+        Returns:
+            The jobs, most urgent first, and oldest first for the same
+            priority.
+        """
+        return await asyncio.to_thread(self._claim, lease_timeout, limit)
+
+    def _execute(self, query: str, *params: tuple[object, ...]) -> None:
+        """Run a write query once per set of parameters."""
+        with self._lock:
+            self._db.executemany(query, params)
+
+    async def ack(self, job_id: int) -> None:
+        """
+        Remove a job that was handled.
+
+        Args:
+            job_id: The id of the job.
+        """
+        await asyncio.to_thread(
+            self._execute,
+            "DELETE FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+
+    async def nack(self, job: ProvisioningJob) -> None:
+        """
+        Give a job back to the queue.
+
+        Args:
+            job: The job, with its updated number of attempts.
+        """
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET payload = ?, enqueued_at = ?, leased_until = NULL"
+            " WHERE id = ?",
+            (job.model_dump_json(), time.time(), job.id),
+        )
+
+    async def renew(self, job_ids: list[int], lease_timeout: float) -> None:
+        """
+        Extend the leases of jobs that are still being handled.
+
+        Args:
+            job_ids: The ids of the jobs.
+            lease_timeout: The time, in seconds, until the leases expire.
+        """
+        expires = time.time() + lease_timeout
+
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET leased_until = ? WHERE id = ?",
+            *[(expires, job_id) for job_id in job_ids],
+        )
+
+    def _cancel(self, job_id: int, history_ttl: float) -> None:
+        """Remove a job and mark it as cancelled in one transaction."""
+        now = time.time()
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+
+            try:
+                self._db.execute("DELETE FROM cancelled WHERE expires < ?", (now,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cancelled (id, expires) VALUES (?, ?)",
+                    (job_id, now + history_ttl),
+                )
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._db.execute("COMMIT")
+
+    async def cancel(self, job_id: int, history_ttl: float) -> None:
+        """
+        Remove a job, marking it as cancelled.
+
+        Args:
+            job_id: The id of the job.
+            history_ttl: The time, in seconds, for which to remember it.
+        """
+        await asyncio.to_thread(self._cancel, job_id, history_ttl)
+
+    def _cancelled(self, job_ids: list[int]) -> set[int]:
+        """Select the cancelled jobs, blocking on the database."""
+        placeholders = ", ".join("?" * len(job_ids))
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM cancelled WHERE expires >= ?"  # nosec B608
+                f" AND id IN ({placeholders})",
+                (time.time(), *job_ids),
+            ).fetchall()
+
+        return {row[0] for row in rows}
+
+    async def cancelled(self, job_ids: list[int]) -> set[int]:
+        """
+        Find the jobs that were cancelled.
+
+        Args:
+            job_ids: The ids of the jobs.
+
+        Returns:
+            The ids of the cancelled jobs.
+        """
+        if not job_ids:
+            return set()
+
+        return await asyncio.to_thread(self._cancelled, job_ids)
+
+    def _size(self) -> int:
+        """Count the jobs, blocking on the database."""
+        with self._lock:
+            return int(self._db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0])
+
+    async def size(self) -> int:
+        """Count the queued and leased jobs."""
+        return await asyncio.to_thread(self._size)
+
+    async def close(self) -> None:
+        """Close the database."""
+        self._db.close()
+
+
+class RedisQueueBackend:
+    """
+    A queue backend that stores the jobs on a server speaking the Redis protocol.
+
+    Jobs are kept in a hash keyed by job id, the ids of available jobs in a
+    list per priority, and the leases in a sorted set scored by their expiry
+    time, as are the ids of the jobs that were queued or cancelled recently.
+    Only plain commands and ``MULTI``/``EXEC`` transactions are used,
+    without scripts, so any server that implements the Redis protocol can
+    be used.
+    """
+
+    def __init__(self, url: str, prefix: str) -> None:
+        """
+        Create a new Redis queue.
+
+        Args:
+            url: The URL of the server.
+            prefix: The prefix of the keys used for the queue.
+        """
+        self._client = RespClient(url)
+        self._jobs = f"{prefix}:jobs"
+        # The normal priority keeps the key that every job used to be put on
+        self._pending = {
+            priority: f"{prefix}:pending"
+            if priority == JobPriority.NORMAL
+            else f"{prefix}:pending:{priority.name.lower()}"
+            for priority in JobPriority
+        }
+        self._leases = f"{prefix}:leases"
+        self._history = f"{prefix}:history"
+        self._cancelled = f"{prefix}:cancelled"
+
+    async def put(self, job: ProvisioningJob, history_ttl: float) -> bool:
+        """
+        Queue a job.
+
+        The job is remembered, stored and made available in a single
+        transaction, so a crash can't leave a job that is remembered but
+        never handed out. Two processes that queue the same job at once
+        may both make it available, but only one of them stores it, and
+        :meth:`claim` skips the job that is already leased.
+
+        Args:
+            job: The job to queue.
+            history_ttl: The time, in seconds, for which to remember it.
+
+        Returns:
+            False if the job was queued recently.
+        """
+        now = time.time()
+        await self._client.execute("ZREMRANGEBYSCORE", self._history, "-inf", now)
+
+        if await self._client.execute("ZSCORE", self._history, job.id) is not None:
+            return False
+
+        added, _, _ = await self._client.transaction(
+            ("ZADD", self._history, "NX", now + history_ttl, job.id),
+            ("HSETNX", self._jobs, job.id, job.model_dump_json()),
+            ("RPUSH", self._pending[job.priority], job.id),
+        )
+
+        return bool(added)
+
+    async def _reclaim(self) -> None:
+        """Make the jobs with expired leases available again."""
+        expired = await self._client.execute(
+            "ZRANGEBYSCORE", self._leases, "-inf", time.time(), "LIMIT", 0, 100
+        )
+
+        for job_id in expired:
+            # Only the process that removes the lease puts the job back
+            if not await self._client.execute("ZREM", self._leases, job_id):
+                continue
+
+            payload = await self._client.execute("HGET", self._jobs, job_id)
+
+            if payload is not None:
+                job = ProvisioningJob.model_validate_json(payload)
+                pending = self._pending[job.priority]
+                await self._client.execute("RPUSH", pending, job_id)
+
+    async def claim(self, lease_timeout: float, limit: int) -> list[ProvisioningJob]:
+        """
+        Lease up to a number of the most urgent available jobs.
+
+        Each job is leased before it is removed from the list of available
+        jobs, so a crash in between can only cause it to be handed out twice,
+        never lost.
+
+        Args:
+            lease_timeout: The time, in seconds, until the leases expire.
+            limit: The maximum number of jobs to lease.
+
+        Returns:
+            The jobs, most urgent first, and oldest first for the same
+            priority.
+        """
+        await self._reclaim()
+        jobs: list[ProvisioningJob] = []
+
+        for pending in self._pending.values():
+            await self._claim_from(pending, lease_timeout, limit, jobs)
+
+        return jobs
+
+    async def _claim_from(
+        self,
+        pending: str,
+        lease_timeout: float,
+        limit: int,
+        jobs: list[ProvisioningJob],
+    ) -> None:
+        """
+        Lease the oldest jobs of a list of available jobs, up to a limit.
+
+        Args:
+            pending: The key of the list.
+            lease_timeout: The time, in seconds, until the leases expire.
+            limit: The maximum number of jobs, including those already leased.
+            jobs: The jobs that were leased, which are added to.
+        """
+        while len(jobs) < limit:
+            job_ids = await self._client.execute(
+                "LRANGE", pending, 0, limit - len(jobs) - 1
+            )
+
+            if not job_ids:
+                break
+
+            for job_id in job_ids:
+                leased = await self._client.execute(
+                    "ZADD", self._leases, "NX", time.time() + lease_timeout, job_id
+                )
+                await self._client.execute("LREM", pending, 1, job_id)
+
+                if not leased:
+                    continue
+
+                payload = await self._client.execute("HGET", self._jobs, job_id)
+
+                if payload is None:
+                    await self._client.execute("ZREM", self._leases, job_id)
+                    continue
+
+                jobs.append(ProvisioningJob.model_validate_json(payload))
+
+    async def ack(self, job_id: int) -> None:
+        """
+        Remove a job that was handled.
+
+        Args:
+            job_id: The id of the job.
+        """
+        await self._client.transaction(
+            ("ZREM", self._leases, job_id),
+            *[("LREM", pending, 0, job_id) for pending in self._pending.values()],
+            ("HDEL", self._jobs, job_id),
+        )
+
+    async def nack(self, job: ProvisioningJob) -> None:
+        """
+        Give a job back to the queue.
+
+        Args:
+            job: The job, with its updated number of attempts.
+        """
+        await self._client.execute("HSET", self._jobs, job.id, job.model_dump_json())
+
+        if await self._client.execute("ZREM", self._leases, job.id):
+            await self._client.execute("RPUSH", self._pending[job.priority], job.id)
+
+    async def renew(self, job_ids: list[int], lease_timeout: float) -> None:
+        """
+        Extend the leases of jobs that are still being handled.
+
+        Args:
+            job_ids: The ids of the jobs.
+            lease_timeout: The time, in seconds, until the leases expire.
+        """
+        expires = time.time() + lease_timeout
+
+        for job_id in job_ids:
+            await self._client.execute("ZADD", self._leases, "XX", expires, job_id)
+
+    async def cancel(self, job_id: int, history_ttl: float) -> None:
+        """
+        Remove a job, marking it as cancelled.
+
+        Args:
+            job_id: The id of the job.
+            history_ttl: The time, in seconds, for which to remember it.
+        """
+        now = time.time()
+
+        await self._client.transaction(
+            ("ZREMRANGEBYSCORE", self._cancelled, "-inf", now),
+            ("ZADD", self._cancelled, now + history_ttl, job_id),
+            ("ZREM", self._leases, job_id),
+            *[("LREM", pending, 0, job_id) for pending in self._pending.values()],
+            ("HDEL", self._jobs, job_id),
+        )
+
+    async def cancelled(self, job_ids: list[int]) -> set[int]:
+        """
+        Find the jobs that were cancelled.
+
+        Args:
+            job_ids: The ids of the jobs.
+
+        Returns:
+            The ids of the cancelled jobs.
+        """
+        if not job_ids:
+            return set()
+
+        now = time.time()
+        expiries = await self._client.transaction(
+            *[("ZSCORE", self._cancelled, job_id) for job_id in job_ids]
+        )
+
+        return {
+            job_id
+            for job_id, expires in zip(job_ids, expiries)
+            if expires is not None and float(expires) >= now
+        }
+
+    async def size(self) -> int:
+        """Count the queued and leased jobs."""
+        return int(await self._client.execute("HLEN", self._jobs))
+
+    async def close(self) -> None:
+        """Close the connection to the server."""
+        await self._client.close()
+
+
+class ProvisioningQueue:
+    """
+    A queue of jobs waiting for a runner.
+
+    Webhooks put jobs on the queue, and a bounded pool of workers takes
+    them off, so that pending jobs survive restarts (with a persistent
+    backend), can be shared by several processes, and don't each hold a
+    coroutine while they wait. The most urgent jobs are taken off first,
+    and jobs that waited past the autoscale timeout are dropped instead.
+    """
+
+    settings: QueueSettings
+    timeout: float
+    _backend: QueueBackend
+
+    def __init__(self) -> None:
+        """Create a new provisioning queue."""
+        self._ready = asyncio.Event()
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Initialize the queue, opening the configured backend.
+
+        Args:
+            settings: The settings to use for the queue.
+        """
+        self.settings = settings.queue
+        self.timeout = settings.runner.autoscale_timeout
+
+        logger.debug(f"Using the {self.settings.backend} queue backend")
+
+        if self.settings.backend == "sqlite":
+            self._backend = SqliteQueueBackend(self.settings.sqlite_path)
+        elif self.settings.backend == "redis":
+            self._backend = RedisQueueBackend(
+                self.settings.redis_url,
+                self.settings.redis_prefix,
+            )
+        else:
+            self._backend = MemoryQueueBackend()
+
+    async def start(self) -> None:
+        """Start the queue."""
+
+    async def close(self) -> None:
+        """Close the queue."""
+        await self._backend.close()
+
+    def priority(self, event: WorkflowJobEvent) -> JobPriority:
+        """
+        Decide how urgently the job of a webhook needs a runner.
+
+        Args:
+            event: The workflow job event of the job.
+
+        Returns:
+            HIGH for the jobs of the default branch, and of the configured
+            branches and workflows, and NORMAL for the other jobs.
+        """
+        branch = event.head_branch
+
+        if branch is not None:
+            if self.settings.priority_default_branch and branch == event.default_branch:
+                return JobPriority.HIGH
+
+            if any(
+                fnmatch.fnmatchcase(branch, pattern)
+                for pattern in self.settings.priority_branches
+            ):
+                return JobPriority.HIGH
+
+        if event.workflow_name is not None and any(
+            fnmatch.fnmatchcase(event.workflow_name, pattern)
+            for pattern in self.settings.priority_workflows
+        ):
+            return JobPriority.HIGH
+
+        return JobPriority.NORMAL
+
+    async def put(self, job: ProvisioningJob) -> bool:
+        """
+        Queue a job.
+
+        Args:
+            job: The job to queue.
+
+        Returns:
+            False if the job was queued recently, by any process.
+        """
+        queued = await self._backend.put(job, self.settings.history_ttl)
+        self._ready.set()
+
+        return queued
+
+    async def get_batch(self, limit: int) -> list[ProvisioningJob]:
+        """
+        Take the most urgent jobs off the queue, waiting for one if needed.
+
+        Once a job is available, the jobs queued within the batch window are
+        taken along with it, so that a burst of jobs is handled together.
+        The jobs are leased to the caller, which must renew the leases while
+        it handles the jobs, and then either ack or nack each of them.
+
+        Args:
+            limit: The maximum number of jobs to take.
+
+        Returns:
+            The jobs, most urgent first.
+        """
+        while True:
+            self._ready.clear()
+            jobs = await self._claim(limit)
+
+            if jobs:
+                break
+
+            # Jobs queued by other processes are only noticed when polling
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.settings.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.settings.batch_window
+
+        while len(jobs) < limit and loop.time() < deadline:
+            self._ready.clear()
+
+            try:
+                await asyncio.wait_for(self._ready.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                pass
+
+            jobs += await self._claim(limit - len(jobs))
+
+        return jobs
+
+    async def _claim(self, limit: int) -> list[ProvisioningJob]:
+        """
+        Lease the most urgent jobs, dropping those past the autoscale timeout.
+
+        A job that waited past the timeout would not be given a runner, so
+        it is dropped rather than taking up a worker.
+
+        Args:
+            limit: The maximum number of jobs to lease.
+
+        Returns:
+            The jobs that are still within the timeout.
+        """
+        jobs: list[ProvisioningJob] = []
+        now = time.time()
+
+        for job in await self._backend.claim(self.settings.lease_timeout, limit):
+            if now - job.queued_at < self.timeout:
+                jobs.append(job)
+                continue
+
+            logger.error(
+                f"Dropping job {job.id} after waiting {now - job.queued_at:.0f}s"
+            )
+            await self._backend.ack(job.id)
+
+        return jobs
+
+    async def ack(self, job: ProvisioningJob) -> None:
+        """
+        Remove a job that was handled.
+
+        Args:
+            job: The job.
+        """
+        await self._backend.ack(job.id)
+
+    async def remove(self, job_id: int) -> None:
+        """
+        Take a job off the queue, whether or not it is being handled.
+
+        The job is marked as cancelled, so that a worker of any process that
+        is handling it finds out through :meth:`cancelled`.
+
+        Args:
+            job_id: The id of the job.
+        """
+        await self._backend.cancel(job_id, self.settings.history_ttl)
+
+    async def cancelled(self, jobs: list[ProvisioningJob]) -> set[int]:
+        """
+        Find the jobs being handled that were taken off the queue since.
+
+        Args:
+            jobs: The jobs.
+
+        Returns:
+            The ids of the jobs that were cancelled.
+        """
+        return await self._backend.cancelled([job.id for job in jobs])
+
+    async def nack(self, job: ProvisioningJob) -> None:
+        """
+        Give a job that failed back to the queue, unless it failed too often.
+
+        Args:
+            job: The job.
+        """
+        job = job.model_copy(update={"attempts": job.attempts + 1})
+
+        if job.attempts >= self.settings.max_attempts:
+            logger.error(f"Dropping job {job.id} after {job.attempts} attempts")
+            await self._backend.ack(job.id)
+        else:
+            await self._backend.nack(job)
+            self._ready.set()
+
+    async def renew(self, jobs: list[ProvisioningJob]) -> None:
+        """
+        Extend the leases of jobs that are still being handled.
+
+        Args:
+            jobs: The jobs.
+        """
+        if jobs:
+            await self._backend.renew(
+                [job.id for job in jobs],
+                self.settings.lease_timeout,
+            )
+
+    async def size(self) -> int:
+        """Count the queued and leased jobs."""
+        return await self._backend.size()
@@ -0,0 +1,189 @@
+"""A minimal client for servers that speak the Redis protocol (RESP)."""
+
+import asyncio
+
+from typing import Any
+from urllib.parse import urlsplit
+
+
+class RespError(Exception):
+    """An error reply from the server."""
+
+
+class RespClient:
+    """
+    A minimal async client for the Redis serialization protocol.
+
+    Only what the autoscaler needs is supported: sending commands over a
+    single connection and reading the replies. Commands are sent one at a
+    time, so the client must not be used for blocking commands.
+    """
+
+    def __init__(self, url: str) -> None:
+        """
+        Create a new client.
+
+        Args:
+            url: The URL of the server, e.g. ``redis://:password@host:6379/0``.
+        """
+        self.url = url
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open the connection, authenticating and selecting the database."""
+        url = urlsplit(self.url)
+        reader, writer = await asyncio.open_connection(
+            url.hostname or "localhost",
+            url.port or 6379,
+            ssl=url.scheme == "rediss",
+        )
+        self._reader, self._writer = reader, writer
+
+        try:
+            if url.password:
+                await self._send(reader, writer, "AUTH", url.password)
+
+            if url.path.strip("/"):
+                await self._send(reader, writer, "SELECT", url.path.strip("/"))
+        except BaseException:
+            await self.close()
+            raise
+
+        return reader, writer
+
+    async def execute(self, *args: str | int | float) -> Any:
+        """
+        Send a command to the server and read its reply.
+
+        Args:
+            args: The command and its arguments.
+
+        Returns:
+            The decoded reply.
+
+        Raises:
+            RespError: If the server replied with an error.
+        """
+        async with self._lock:
+            reader, writer = await self._connection()
+
+            return await self._request(reader, writer, *args)
+
+    async def transaction(self, *commands: tuple[str | int | float, ...]) -> list[Any]:
+        """
+        Send commands in a ``MULTI``/``EXEC`` block, and read their replies.
+
+        The server runs the commands at once, without the commands of other
+        clients in between, and only once it has received all of them, so a
+        client that fails halfway through doesn't leave a partial update.
+
+        Args:
+            commands: The commands, each with its arguments.
+
+        Returns:
+            The decoded reply of each command.
+
+        Raises:
+            RespError: If the server rejected one of the commands, or
+                didn't run the transaction.
+        """
+        async with self._lock:
+            reader, writer = await self._connection()
+            await self._request(reader, writer, "MULTI")
+
+            try:
+                for command in commands:
+                    await self._request(reader, writer, *command)
+            except RespError:
+                await self._request(reader, writer, "DISCARD")
+                raise
+
+            replies = await self._request(reader, writer, "EXEC")
+
+        if replies is None:
+            raise RespError("The transaction was aborted")
+
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+
+        return list(replies)
+
+    async def _connection(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Get the open connection, or open one."""
+        if self._reader is None or self._writer is None:
+            return await self._connect()
+
+        return self._reader, self._writer
+
+    async def _request(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        *args: str | int | float,
+    ) -> Any:
+        """Send a command, closing the connection if its reply is lost."""
+        try:
+            return await self._send(reader, writer, *args)
+        except RespError:
+            raise
+        except BaseException:
+            # A reply left unread, such as when the caller is cancelled
+            # while waiting for it, would be read by the next command
+            await self.close()
+            raise
+
+    async def _send(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        *args: str | int | float,
+    ) -> Any:
+        """Write a command as an array of bulk strings and read the reply."""
+        parts = [str(arg).encode() for arg in args]
+        request = b"*%d\r\n" % len(parts) + b"".join(
+            b"$%d\r\n%s\r\n" % (len(part), part) for part in parts
+        )
+        writer.write(request)
+        await writer.drain()
+
+        return await self._read(reader)
+
+    async def _read(self, reader: asyncio.StreamReader, nested: bool = False) -> Any:
+        """
+        Read and decode a single reply.
+
+        Errors are raised, unless they are nested in an array, such as the
+        replies of a transaction, where they are returned so that the rest
+        of the array is still read.
+        """
+        line = (await reader.readuntil(b"\r\n"))[:-2]
+        kind, rest = line[:1], line[1:]
+
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            if nested:
+                return RespError(rest.decode())
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            if int(rest) < 0:
+                return None
+            return (await reader.readexactly(int(rest) + 2))[:-2].decode()
+        if kind == b"*":
+            if int(rest) < 0:
+                return None
+            return [await self._read(reader, nested=True) for _ in range(int(rest))]
+
+        raise RespError(f"Unexpected reply: {line!r}")
+
+    async def close(self) -> None:
+        """Close the connection."""
+        if self._writer is not None:
+            self._writer.close()
+
+        self._reader = self._writer = None
@@ -0,0 +1,291 @@
+"""A module for sharing the runner slots fairly between owners."""
+
+import asyncio
+import heapq
+import itertools
+import math
+
+from collections import Counter
+from typing import Callable
+
+from autoscaler.config import (
+    OwnerShare,
+    RunnerClass,
+)
+from autoscaler.models import JobPriority
+
+# A job waiting for a slot: its priority, deadline, place in line, future
+# and class. Jobs sort by priority, then deadline, then place in line.
+Waiter = tuple[JobPriority, float, int, asyncio.Future[bool], RunnerClass]
+
+# Heaps with more entries than this many times the waiting jobs are rebuilt
+COMPACT_RATIO = 2
+
+
+class FairShareScheduler:
+    """
+    Hand out free runner slots to the waiting jobs, fairly between owners.
+
+    The waiting jobs are kept in a heap per owner and runner class, so that
+    only the first job of each class needs to be looked at, and a class
+    that has no room is checked once per slot and then skipped for every
+    owner, however many jobs are waiting for it. A free slot goes to the
+    owner with the fewest runners for its weight, so that one owner's large
+    matrix only takes the slots that no other owner is waiting for. Owners
+    with fewer runners than their minimum go first, and owners with as many
+    runners as their maximum are skipped. Within an owner, and between
+    owners with the same share, the most urgent jobs are served first, and
+    then the jobs closest to their deadline.
+
+    Jobs that reach their deadline are dropped by a single timer, set for
+    the earliest deadline, rather than each job keeping its own timeout.
+    Jobs that stop waiting are only taken out of the heaps once they reach
+    the top, or when most of the heaps are made of them.
+    """
+
+    def __init__(self) -> None:
+        """Create a new scheduler."""
+        self._queues: dict[str, dict[str, list[Waiter]]] = {}
+        self._shares: dict[str, OwnerShare] = {}
+        self._order = itertools.count()
+        self._deadlines: list[tuple[float, int, asyncio.Future[bool]]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._waiting = 0
+        self._entries = 0
+
+    def configure(self, shares: list[OwnerShare]) -> None:
+        """
+        Set the shares of the owners.
+
+        Args:
+            shares: The shares of the owners that are configured.
+        """
+        self._shares = {share.owner: share for share in shares}
+
+    def share(self, owner: str) -> OwnerShare:
+        """
+        Get the share of an owner.
+
+        Args:
+            owner: The owner.
+
+        Returns:
+            The configured share, or an even share if none is configured.
+        """
+        share = self._shares.get(owner)
+
+        if share is None:
+            share = self._shares[owner] = OwnerShare(owner=owner)
+
+        return share
+
+    def is_capped(self, owner: str, usage: int) -> bool:
+        """
+        Check whether an owner has as many runners as it may have.
+
+        Args:
+            owner: The owner.
+            usage: The number of runners of the owner.
+
+        Returns:
+            True if the owner may not have another runner.
+        """
+        max_runners = self.share(owner).max_runners
+
+        return max_runners is not None and usage >= max_runners
+
+    @property
+    def waiting(self) -> int:
+        """Count the jobs that are waiting for a slot."""
+        return self._waiting
+
+    def add(
+        self,
+        owner: str,
+        runner_class: RunnerClass,
+        priority: JobPriority = JobPriority.NORMAL,
+        deadline: float | None = None,
+    ) -> asyncio.Future[bool]:
+        """
+        Put a job in line for a slot.
+
+        Args:
+            owner: The owner of the job.
+            runner_class: The class of the runner that the job needs.
+            priority: How urgently the job needs a runner.
+            deadline: The event loop time at which the job stops waiting,
+                or None to wait until it is given a slot.
+
+        Returns:
+            A future that is resolved with True when the job is given a
+            slot, or with False when it reaches its deadline. Jobs that
+            stop waiting cancel the future.
+        """
+        loop = asyncio.get_running_loop()
+        waiter: asyncio.Future[bool] = loop.create_future()
+        waiter.add_done_callback(self._done)
+        seq = next(self._order)
+        expires = math.inf if deadline is None else deadline
+
+        heapq.heappush(
+            self._queues.setdefault(owner, {}).setdefault(runner_class.name, []),
+            (priority, expires, seq, waiter, runner_class),
+        )
+        self._waiting += 1
+        self._entries += 1
+
+        if deadline is not None:
+            heapq.heappush(self._deadlines, (deadline, seq, waiter))
+
+            if self._timer is None or deadline < self._timer.when():
+                self._schedule(loop)
+
+        return waiter
+
+    def pop(
+        self,
+        usage: Counter[str],
+        fits: Callable[[RunnerClass], bool],
+    ) -> tuple[str, RunnerClass] | None:
+        """
+        Give a slot to the next job, resolving its future.
+
+        Args:
+            usage: The number of runners of each owner.
+            fits: Whether a runner of a class can be started now.
+
+        Returns:
+            The owner and runner class of the job, or None if no waiting
+            job can be given a slot now.
+        """
+        best: tuple[tuple[bool, float, JobPriority, float, int], str, Waiter] | None
+        best = None
+        fitting: dict[str, bool] = {}
+
+        for owner, classes in list(self._queues.items()):
+            if self.is_capped(owner, usage[owner]):
+                continue
+
+            entry = self._first_fitting(classes, fits, fitting)
+
+            if not classes:
+                del self._queues[owner]
+
+            if entry is None:
+                continue
+
+            share = self.share(owner)
+            key = (
+                usage[owner] >= share.min_runners,
+                usage[owner] / share.weight,
+                *entry[:3],
+            )
+
+            if best is None or key < best[0]:
+                best = (key, owner, entry)
+
+        if best is None:
+            return None
+
+        _, owner, (_, _, _, waiter, runner_class) = best
+        waiter.set_result(True)
+
+        return owner, runner_class
+
+    def _first_fitting(
+        self,
+        classes: dict[str, list[Waiter]],
+        fits: Callable[[RunnerClass], bool],
+        fitting: dict[str, bool],
+    ) -> Waiter | None:
+        """
+        Find the first job of an owner that a runner can be started for.
+
+        A job waiting for a full class doesn't hold up the jobs behind it
+        that are waiting for other classes.
+
+        Args:
+            classes: The heaps of the jobs of the owner, by runner class.
+            fits: Whether a runner of a class can be started now.
+            fitting: Whether each class that was already checked fits.
+
+        Returns:
+            The first job of the classes that fit, or None if there is none.
+        """
+        first: Waiter | None = None
+
+        for name, queue in list(classes.items()):
+            while queue and queue[0][3].done():
+                heapq.heappop(queue)
+                self._entries -= 1
+
+            if not queue:
+                del classes[name]
+                continue
+
+            if first is not None and queue[0][:3] >= first[:3]:
+                continue
+
+            if name not in fitting:
+                fitting[name] = fits(queue[0][4])
+
+            if fitting[name]:
+                first = queue[0]
+
+        return first
+
+    def _done(self, waiter: asyncio.Future[bool]) -> None:
+        """Count a job that stopped waiting, and compact the heaps if needed."""
+        self._waiting -= 1
+
+        entries = max(self._entries, len(self._deadlines))
+
+        if entries > COMPACT_RATIO * self._waiting + 64:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Rebuild the heaps without the jobs that stopped waiting."""
+        for owner, classes in list(self._queues.items()):
+            for name, queue in list(classes.items()):
+                queue[:] = [entry for entry in queue if not entry[3].done()]
+
+                if queue:
+                    heapq.heapify(queue)
+                else:
+                    del classes[name]
+
+            if not classes:
+                del self._queues[owner]
+
+        self._deadlines = [entry for entry in self._deadlines if not entry[2].done()]
+        heapq.heapify(self._deadlines)
+        self._entries = sum(
+            len(queue)
+            for classes in self._queues.values()
+            for queue in classes.values()
+        )
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Set the timer for the earliest deadline of the waiting jobs."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._deadlines and self._deadlines[0][2].done():
+            heapq.heappop(self._deadlines)
+
+        if self._deadlines:
+            self._timer = loop.call_at(self._deadlines[0][0], self._expire, loop)
+
+    def _expire(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Drop the jobs that reached their deadline."""
+        self._timer = None
+        now = loop.time()
+
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, waiter = heapq.heappop(self._deadlines)
+
+            if not waiter.done():
+                waiter.set_result(False)
+
+        self._schedule(loop)
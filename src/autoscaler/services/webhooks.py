@@ -0,0 +1,191 @@
+"""A module for handling the workflow job events sent by Github."""
+
+import time
+
+from loguru import logger
+
+from autoscaler.config import Settings
+from autoscaler.models import (
+    ProvisioningJob,
+    StatusResponse,
+    WorkflowJobAction,
+    WorkflowJobEvent,
+)
+from autoscaler.services.classes import RunnerClassRegistry
+from autoscaler.services.forecast import DemandForecaster
+from autoscaler.services.jobs import JobTracker
+from autoscaler.services.queue import ProvisioningQueue
+
+
+class WorkflowJobHandler:
+    """
+    Apply workflow job events to the provisioning queue.
+
+    Events arrive as webhooks, or are found by polling Github for jobs
+    whose webhook was missed, and both are handled the same way. Whether
+    a job was already queued is decided by the queue, which can be shared
+    by several processes, so a job is only queued once whichever process
+    sees it, and however it was seen.
+    """
+
+    def __init__(
+        self,
+        runner_classes: RunnerClassRegistry,
+        jobs: JobTracker,
+        queue: ProvisioningQueue,
+        forecaster: DemandForecaster,
+    ) -> None:
+        """
+        Create a new workflow job handler.
+
+        Args:
+            runner_classes: The registry that routes jobs to runner classes.
+            jobs: The tracker of the jobs seen by this process.
+            queue: The queue to put jobs that need a runner on.
+            forecaster: The forecaster that counts the queued jobs.
+        """
+        self._runner_classes = runner_classes
+        self._jobs = jobs
+        self._queue = queue
+        self._forecaster = forecaster
+
+    def initialize(self, settings: Settings) -> None:
+        """
+        Initialize the handler.
+
+        Args:
+            settings: The settings of the app.
+        """
+
+    async def start(self) -> None:
+        """Start the handler."""
+
+    async def close(self) -> None:
+        """Close the handler."""
+
+    async def handle(
+        self,
+        event: WorkflowJobEvent,
+        delivery_id: str | None,
+        owner: str,
+        repo: str | None,
+    ) -> StatusResponse:
+        """
+        Handle a workflow job event.
+
+        Queued jobs are routed to the cheapest runner class that has all of
+        their labels, and put on the provisioning queue, unless the webhook
+        is a redelivery, the job was already queued or has already started,
+        or no runner class can run the job. Jobs that are cancelled before
+        any runner picked them up are taken off the queue, and the runner
+        that was being provisioned for them is cancelled. Jobs that start
+        keep their runner, as the runner that picked them up may have been
+        started for another job.
+
+        Args:
+            event: The workflow job event.
+            delivery_id: The unique id of the webhook delivery, or None if
+                the event was found by polling Github.
+            owner: The owner that the runner should be registered to.
+            repo: The repo that the runner should be registered to, or None
+                if the runner should be registered to the org.
+
+        Returns:
+            A status response message.
+        """
+        if self._jobs.is_redelivery(delivery_id):
+            return StatusResponse(msg="Webhook already received")
+
+        response = await self._apply(event, owner, repo)
+        self._jobs.mark_delivered(delivery_id)
+
+        return response
+
+    async def _apply(
+        self,
+        event: WorkflowJobEvent,
+        owner: str,
+        repo: str | None,
+    ) -> StatusResponse:
+        """
+        Apply a workflow job event to the queue and the tracked jobs.
+
+        Args:
+            event: The workflow job event.
+            owner: The owner that the runner should be registered to.
+            repo: The repo that the runner should be registered to, or None
+                if the runner should be registered to the org.
+
+        Returns:
+            A status response message.
+        """
+        job_id = event.job_id
+
+        if event.action == WorkflowJobAction.QUEUED:
+            if self._runner_classes.match(event.labels) is None:
+                logger.info(
+                    f"Ignoring job {job_id}, no runner class has the labels "
+                    f"{event.labels}"
+                )
+                return StatusResponse(msg="No runner class matches the job")
+
+            await self.enqueue(event, owner, repo)
+        elif event.action == WorkflowJobAction.IN_PROGRESS:
+            self._jobs.mark_started(job_id)
+        elif event.cancelled_before_start:
+            # Decided from the payload, as the in_progress webhook of the job
+            # may have gone to another worker, or to this one before a restart
+            self._jobs.finish(job_id)
+            await self._queue.remove(job_id)
+
+        return StatusResponse(msg="Webhook received")
+
+    async def enqueue(
+        self,
+        event: WorkflowJobEvent,
+        owner: str,
+        repo: str | None,
+    ) -> bool:
+        """
+        Put a queued job on the provisioning queue, unless it was already.
+
+        Args:
+            event: The queued workflow job event.
+            owner: The owner that the runner should be registered to.
+            repo: The repo that the runner should be registered to, or None
+                if the runner should be registered to the org.
+
+        Returns:
+            True if the job was queued, False if no runner class can run
+            it, or it was already queued, or it no longer needs a runner.
+        """
+        job_id = event.job_id
+        runner_class = self._runner_classes.match(event.labels)
+
+        if (
+            runner_class is None
+            or self._jobs.is_finished(job_id)
+            or not self._jobs.mark_queued(job_id)
+        ):
+            return False
+
+        try:
+            queued = await self._queue.put(
+                ProvisioningJob(
+                    id=job_id,
+                    owner=owner,
+                    repo=repo,
+                    runner_class=runner_class.name,
+                    priority=self._queue.priority(event),
+                    queued_at=event.created_at or time.time(),
+                )
+            )
+        except BaseException:
+            # Let a redelivery of the webhook queue the job
+            self._jobs.unmark_queued(job_id)
+            raise
+
+        if queued:
+            await self._forecaster.record(owner, repo, runner_class.name)
+
+        return queued
@@ -1,54 +1,664 @@
 """A module for background tasks."""
 
 import asyncio
+import time
 
+from functools import partial
+
+from autoscaler import metrics
+from autoscaler.config import (
+    RunnerClass,
+    RunnerSettings,
+    Settings,
+)
+from autoscaler.models import (
+    GithubRunner,
+    JobPriority,
+    ProvisioningJob,
+    RunnerRecord,
+)
 from autoscaler.services import (
+    capacity,
     github,
-    RunnerProvider,
+    jobs,
+    queue,
+    runner_classes,
+    leader,
+    warm_pools,
+    webhooks,
+    AsyncRunnerProvider,
 )
+from autoscaler.services.docker import runner_name_prefix
+from autoscaler.services.pool import WarmPool
 
 from loguru import logger
 
 
+async def provision_runner(
+    *,
+    runner_provider: AsyncRunnerProvider,
+    owner: str,
+    repo: str | None,
+    runner_class: RunnerClass,
+    priority: JobPriority = JobPriority.NORMAL,
+    queued_at: float | None = None,
+    warm: bool = False,
+) -> str | None:
+    """
+    Provision a new runner.
+
+    Waits until the capacity manager hands out a free runner slot, rather
+    than polling the runner provider for the number of runners. The wait
+    is up to the autoscale timeout from when the job was queued.
+
+    Args:
+        runner_provider: The runner provider to use.
+        owner: The owner of the repo.
+        repo: The name of the repo.
+        runner_class: The class of the runner.
+        priority: How urgently the runner is needed.
+        queued_at: The time, as a UNIX timestamp, at which the job was
+            queued, or None if the runner isn't for a queued job.
+        warm: Whether the runner is started for a warm pool.
+
+    Returns:
+        The id of the runner, or None if no slot freed up in time.
+    """
+    if capacity.available <= 0:
+        logger.info("Runner limit reached, waiting for runners to terminate")
+
+    timeout = float(runner_provider.settings.autoscale_timeout)
+
+    if queued_at is not None:
+        timeout -= time.time() - queued_at
+
+    lease_id = await capacity.acquire(
+        runner_class,
+        owner,
+        timeout=timeout,
+        priority=priority,
+    )
+
+    if lease_id is None:
+        logger.error("Timed out waiting for runners to terminate")
+
+        return None
+
+    try:
+        token = await github.create_runner_token(owner, repo)
+
+        if repo is None:
+            logger.info(f"Starting {runner_class.name} runner for org: {owner}")
+            url = f"{runner_provider.settings.base_url}/{owner}"
+        else:
+            logger.info(f"Starting {runner_class.name} runner for repo: {owner}/{repo}")
+            url = f"{runner_provider.settings.base_url}/{owner}/{repo}"
+
+        runner_id = await runner_provider.start_runner(
+            url=url,
+            token=token,
+            owner=owner,
+            repo=repo,
+            runner_class=runner_class,
+            warm=warm,
+        )
+    except BaseException:
+        # Also give the slot back if the job was cancelled
+        capacity.release(lease_id, runner_class, owner)
+        raise
+
+    capacity.confirm(lease_id, runner_id, runner_class, owner, repo)
+
+    return runner_id
+
+
 async def start_runner(
     *,
-    runner_provider: RunnerProvider,
+    runner_provider: AsyncRunnerProvider,
     owner: str,
     repo: str | None,
-) -> None:
+    runner_class: RunnerClass,
+    priority: JobPriority = JobPriority.NORMAL,
+    queued_at: float | None = None,
+) -> bool:
     """
     Start a runner.
 
+    If the owner or repo has a warm pool of the runner class with an idle
+    runner, the job is left to that runner and the pool is topped up in
+    the background.
+
     Args:
         runner_provider: The runner provider to use.
         owner: The owner of the repo.
         repo: The name of the repo.
-        token: The registration token for the runner.
+        runner_class: The class of the runner.
+        priority: How urgently the runner is needed.
+        queued_at: The time, as a UNIX timestamp, at which the job was
+            queued.
+
+    Returns:
+        True if a runner is available for the job.
     """
-    count = 0
+    if await warm_pools.claim(owner, repo, runner_class):
+        target = owner if repo is None else f"{owner}/{repo}"
+        logger.info(f"Serving job for {target} from the warm pool")
 
-    while count < runner_provider.settings.autoscale_timeout:
-        if runner_provider.count_runners() < runner_provider.settings.max_runners:
-            break
+        return True
 
-        logger.info("Runner limit reached, waiting for runners to terminate")
+    runner_id = await provision_runner(
+        runner_provider=runner_provider,
+        owner=owner,
+        repo=repo,
+        runner_class=runner_class,
+        priority=priority,
+        queued_at=queued_at,
+    )
 
-        count += runner_provider.settings.scale_polling_interval
+    return runner_id is not None
 
-        await asyncio.sleep(runner_provider.settings.scale_polling_interval)
 
-    if count >= runner_provider.settings.autoscale_timeout:
-        logger.error("Timed out waiting for runners to terminate")
+async def replenish_warm_pool(
+    *,
+    runner_provider: AsyncRunnerProvider,
+    pool: WarmPool,
+) -> None:
+    """
+    Keep a warm pool topped up with idle runners.
+
+    Only the leader process tops the pool up, so that the workers don't
+    each start the runners that the pool is short of.
+
+    Args:
+        runner_provider: The runner provider to use.
+        pool: The warm pool to replenish.
+    """
+    while True:
+        await pool.wait_for_deficit()
+
+        # Runners for predicted jobs only take slots that are free anyway
+        if not leader.is_leader or (pool.idle >= pool.size and capacity.available <= 0):
+            await asyncio.sleep(runner_provider.settings.scale_polling_interval)
+
+            continue
+
+        try:
+            runner_id = await provision_runner(
+                runner_provider=runner_provider,
+                owner=pool.owner,
+                repo=pool.repo,
+                runner_class=pool.runner_class,
+                priority=JobPriority.LOW,
+                warm=True,
+            )
+        except Exception as e:
+            logger.error(f"Failed to replenish warm pool: {e}")
+            await asyncio.sleep(runner_provider.settings.scale_polling_interval)
+
+            continue
+
+        if runner_id is not None and capacity.is_live(runner_id):
+            pool.add(runner_id)
+
+
+async def replenish_warm_pools(*, runner_provider: AsyncRunnerProvider) -> None:
+    """
+    Keep every warm pool topped up, including the pools added later on.
+
+    Args:
+        runner_provider: The runner provider to use.
+    """
+    replenishers: list[asyncio.Task[None]] = []
+
+    try:
+        while True:
+            pool = await warm_pools.added()
+            replenishers.append(
+                asyncio.create_task(
+                    replenish_warm_pool(runner_provider=runner_provider, pool=pool)
+                )
+            )
+    finally:
+        for replenisher in replenishers:
+            replenisher.cancel()
+
+
+async def handle_job(
+    *,
+    runner_provider: AsyncRunnerProvider,
+    job: ProvisioningJob,
+) -> None:
+    """
+    Start a runner for a job taken off the provisioning queue.
+
+    The job is acknowledged once it has been handled, or given back to the
+    queue to be retried if starting the runner failed.
+
+    Args:
+        runner_provider: The runner provider to use.
+        job: The job to start a runner for.
+    """
+    try:
+        started = await start_runner(
+            runner_provider=runner_provider,
+            owner=job.owner,
+            repo=job.repo,
+            runner_class=runner_classes.get(job.runner_class),
+            priority=job.priority,
+            queued_at=job.queued_at,
+        )
+    except Exception as e:
+        logger.error(f"Failed to start a runner for job {job.id}: {e}")
+        await queue.nack(job)
 
         return
 
-    token = await github.create_runner_token(owner, repo)
+    if started:
+        metrics.queued_to_started_duration.observe(
+            time.time() - job.queued_at,
+            owner=job.owner,
+        )
+
+    await queue.ack(job)
+
+
+async def renew_leases(jobs: dict[int, ProvisioningJob]) -> None:
+    """
+    Keep renewing the leases of the jobs that are being handled.
+
+    Args:
+        jobs: The jobs that are being handled, by id.
+    """
+    while True:
+        await asyncio.sleep(queue.settings.lease_timeout / 3)
+
+        try:
+            await queue.renew(list(jobs.values()))
+        except Exception as e:
+            logger.error(f"Failed to renew the job leases: {e}")
+
+
+async def cancel_removed_jobs(in_flight: dict[int, ProvisioningJob]) -> None:
+    """
+    Keep cancelling the handling of jobs that were taken off the queue.
+
+    Jobs are cancelled by the webhooks of whichever process receives them,
+    so the queue is checked for the jobs handled here, rather than only
+    relying on the tasks indexed by the job tracker of this process.
+
+    Args:
+        in_flight: The jobs that are being handled, by id.
+    """
+    while True:
+        await asyncio.sleep(queue.settings.poll_interval)
+
+        if not in_flight:
+            continue
+
+        try:
+            cancelled = await queue.cancelled(list(in_flight.values()))
+        except Exception as e:
+            logger.error(f"Failed to check for cancelled jobs: {e}")
+
+            continue
+
+        for job_id in cancelled:
+            jobs.finish(job_id)
+
+
+async def prefetch_runner_token(owner: str, repo: str | None) -> None:
+    """
+    Fetch the registration token for a batch of jobs ahead of their runners.
+
+    The token is cached by the Github client, so the runners of the batch
+    all use it once they get a slot, instead of waiting for it after.
+
+    Args:
+        owner: The owner of the repo.
+        repo: The name of the repo, or None if the token is for an org.
+    """
+    try:
+        await github.create_runner_token(owner, repo)
+    except Exception as e:
+        logger.warning(f"Failed to prefetch a runner token: {e}")
+
+
+async def drain_queue(*, runner_provider: AsyncRunnerProvider) -> None:
+    """
+    Start runners for the queued jobs with a bounded pool of workers.
+
+    Jobs are taken off the queue in batches of up to the number of free
+    workers, and the jobs of a batch for the same owner or repo share a
+    single registration token request.
+
+    Args:
+        runner_provider: The runner provider to use.
+    """
+    workers = asyncio.Semaphore(queue.settings.workers)
+    in_flight: dict[int, ProvisioningJob] = {}
+    handlers: set[asyncio.Task[None]] = set()
+
+    def done(job: ProvisioningJob, handler: asyncio.Task[None]) -> None:
+        in_flight.pop(job.id, None)
+        handlers.discard(handler)
+        workers.release()
+
+    renewer = asyncio.create_task(renew_leases(in_flight))
+    canceller = asyncio.create_task(cancel_removed_jobs(in_flight))
+
+    try:
+        while True:
+            await workers.acquire()
+            slots = 1
+
+            while slots < queue.settings.batch_size and not workers.locked():
+                await workers.acquire()
+                slots += 1
+
+            batch = await queue.get_batch(slots)
+
+            for _ in range(slots - len(batch)):
+                workers.release()
+
+            owners = {(job.owner, job.repo) for job in batch}
+
+            if len(batch) > 1:
+                logger.info(f"Starting runners for {len(batch)} queued jobs")
+
+            for owner, repo in owners:
+                prefetch = asyncio.create_task(prefetch_runner_token(owner, repo))
+                handlers.add(prefetch)
+                prefetch.add_done_callback(handlers.discard)
+
+            for job in batch:
+                in_flight[job.id] = job
+
+                handler = asyncio.create_task(
+                    handle_job(runner_provider=runner_provider, job=job)
+                )
+                handlers.add(handler)
+                handler.add_done_callback(partial(done, job))
+                jobs.track(job.id, handler)
+    finally:
+        renewer.cancel()
+        canceller.cancel()
+
+        for handler in list(handlers):
+            handler.cancel()
+
+
+async def poll_owner(target: str) -> None:
+    """
+    Queue the jobs of an org or repo whose webhook was missed.
+
+    Args:
+        target: The org (``org``) or repo (``owner/repo``) to poll.
+    """
+    owner, _, name = target.partition("/")
+    repos = (
+        {name: await github.get_default_branch(owner, name)}
+        if name
+        else await github.list_org_repos(owner)
+    )
+
+    for repo, default_branch in repos.items():
+        for event in await github.list_queued_jobs(owner, repo, default_branch):
+            age = time.time() - (event.created_at or 0.0)
+
+            # Recent jobs are left to their webhooks
+            if age < github.settings.poll_min_age:
+                continue
+
+            # The shared queue skips the jobs that any process already queued
+            if await webhooks.enqueue(event, owner, repo if name else None):
+                logger.warning(f"Found job {event.job_id} of {owner}/{repo} by polling")
+                metrics.recovered_jobs.inc()
+
+
+async def poll_queued_jobs() -> None:
+    """
+    Start runners for the queued jobs whose webhook was missed.
+
+    Webhooks are the main way that jobs are queued, but a webhook that
+    failed to be delivered, or that was delivered while the autoscaler
+    was restarting, would leave its job waiting until Github drops it.
+    The configured orgs and repos are polled for queued jobs, and the
+    jobs that were queued a while ago without a webhook are handled as
+    if their webhook had arrived. Only the leader process polls, so that
+    the workers don't each use up the rate limit.
+    """
+    while True:
+        if leader.is_leader:
+            for target in github.settings.poll_owners:
+                try:
+                    await poll_owner(target)
+                except Exception as e:
+                    logger.error(f"Failed to poll {target} for queued jobs: {e}")
+
+        await asyncio.sleep(github.settings.poll_interval)
+
+
+def stuck_reason(
+    record: RunnerRecord,
+    runner: GithubRunner | None,
+    idle_since: dict[str, float],
+    now: float,
+    settings: RunnerSettings,
+    pool: WarmPool | None = None,
+) -> str | None:
+    """
+    Tell whether a runner is stuck.
+
+    A runner is idle from the first check that finds it online without a
+    job. Warm pool runners waiting for a job are idle by design, so they
+    are only removed while their pool keeps more of them than its target.
+    Warm runners that were claimed for a job are removed like any other,
+    and no busy runner is removed, even one that nothing was claimed from.
+
+    Args:
+        record: The record of the runner.
+        runner: The runner on Github, or None if it isn't registered.
+        idle_since: The time at which each runner was first found idle,
+            by the id of its container, which is updated.
+        now: The current time, as a UNIX timestamp.
+        settings: The settings of the runners.
+        pool: The warm pool that the runner is waiting in for a job, if any.
+
+    Returns:
+        Why the runner is stuck, or None if it isn't.
+    """
+    if runner is None or runner.status != "online":
+        idle_since.pop(record.id, None)
+        age = now - record.started_at
+
+        return "unregistered" if age >= settings.registration_timeout else None
+
+    if runner.busy:
+        # Github gives jobs to any matching runner, claimed or not
+        idle_since.pop(record.id, None)
+        return None
+
+    if pool is not None:
+        idle_since.pop(record.id, None)
+        return "surplus" if pool.surplus > 0 else None
+
+    idle = now - idle_since.setdefault(record.id, now)
+
+    return "idle" if idle >= settings.idle_timeout else None
+
+
+async def reap_target(
+    *,
+    runner_provider: AsyncRunnerProvider,
+    owner: str,
+    repo: str | None,
+    runners: list[RunnerRecord],
+    offline: set[int],
+    idle_since: dict[str, float],
+    name_prefix: str,
+) -> set[int]:
+    """
+    Remove the stuck runners of an org or repo, and its stale registrations.
+
+    Runners that haven't come online on Github within the registration
+    timeout, runners that have been idle on Github for the idle timeout,
+    and idle warm runners above the target of their pool, are removed.
+    Runners that this autoscaler registered, by the prefix of their name,
+    that were offline on Github at the last check too, and aren't running,
+    are deregistered, a batch at a time.
+
+    Args:
+        runner_provider: The runner provider to use.
+        owner: The owner of the repo, or the org.
+        repo: The name of the repo, or None for the runners of the org.
+        runners: The live runners of the org or repo.
+        offline: The ids on Github of the runners that were offline at the
+            last check.
+        idle_since: The time at which each runner was first found idle,
+            by the id of its container, which is updated.
+        name_prefix: The start of the names of the runners that this
+            autoscaler registers.
+
+    Returns:
+        The ids on Github of the runners that are offline and that were
+        not deregistered.
+    """
+    settings = runner_provider.settings
+    registered = {
+        runner.name: runner for runner in await github.list_runners(owner, repo)
+    }
+    now = time.time()
+
+    for record in runners:
+        runner = None if record.name is None else registered.get(record.name)
+        pool = warm_pools.waiting_pool(record.id)
+        reason = stuck_reason(record, runner, idle_since, now, settings, pool)
+
+        if reason is None:
+            continue
+
+        # A job may have been served from the runner since it was checked
+        if reason == "surplus" and not await warm_pools.retire(record.id):
+            continue
+
+        age = now - record.started_at
+        logger.warning(f"Removing runner {record.id}, {reason} after {age:.0f}s")
+        metrics.reaped_runners.inc(reason=reason)
+        idle_since.pop(record.id, None)
+        await runner_provider.remove_runner(record.id)
+
+    live = {record.name for record in runners}
+    stale = {
+        runner.id
+        for runner in registered.values()
+        if runner.status == "offline"
+        and not runner.busy
+        and runner.name.startswith(name_prefix)
+        and runner.name not in live
+    }
+
+    for runner_id in sorted(stale & offline)[: settings.reap_batch_size]:
+        await github.delete_runner(owner, repo, runner_id)
+        metrics.deregistered_runners.inc()
+        stale.discard(runner_id)
+
+    return stale
+
+
+async def reap_runners(
+    *,
+    runner_provider: AsyncRunnerProvider,
+    instance_name: str,
+) -> None:
+    """
+    Keep removing the stuck runners, and deregistering stale runners.
+
+    Runners are ephemeral, so they normally exit after their job. A runner
+    that failed to register, or that never got a job, would otherwise hold
+    a runner slot for good, and runners that exited without deregistering
+    would stay on Github as offline runners. Only the leader process reaps,
+    so that the workers don't remove the same runners.
+
+    Args:
+        runner_provider: The runner provider to use.
+        instance_name: The name of this autoscaler, which starts the names
+            of its runners.
+    """
+    settings = runner_provider.settings
+    name_prefix = runner_name_prefix(instance_name)
+    offline: dict[tuple[str, str | None], set[int]] = {}
+    idle_since: dict[str, float] = {}
+
+    while True:
+        await asyncio.sleep(settings.reap_interval)
+
+        if not leader.is_leader:
+            offline.clear()
+            idle_since.clear()
+            continue
+
+        idle_since = {
+            runner_id: since
+            for runner_id, since in idle_since.items()
+            if capacity.is_live(runner_id)
+        }
+
+        # Owners whose runners are all gone are still checked for stale ones
+        targets: dict[tuple[str, str | None], list[RunnerRecord]] = {
+            target: [] for target in offline
+        }
+
+        for record in capacity.runners:
+            if record.owner is not None:
+                targets.setdefault((record.owner, record.repo), []).append(record)
+
+        for (owner, repo), runners in targets.items():
+            try:
+                offline[(owner, repo)] = await reap_target(
+                    runner_provider=runner_provider,
+                    owner=owner,
+                    repo=repo,
+                    runners=runners,
+                    offline=offline.get((owner, repo), set()),
+                    idle_since=idle_since,
+                    name_prefix=name_prefix,
+                )
+            except Exception as e:
+                target = owner if repo is None else f"{owner}/{repo}"
+                logger.error(f"Failed to reap the runners of {target}: {e}")
+
+
+def start_background_tasks(
+    settings: Settings,
+    *,
+    runner_provider: AsyncRunnerProvider,
+) -> list[asyncio.Task[None]]:
+    """
+    Start the background tasks of the app.
+
+    Args:
+        settings: The settings of the app.
+        runner_provider: The runner provider to use.
+
+    Returns:
+        The tasks, to cancel when the app shuts down.
+    """
+    tasks = [
+        asyncio.create_task(drain_queue(runner_provider=runner_provider)),
+        asyncio.create_task(replenish_warm_pools(runner_provider=runner_provider)),
+    ]
+
+    if settings.github.poll_owners:
+        tasks.append(asyncio.create_task(poll_queued_jobs()))
 
-    if repo is None:
-        logger.info(f"Starting runner for org: {owner}")
-        url = f"{runner_provider.settings.base_url}/{owner}"
-    else:
-        logger.info(f"Starting runner for repo: {owner}/{repo}")
-        url = f"{runner_provider.settings.base_url}/{owner}/{repo}"
+    if settings.runner.reap_interval > 0:
+        tasks.append(
+            asyncio.create_task(
+                reap_runners(
+                    runner_provider=runner_provider,
+                    instance_name=settings.docker.instance_name,
+                )
+            )
+        )
 
-    runner_provider.start_runner(url=url, token=token)
+    return tasks
@@ -0,0 +1,269 @@
+"""Tests for the tracking and admission of runner capacity."""
+
+import asyncio
+
+from collections import Counter
+from typing import Any
+
+import pytest
+
+from autoscaler.config import (
+    RunnerClass,
+    RunnerSettings,
+    Settings,
+)
+from autoscaler.models import (
+    RunnerRecord,
+    RunnerState,
+)
+from autoscaler.services.capacity import CapacityManager
+
+pytestmark = pytest.mark.unit
+
+DEFAULT = RunnerClass(name="default", image="runner")
+LARGE = RunnerClass(name="large", image="runner", cpus=2, memory="1g")
+SINGLE = RunnerClass(name="single", image="runner", max_runners=1)
+
+
+class FakeRunnerSource:
+    """Runners on hosts that have room on demand, without a docker daemon."""
+
+    def __init__(self) -> None:
+        """Create hosts without runners, that have room."""
+        self.records: dict[str, RunnerRecord] = {}
+        self.has_room = True
+
+    async def runner_events(self) -> Any:
+        """Subscribe to no events."""
+        return iter([])
+
+    async def list_runner_records(self) -> dict[str, RunnerRecord]:
+        """List the runners."""
+        return dict(self.records)
+
+    async def allocatable_resources(self) -> tuple[float, int]:
+        """Report hosts without any resources to spare."""
+        return 0.0, 0
+
+    def can_place(self, runner_class: RunnerClass, reserved: Counter[str]) -> bool:
+        """Have room for a runner, unless told not to."""
+        return self.has_room
+
+
+def create_manager(max_runners: int = 1) -> CapacityManager:
+    """Create a manager with in-memory leases, without following events."""
+    manager = CapacityManager(FakeRunnerSource())
+    manager.initialize(
+        Settings(
+            runner=RunnerSettings(max_runners=max_runners, classes=[LARGE, SINGLE])
+        )
+    )
+
+    return manager
+
+
+def test_acquire_past_the_deadline_gets_no_slot() -> None:
+    """Test that a job whose timeout ran out in the queue isn't admitted."""
+
+    async def main() -> None:
+        manager = create_manager()
+
+        try:
+            assert await manager.acquire(DEFAULT, "octo-org", timeout=0) is None
+            assert await manager.acquire(DEFAULT, "octo-org", timeout=-5) is None
+            assert manager.available == 1
+
+            assert await manager.acquire(DEFAULT, "octo-org", timeout=5) is not None
+        finally:
+            await manager.close()
+
+    asyncio.run(main())
+
+
+def test_runners_are_admitted_by_the_resources_they_reserve() -> None:
+    """Test that a runner is only admitted if its reservation fits."""
+
+    async def main() -> None:
+        manager = create_manager(max_runners=10)
+        manager.cpus, manager.memory = 5.0, 4 * 1024**3
+
+        first = await manager.acquire(LARGE, "octo-org", timeout=0.01)
+        second = await manager.acquire(LARGE, "octo-org", timeout=0.01)
+
+        assert first is not None and second is not None
+        assert manager.usage() == (4.0, 2 * 1024**3)
+        assert await manager.acquire(LARGE, "octo-org", timeout=0.01) is None
+
+        # Runners that reserve nothing only count against the slots
+        assert await manager.acquire(DEFAULT, "octo-org", timeout=0.01) is not None
+
+        manager.release(first, LARGE, "octo-org")
+
+        assert manager.usage() == (2.0, 1024**3)
+        assert await manager.acquire(LARGE, "octo-org", timeout=0.01) is not None
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def test_runners_are_admitted_by_their_class_limit() -> None:
+    """Test that a class with a limit of its own doesn't go over it."""
+
+    async def main() -> None:
+        manager = create_manager(max_runners=10)
+
+        assert await manager.acquire(SINGLE, "octo-org", timeout=0.01) is not None
+        assert await manager.acquire(SINGLE, "octo-org", timeout=0.01) is None
+        assert manager.count("single") == 1
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def test_runners_are_only_admitted_if_a_host_has_room() -> None:
+    """Test that the totals fitting isn't enough if no single host does."""
+
+    async def main() -> None:
+        manager = create_manager(max_runners=10)
+        manager._source.has_room = False  # type: ignore[attr-defined]
+
+        assert await manager.acquire(DEFAULT, "octo-org", timeout=0.01) is None
+        assert manager.available == 10
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize(
+    ("error", "raised"),
+    [(RuntimeError("lease store down"), RuntimeError), (None, asyncio.CancelledError)],
+)
+def test_failed_lease_gives_the_reservation_back(
+    error: BaseException | None,
+    raised: type[BaseException],
+) -> None:
+    """Test that a reservation is undone if leasing it fails or is cancelled."""
+
+    async def main() -> None:
+        manager = create_manager(max_runners=2)
+        manager.cpus, manager.memory = 4.0, 4 * 1024**3
+        started = asyncio.Event()
+
+        async def reserve(limit: int, timeout: float) -> str | None:
+            started.set()
+
+            if error is not None:
+                raise error
+
+            await asyncio.sleep(60)
+            return None
+
+        manager._leases.reserve = reserve  # type: ignore[method-assign]
+        task = asyncio.create_task(manager.acquire(LARGE, "octo-org"))
+        await started.wait()
+
+        if error is None:
+            task.cancel()
+
+        with pytest.raises(raised):
+            await task
+
+        assert manager.available == 2
+        assert manager.usage() == (0.0, 0)
+        assert manager.count("large") == 0
+        assert manager.owner_usage()["octo-org"] == 0
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def test_lease_is_handed_over_to_the_started_runner() -> None:
+    """Test that a confirmed slot is leased under the id of its container."""
+
+    async def main() -> None:
+        manager = create_manager()
+        lease_id = await manager.acquire(DEFAULT, "octo-org", timeout=0.01)
+
+        assert lease_id is not None
+        assert await manager._leases.held() == [lease_id]
+
+        manager.confirm(lease_id, "r1", DEFAULT, "octo-org")
+        await asyncio.gather(*manager._background)
+
+        assert await manager._leases.held() == ["r1"]
+        assert manager.runners[0].state == RunnerState.STARTING
+        assert manager.available == 0
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def test_runner_is_dropped_after_missing_two_listings() -> None:
+    """Test that a runner missing from the hosts is dropped on the second miss."""
+
+    async def main() -> None:
+        manager = create_manager(max_runners=2)
+        source: FakeRunnerSource = manager._source  # type: ignore[assignment]
+        lease_id = await manager.acquire(DEFAULT, "octo-org", timeout=0.01)
+        assert lease_id is not None
+        manager.confirm(lease_id, "r1", DEFAULT, "octo-org")
+
+        # A runner on the hosts that was never seen is tracked and leased
+        source.records = {
+            "r1": RunnerRecord(id="r1", owner="octo-org"),
+            "r2": RunnerRecord(id="r2", owner="octo-org"),
+        }
+        await manager._reconcile()
+        await asyncio.gather(*manager._background)
+
+        assert {record.id: record.state for record in manager.runners} == {
+            "r1": RunnerState.RUNNING,
+            "r2": RunnerState.RUNNING,
+        }
+        assert sorted(await manager._leases.held()) == ["r1", "r2"]
+
+        del source.records["r1"]
+        await manager._reconcile()
+        await asyncio.gather(*manager._background)
+
+        assert manager.is_live("r1")
+        assert sorted(await manager._leases.held()) == ["r1", "r2"]
+
+        await manager._reconcile()
+        await asyncio.gather(*manager._background)
+
+        assert not manager.is_live("r1")
+        assert await manager._leases.held() == ["r2"]
+        assert manager.available == 1
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def test_runner_back_in_a_listing_is_kept() -> None:
+    """Test that a runner that one listing missed isn't dropped later."""
+
+    async def main() -> None:
+        manager = create_manager()
+        source: FakeRunnerSource = manager._source  # type: ignore[assignment]
+        source.records = {"r1": RunnerRecord(id="r1", owner="octo-org")}
+        await manager._reconcile()
+
+        source.records = {}
+        await manager._reconcile()
+        source.records = {"r1": RunnerRecord(id="r1", owner="octo-org")}
+        await manager._reconcile()
+        source.records = {}
+        await manager._reconcile()
+
+        assert manager.is_live("r1")
+
+        await manager.close()
+
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""Tests for the routing of jobs to runner classes."""
+
+import pytest
+
+from autoscaler.config import (
+    RunnerClass,
+    RunnerSettings,
+    Settings,
+)
+from autoscaler.services.classes import RunnerClassRegistry
+
+pytestmark = pytest.mark.unit
+
+
+def create_registry(*classes: RunnerClass) -> RunnerClassRegistry:
+    """Create a registry with some runner classes on top of the default."""
+    registry = RunnerClassRegistry()
+    registry.initialize(Settings(runner=RunnerSettings(classes=list(classes))))
+
+    return registry
+
+
+def test_jobs_are_routed_by_their_labels() -> None:
+    """Test that a job goes to a class that has all of its labels."""
+    registry = create_registry(
+        RunnerClass(name="gpu", labels=["gpu"], image="runner", cost=4),
+        RunnerClass(name="large", labels=["large"], image="runner", cost=2),
+    )
+
+    assert registry.match(["self-hosted", "gpu"]).name == "gpu"
+    assert registry.match(["self-hosted", "linux", "large"]).name == "large"
+
+
+def test_labels_are_matched_case_insensitively() -> None:
+    """Test that labels match whatever their case."""
+    registry = create_registry(
+        RunnerClass(name="gpu", labels=["GPU"], image="runner"),
+    )
+
+    assert registry.match(["Self-Hosted", "gpu"]).name == "gpu"
+
+
+def test_jobs_go_to_the_cheapest_class() -> None:
+    """Test that a job that several classes can run goes to the cheapest."""
+    registry = create_registry(
+        RunnerClass(name="gpu", labels=["gpu"], image="runner", cost=4),
+        RunnerClass(name="gpu-spot", labels=["gpu", "spot"], image="runner"),
+    )
+
+    assert registry.match(["self-hosted", "gpu"]).name == "gpu-spot"
+    assert registry.match(["self-hosted"]).name == "default"
+
+
+def test_jobs_with_default_labels_go_to_the_default_class() -> None:
+    """Test that the default class runs jobs that ask for no custom label."""
+    registry = create_registry()
+
+    assert registry.match(["self-hosted", "linux", "x64"]) is registry.default
+    assert registry.match([]) is registry.default
+
+
+def test_jobs_no_class_can_run_are_not_matched() -> None:
+    """Test that a job with a label that no class has is not matched."""
+    registry = create_registry(
+        RunnerClass(name="gpu", labels=["gpu"], image="runner"),
+    )
+
+    assert registry.match(["self-hosted", "arm64"]) is None
+    assert registry.match(["gpu", "large"]) is None
+
+
+def test_unknown_classes_fall_back_to_the_default() -> None:
+    """Test that a class that is no longer configured is the default."""
+    registry = create_registry(
+        RunnerClass(name="gpu", labels=["gpu"], image="runner"),
+    )
+
+    assert registry.get("gpu").name == "gpu"
+    assert registry.get("removed") is registry.default
@@ -0,0 +1,49 @@
+"""Tests for the docker runner provider."""
+
+import shutil
+
+from pathlib import Path
+
+import pytest
+
+from autoscaler.services.docker import hash_build_context
+
+pytestmark = pytest.mark.unit
+
+ROOT = Path(__file__).parent.parent
+
+
+def create_context(path: Path) -> None:
+    """Create a build context with the ignore file of the repo."""
+    shutil.copy(ROOT / ".dockerignore", path / ".dockerignore")
+    (path / "devstack").mkdir()
+    (path / "devstack" / "runner.dockerfile").write_text("FROM debian:11-slim\n")
+    (path / "runner.sh").write_text("#!/bin/sh\n")
+    (path / ".git").mkdir()
+    (path / ".git" / "HEAD").write_text("ref: refs/heads/main\n")
+    (path / "autoscaler.db").write_bytes(b"\0")
+
+
+def test_ignored_files_do_not_change_the_hash(tmp_path: Path) -> None:
+    """Test that the files the app changes at runtime aren't hashed."""
+    create_context(tmp_path)
+    before = hash_build_context(str(tmp_path), "devstack/runner.dockerfile")
+
+    (tmp_path / ".git" / "HEAD").write_text("ref: refs/heads/other\n")
+    (tmp_path / "autoscaler.db").write_bytes(b"\1")
+    (tmp_path / "autoscaler.db-wal").write_bytes(b"\1")
+    (tmp_path / ".coverage").write_bytes(b"\1")
+    (tmp_path / ".pytest_cache").mkdir()
+    (tmp_path / ".pytest_cache" / "README.md").write_text("cache\n")
+
+    assert hash_build_context(str(tmp_path), "devstack/runner.dockerfile") == before
+
+
+def test_changed_files_change_the_hash(tmp_path: Path) -> None:
+    """Test that a change to a file of the build context changes the hash."""
+    create_context(tmp_path)
+    before = hash_build_context(str(tmp_path), "devstack/runner.dockerfile")
+
+    (tmp_path / "runner.sh").write_text("#!/bin/bash\n")
+
+    assert hash_build_context(str(tmp_path), "devstack/runner.dockerfile") != before
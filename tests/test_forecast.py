@@ -0,0 +1,144 @@
+"""Tests for the predictions of job arrivals."""
+
+import asyncio
+
+from datetime import (
+    datetime,
+    timedelta,
+)
+
+import pytest
+
+from autoscaler.config import (
+    PrescaleSettings,
+    RunnerSettings,
+    Settings,
+)
+from autoscaler.services.capacity import CapacityManager
+from autoscaler.services.classes import RunnerClassRegistry
+from autoscaler.services.forecast import (
+    SEASONAL_ALPHA,
+    ArrivalModel,
+    DemandForecaster,
+    hour_of_week,
+)
+from autoscaler.services.leases import LeaderLease
+from autoscaler.services.pool import WarmPoolManager
+
+pytestmark = pytest.mark.unit
+
+# A Monday morning, in the 10th hour of the week
+MONDAY = datetime(2024, 1, 1, 9, 0)
+
+
+def test_level_is_a_moving_average() -> None:
+    """Test that the level moves towards every count by alpha."""
+    model = ArrivalModel(alpha=0.5)
+
+    model.observe(4, MONDAY)
+    assert model.level == 2.0
+
+    model.observe(0, MONDAY + timedelta(minutes=1))
+    assert model.level == 1.0
+
+    model.observe(5, MONDAY + timedelta(minutes=2))
+    assert model.level == 3.0
+
+
+def test_busy_hours_are_predicted_a_week_later() -> None:
+    """Test that the mean of an hour is learnt once the hour is over."""
+    model = ArrivalModel(alpha=0.5)
+    hour = hour_of_week(MONDAY)
+
+    assert hour == 9
+
+    for minute in range(0, 60, 20):
+        model.observe(6, MONDAY + timedelta(minutes=minute))
+
+    assert model.seasonal[hour] == 0.0
+
+    for minute in range(60, 60 * 12, 10):
+        model.observe(0, MONDAY + timedelta(minutes=minute))
+
+    assert model.seasonal[hour] == SEASONAL_ALPHA * 6
+    assert model.level < 0.01
+
+    next_week = MONDAY + timedelta(weeks=1, minutes=30)
+    assert model.predict(next_week) == SEASONAL_ALPHA * 6
+    assert model.predict(next_week + timedelta(hours=1)) < 0.01
+    assert not model.is_idle
+
+
+def create_forecaster(max_runners: int) -> DemandForecaster:
+    """Create a forecaster whose predictions follow the last interval."""
+    settings = Settings(
+        runner=RunnerSettings(max_runners=max_runners),
+        prescale=PrescaleSettings(
+            enabled=True,
+            alpha=1.0,
+            horizon=60,
+            interval=60,
+            max_runners=10,
+            max_share=0.25,
+        ),
+    )
+    runner_classes = RunnerClassRegistry()
+    runner_classes.initialize(settings)
+    warm_pools = WarmPoolManager(
+        CapacityManager(None),  # type: ignore[arg-type]
+        runner_classes,
+    )
+    warm_pools.initialize(settings)
+    forecaster = DemandForecaster(warm_pools, runner_classes, LeaderLease())
+    forecaster.initialize(settings)
+
+    return forecaster
+
+
+def test_predictions_are_capped_to_a_share_of_the_slots() -> None:
+    """Test that every pool is scaled down when the share is exceeded."""
+
+    async def main() -> None:
+        forecaster = create_forecaster(max_runners=8)
+        pools = forecaster._warm_pools.pools
+
+        for _ in range(3):
+            await forecaster.record("octo-org", None, "default")
+
+        await forecaster.record("other-org", None, "default")
+        await forecaster.collect()
+        forecaster.update(MONDAY)
+
+        assert forecaster.max_predicted == 2
+        assert pools[("octo-org", None, "default")].predicted == 1
+        assert ("other-org", None, "default") not in pools
+
+        await forecaster.close()
+
+    asyncio.run(main())
+
+
+def test_predictions_within_the_share_are_kept() -> None:
+    """Test that the pools keep their predictions when there is room."""
+
+    async def main() -> None:
+        forecaster = create_forecaster(max_runners=40)
+        pools = forecaster._warm_pools.pools
+
+        for _ in range(3):
+            await forecaster.record("octo-org", None, "default")
+
+        await forecaster.collect()
+        forecaster.update(MONDAY)
+
+        pool = pools[("octo-org", None, "default")]
+        assert pool.predicted == 3
+
+        # Once the jobs stop coming, the pool's target goes back down
+        forecaster.update(MONDAY + timedelta(minutes=1))
+
+        assert pool.predicted == 0
+
+        await forecaster.close()
+
+    asyncio.run(main())
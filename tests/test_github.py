@@ -0,0 +1,340 @@
+"""Tests for the Github client."""
+
+import asyncio
+import time
+
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+)
+
+import httpx
+import pytest
+
+from autoscaler.config import (
+    GithubSettings,
+    Settings,
+)
+from autoscaler.services.github import (
+    GithubAPIError,
+    GithubClient,
+    GithubRateLimitError,
+    TokenBucket,
+)
+
+pytestmark = pytest.mark.unit
+
+Handler = Callable[[httpx.Request], Awaitable[httpx.Response]]
+
+
+def create_client(handler: Handler, **settings: Any) -> GithubClient:
+    """Create a client that sends its requests to a handler."""
+    client = GithubClient()
+    client.initialize(
+        Settings(github=GithubSettings(**settings)),
+        transport=httpx.MockTransport(handler),
+    )
+
+    return client
+
+
+def token_response(token: str, expires_in: timedelta) -> httpx.Response:
+    """Answer a registration token request."""
+    expires_at = datetime.now(timezone.utc) + expires_in
+
+    return httpx.Response(
+        201,
+        json={"token": token, "expires_at": expires_at.isoformat()},
+    )
+
+
+def test_concurrent_token_requests_are_shared() -> None:
+    """Test that callers waiting for the same token make one request."""
+    requests: list[str] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.path)
+        await asyncio.sleep(0.01)
+
+        return token_response(f"token-{len(requests)}", timedelta(hours=1))
+
+    async def main() -> None:
+        client = create_client(handler)
+
+        try:
+            tokens = await asyncio.gather(
+                *(client.create_runner_token("octo-org") for _ in range(10))
+            )
+
+            assert tokens == ["token-1"] * 10
+            assert requests == ["/orgs/octo-org/actions/runners/registration-token"]
+
+            assert await client.create_runner_token("octo-org") == "token-1"
+            assert await client.create_runner_token("octo-org", "repo") == "token-2"
+            assert len(requests) == 2
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_token_close_to_expiry_is_replaced() -> None:
+    """Test that a token isn't reused shortly before it expires."""
+    requests: list[str] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.path)
+
+        return token_response(f"token-{len(requests)}", timedelta(minutes=2))
+
+    async def main() -> None:
+        client = create_client(handler)
+
+        try:
+            assert await client.create_runner_token("octo-org") == "token-1"
+            assert await client.create_runner_token("octo-org") == "token-2"
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_fail_the_shared_request() -> None:
+    """Test that the other callers still get the token."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.01)
+
+        return token_response("token", timedelta(hours=1))
+
+    async def main() -> None:
+        client = create_client(handler)
+
+        try:
+            first = asyncio.create_task(client.create_runner_token("octo-org"))
+            second = asyncio.create_task(client.create_runner_token("octo-org"))
+            await asyncio.sleep(0)
+            first.cancel()
+
+            assert await second == "token"
+            assert first.cancelled()
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_bucket_throttles_to_its_rate() -> None:
+    """Test that tokens past the burst are handed out at the rate."""
+
+    async def main() -> None:
+        bucket = TokenBucket(rate=100, burst=5)
+        started = time.monotonic()
+
+        for _ in range(5):
+            await bucket.acquire()
+
+        assert time.monotonic() - started < 0.02
+
+        for _ in range(10):
+            await bucket.acquire()
+
+        assert time.monotonic() - started >= 0.09
+
+    asyncio.run(main())
+
+
+def test_paused_bucket_hands_out_no_tokens() -> None:
+    """Test that a pause holds up every caller until it is over."""
+
+    async def main() -> None:
+        bucket = TokenBucket(rate=1000, burst=10)
+        bucket.pause(0.05)
+        started = time.monotonic()
+
+        await asyncio.gather(bucket.acquire(), bucket.acquire())
+
+        assert time.monotonic() - started >= 0.05
+
+    asyncio.run(main())
+
+
+def test_server_errors_are_retried() -> None:
+    """Test that a request is retried until the API answers."""
+    statuses = [502, 500, 200]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(statuses.pop(0), json={"default_branch": "main"})
+
+    async def main() -> None:
+        client = create_client(handler, max_retries=3, backoff_base=0.001)
+
+        try:
+            assert await client.get_default_branch("octo-org", "repo") == "main"
+            assert statuses == []
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_failures_are_raised_after_the_retries() -> None:
+    """Test that a request that keeps failing gives up, with its error."""
+    requests: list[httpx.Request] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+
+        if len(requests) > 3:
+            raise httpx.ConnectError("connection refused")
+
+        return httpx.Response(503)
+
+    async def main() -> None:
+        client = create_client(handler, max_retries=3, backoff_base=0.001)
+
+        try:
+            with pytest.raises(GithubAPIError, match="connection refused"):
+                await client.get_default_branch("octo-org", "repo")
+
+            assert len(requests) == 4
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_throttled_requests_wait_for_the_api() -> None:
+    """Test that a rate limit is waited out, and reported if it persists."""
+    requests: list[float] = []
+    reset = int(time.time()) + 3600
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(time.monotonic())
+
+        return httpx.Response(
+            429,
+            headers={
+                "Retry-After": "0",
+                "X-RateLimit-Limit": "5000",
+                "X-RateLimit-Remaining": "10",
+                "X-RateLimit-Reset": str(reset),
+            },
+        )
+
+    async def main() -> None:
+        client = create_client(handler, max_retries=2)
+
+        try:
+            with pytest.raises(GithubRateLimitError):
+                await client.get_default_branch("octo-org", "repo")
+
+            assert len(requests) == 3
+            assert client.rate_limit.remaining == 10
+            assert client.rate_limit.reset == datetime.fromtimestamp(
+                reset, timezone.utc
+            )
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_exhausted_rate_limit_pauses_every_request() -> None:
+    """Test that no request is sent until a used up rate limit resets."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            json={"default_branch": "main"},
+            headers={
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset": str(int(time.time()) + 3600),
+            },
+        )
+
+    async def main() -> None:
+        client = create_client(handler)
+
+        try:
+            await client.get_default_branch("octo-org", "repo")
+
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    client.get_default_branch("octo-org", "other"), 0.05
+                )
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_unchanged_responses_are_served_from_the_cache() -> None:
+    """Test that a 304 reuses the body cached with the ETag."""
+    requests: list[httpx.Request] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+
+        return httpx.Response(
+            200, json={"default_branch": "main"}, headers={"ETag": '"v1"'}
+        )
+
+    async def main() -> None:
+        client = create_client(handler)
+
+        try:
+            assert await client.get_default_branch("octo-org", "repo") == "main"
+            assert await client.get_default_branch("octo-org", "repo") == "main"
+
+            assert "If-None-Match" not in requests[0].headers
+            assert requests[1].headers["If-None-Match"] == '"v1"'
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_cache_evicts_the_least_recently_used_response() -> None:
+    """Test that the cache holds at most ``poll_cache_size`` responses."""
+    requests: list[httpx.Request] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+
+        if "If-None-Match" in request.headers:
+            return httpx.Response(304)
+
+        repo = request.url.path.rsplit("/", 1)[-1]
+
+        return httpx.Response(
+            200, json={"default_branch": repo}, headers={"ETag": f'"{repo}"'}
+        )
+
+    async def main() -> None:
+        client = create_client(handler, poll_cache_size=2)
+
+        try:
+            for repo in ("a", "b", "a", "c", "a", "b"):
+                assert await client.get_default_branch("octo-org", repo) == repo
+
+            conditional = [
+                request.url.path.rsplit("/", 1)[-1]
+                for request in requests
+                if "If-None-Match" in request.headers
+            ]
+
+            assert conditional == ["a", "a"]
+        finally:
+            await client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+"""Tests for the pool of docker hosts."""
+
+import asyncio
+
+from typing import Any
+
+import pytest
+
+from autoscaler.config import (
+    DockerHost,
+    DockerSettings,
+    Settings,
+)
+from autoscaler.services.hosts import (
+    DockerHostPool,
+    NoHostAvailableError,
+    RunnerHost,
+)
+
+pytestmark = pytest.mark.unit
+
+
+class FakeDockerClient:
+    """A docker client that fails on demand, without a docker daemon."""
+
+    def __init__(self) -> None:
+        """Create a client that has the image of every runner class."""
+        self.images: dict[str, Any] = {}
+        self.failures: list[Exception] = []
+        self.image_failures = 0
+        self.started = 0
+
+    async def start(self) -> None:
+        """Do nothing."""
+
+    async def close(self) -> None:
+        """Do nothing."""
+
+    async def ping(self) -> None:
+        """Answer, as the daemon is always back."""
+
+    async def update_image(self, runner_class: Any, **kwargs: Any) -> None:
+        """Prepare an image, unless told to fail."""
+        if self.image_failures > 0:
+            self.image_failures -= 1
+            raise OSError("registry unreachable")
+
+        self.images[runner_class.name] = object()
+
+    async def start_runner(self, **kwargs: Any) -> str:
+        """Start a runner, unless told to fail."""
+        if self.failures:
+            raise self.failures.pop(0)
+
+        self.started += 1
+
+        return f"runner-{self.started}"
+
+
+def create_pool(client: FakeDockerClient) -> DockerHostPool:
+    """Create a pool with a single host that checks on it quickly."""
+    pool = DockerHostPool()
+    pool.initialize(Settings(docker=DockerSettings(enabled=False)))
+    pool.hosts = [RunnerHost("local", client)]  # type: ignore[arg-type]
+    pool.check_interval = 0
+    pool.refresh_interval = 0
+
+    return pool
+
+
+async def start(pool: DockerHostPool) -> str:
+    """Start a runner on the pool."""
+    return await pool.start_runner(url="https://github.com/o", token="t", owner="o")
+
+
+def test_single_host_comes_back_after_an_error() -> None:
+    """Test that the only host is used again once it answers."""
+
+    async def run() -> None:
+        client = FakeDockerClient()
+        client.failures.append(OSError("connection reset"))
+        pool = create_pool(client)
+        await pool.start()
+
+        try:
+            with pytest.raises(NoHostAvailableError):
+                await start(pool)
+
+            assert not pool.hosts[0].is_up
+
+            for _ in range(10):
+                await asyncio.sleep(0)
+
+            assert pool.hosts[0].is_up
+            assert await start(pool) == "runner-1"
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_start_fails_when_no_host_has_the_image() -> None:
+    """Test that a runner doesn't wait for good for an image that failed."""
+
+    async def run() -> None:
+        client = FakeDockerClient()
+        client.image_failures = 1
+        pool = create_pool(client)
+        pool.check_interval = 60
+        await pool.start()
+
+        try:
+            with pytest.raises(NoHostAvailableError):
+                await asyncio.wait_for(start(pool), timeout=5)
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_failed_image_is_retried() -> None:
+    """Test that the host check prepares the images that failed again."""
+
+    async def run() -> None:
+        client = FakeDockerClient()
+        client.image_failures = 1
+        pool = create_pool(client)
+        await pool.start()
+
+        try:
+            for _ in range(10):
+                await asyncio.sleep(0)
+
+            assert await start(pool) == "runner-1"
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_unreachable_host_starts_out_down() -> None:
+    """Test that a host that can't be reached doesn't stop the app starting."""
+
+    async def run() -> None:
+        pool = DockerHostPool()
+        pool.initialize(
+            Settings(
+                docker=DockerSettings(
+                    hosts=[DockerHost(name="remote", url="tcp://127.0.0.1:1")],
+                    host_check_interval=60,
+                    image_refresh_interval=0,
+                )
+            )
+        )
+
+        try:
+            assert [host.is_up for host in pool.hosts] == [False]
+            assert not await pool._revive_hosts()
+
+            await pool.start()
+
+            with pytest.raises(NoHostAvailableError):
+                await asyncio.wait_for(start(pool), timeout=5)
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
@@ -0,0 +1,54 @@
+"""Tests for the tracking of workflow jobs."""
+
+import asyncio
+
+import pytest
+
+from autoscaler.config import Settings
+from autoscaler.services.jobs import JobTracker
+
+pytestmark = pytest.mark.unit
+
+
+def test_started_jobs_keep_their_provisioning() -> None:
+    """Test that a job that starts leaves its runner to another job."""
+
+    async def main() -> None:
+        jobs = JobTracker()
+        jobs.initialize(Settings())
+        task = asyncio.create_task(asyncio.sleep(60))
+        jobs.track(1, task)
+
+        jobs.mark_started(1)
+        await asyncio.sleep(0)
+
+        assert jobs.is_finished(1)
+        assert not task.cancelled()
+
+        jobs.finish(1)
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+
+def test_a_replaced_task_can_still_be_cancelled() -> None:
+    """Test that an older task of a job doesn't untrack the newer one."""
+
+    async def main() -> None:
+        jobs = JobTracker()
+        jobs.initialize(Settings())
+        old = asyncio.create_task(asyncio.sleep(60))
+        new = asyncio.create_task(asyncio.sleep(60))
+        jobs.track(1, old)
+        jobs.track(1, new)
+
+        old.cancel()
+        await asyncio.gather(old, return_exceptions=True)
+        jobs.finish(1)
+
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(new, 1)
+
+    asyncio.run(main())
@@ -0,0 +1,176 @@
+"""Tests for the stores of leases shared between processes."""
+
+import asyncio
+
+from pathlib import Path
+from typing import (
+    Awaitable,
+    Callable,
+)
+
+import pytest
+
+from autoscaler.benchmark.fakes import FakeRespServer
+from autoscaler.services.leases import (
+    LeaseStore,
+    MemoryLeaseStore,
+    RedisLeaseStore,
+    SqliteLeaseStore,
+)
+
+pytestmark = pytest.mark.unit
+
+TIMEOUT = 60
+
+Scenario = Callable[[LeaseStore, LeaseStore], Awaitable[None]]
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def run(request: pytest.FixtureRequest, tmp_path: Path) -> Callable[[Scenario], None]:
+    """
+    Run a scenario against two clients of each of the lease stores.
+
+    The memory store is only seen by its own process, so both of its
+    clients are the same store.
+    """
+
+    def run_scenario(scenario: Scenario) -> None:
+        async def main() -> None:
+            server = None
+            stores: list[LeaseStore]
+
+            if request.param == "sqlite":
+                path = str(tmp_path / "leases.db")
+                stores = [SqliteLeaseStore(path, "runners") for _ in range(2)]
+            elif request.param == "redis":
+                server = FakeRespServer()
+                await server.start()
+                stores = [
+                    RedisLeaseStore(server.url, "test", "runners") for _ in range(2)
+                ]
+            else:
+                stores = [MemoryLeaseStore()] * 2
+
+            try:
+                await scenario(*stores)
+            finally:
+                for store in stores:
+                    await store.close()
+
+                if server is not None:
+                    await server.close()
+
+        asyncio.run(main())
+
+    return run_scenario
+
+
+def test_reserve_is_limited_across_clients(run: Callable[[Scenario], None]) -> None:
+    """Test that the clients share a single limit on the leases."""
+
+    async def scenario(first: LeaseStore, second: LeaseStore) -> None:
+        lease_id = await first.reserve(2, TIMEOUT)
+        other_id = await second.reserve(2, TIMEOUT)
+
+        assert lease_id is not None and other_id is not None
+        assert await first.reserve(2, TIMEOUT) is None
+        assert await second.reserve(2, TIMEOUT) is None
+        assert sorted(await second.held()) == sorted([lease_id, other_id])
+
+        await second.release(lease_id)
+
+        assert await first.reserve(2, TIMEOUT) is not None
+        assert await first.reserve(0, TIMEOUT) is None
+
+    run(scenario)
+
+
+def test_expired_leases_free_their_slot(run: Callable[[Scenario], None]) -> None:
+    """Test that a lease that isn't renewed stops counting."""
+
+    async def scenario(first: LeaseStore, second: LeaseStore) -> None:
+        lease_id = await first.reserve(1, 0.01)
+        await asyncio.sleep(0.05)
+
+        assert await second.held() == []
+        assert not await first.renew(str(lease_id), TIMEOUT)
+        assert await second.reserve(1, TIMEOUT) is not None
+
+    run(scenario)
+
+
+def test_renewed_lease_is_kept(run: Callable[[Scenario], None]) -> None:
+    """Test that renewing a lease pushes its expiry back."""
+
+    async def scenario(first: LeaseStore, second: LeaseStore) -> None:
+        lease_id = await first.reserve(1, 0.05)
+        assert lease_id is not None
+
+        assert await first.renew(lease_id, TIMEOUT)
+        await asyncio.sleep(0.1)
+
+        assert await second.held() == [lease_id]
+        assert await second.reserve(1, TIMEOUT) is None
+
+        await second.release(lease_id)
+
+        assert not await first.renew(lease_id, TIMEOUT)
+
+    run(scenario)
+
+
+def test_named_lease_is_taken_once(run: Callable[[Scenario], None]) -> None:
+    """Test that only one client can take a lease of a given id."""
+
+    async def scenario(first: LeaseStore, second: LeaseStore) -> None:
+        assert await first.take("runner", TIMEOUT)
+        assert not await second.take("runner", TIMEOUT)
+
+        await first.release("runner")
+
+        assert await second.take("runner", TIMEOUT)
+
+    run(scenario)
+
+
+def test_hold_takes_leases_past_the_limit(run: Callable[[Scenario], None]) -> None:
+    """Test that held leases count against the limit, but ignore it."""
+
+    async def scenario(first: LeaseStore, second: LeaseStore) -> None:
+        await first.hold(["a", "b"], TIMEOUT)
+        await second.hold(["b", "c"], TIMEOUT)
+        await second.hold([], TIMEOUT)
+
+        assert sorted(await first.held()) == ["a", "b", "c"]
+        assert await second.reserve(3, TIMEOUT) is None
+        assert not await second.take("a", TIMEOUT)
+
+    run(scenario)
+
+
+def test_cancelled_redis_call_does_not_shift_replies() -> None:
+    """Test that a call cancelled mid-reply leaves the next ones correct."""
+
+    async def main() -> None:
+        server = FakeRespServer()
+        await server.start()
+        store = RedisLeaseStore(server.url, "test", "runners")
+
+        try:
+            await store.hold(["a"], TIMEOUT)
+
+            task = asyncio.create_task(store.take("b", TIMEOUT))
+            await asyncio.sleep(0)
+            task.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            assert await store.reserve(1, TIMEOUT) is None
+            assert not await store.take("a", TIMEOUT)
+            assert "a" in await store.held()
+        finally:
+            await store.close()
+            await server.close()
+
+    asyncio.run(main())
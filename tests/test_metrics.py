@@ -0,0 +1,25 @@
+"""Tests for the rendering of the metrics."""
+
+import pytest
+
+from autoscaler import metrics
+
+pytestmark = pytest.mark.unit
+
+
+def test_counter_metadata_names_its_samples() -> None:
+    """Test that a counter's help and type lines use its sample name."""
+    counter = metrics.Counter("test_jobs", "Jobs seen", ("owner",))
+    metrics.registry.remove(counter)
+    counter.inc(owner="octo-org")
+
+    assert counter.render().splitlines() == [
+        "# HELP test_jobs_total Jobs seen",
+        "# TYPE test_jobs_total counter",
+        'test_jobs_total{owner="octo-org"} 1.0',
+    ]
+
+    counter = metrics.Counter("test_runs_total", "Runs")
+    metrics.registry.remove(counter)
+
+    assert counter.name == "test_runs_total"
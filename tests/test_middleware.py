@@ -0,0 +1,153 @@
+"""Tests for the middleware that checks the signature of webhooks."""
+
+import asyncio
+import hashlib
+import hmac
+
+from typing import Any
+
+import pytest
+
+from starlette.types import (
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+from autoscaler.config import Settings
+from autoscaler.middleware import WebhookSignatureMiddleware
+
+pytestmark = pytest.mark.unit
+
+BODY = b'{"action": "queued"}'
+
+
+class App:
+    """An app that remembers the bodies of the requests handed to it."""
+
+    def __init__(self) -> None:
+        """Create an app that hasn't received any request."""
+        self.bodies: list[bytes] = []
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Read the whole body, and accept the request."""
+        body = b""
+        more_body = True
+
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        self.bodies.append(body)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def sign(body: bytes, secret: str = "secret") -> str:
+    """Sign a body the way Github does."""
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+    return f"sha256={digest}"
+
+
+def call(
+    app: App,
+    messages: list[Message],
+    signature: str | None,
+    path: str = "/webhook",
+    **settings: Any,
+) -> int | None:
+    """
+    Send a request through the middleware.
+
+    Returns:
+        The status code of the response, or None if nothing was sent.
+    """
+    middleware = WebhookSignatureMiddleware(app, Settings(**settings))
+    size = sum(len(message.get("body", b"")) for message in messages)
+    headers = [(b"content-length", str(size).encode())]
+
+    if signature is not None:
+        headers.append((b"x-hub-signature-256", signature.encode()))
+
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    sent: list[Message] = []
+
+    async def receive() -> Message:
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+
+    for message in sent:
+        if message["type"] == "http.response.start":
+            return int(message["status"])
+
+    return None
+
+
+def body(*chunks: bytes) -> list[Message]:
+    """Split a body into the messages of a request."""
+    return [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+def test_signed_body_is_handed_to_the_app() -> None:
+    """Test that a webhook signed with the secret reaches the app whole."""
+    app = App()
+
+    assert call(app, body(BODY[:5], BODY[5:]), sign(BODY)) == 200
+    assert app.bodies == [BODY]
+
+
+def test_missing_or_wrong_signature_is_rejected() -> None:
+    """Test that unsigned webhooks and ones signed otherwise are rejected."""
+    app = App()
+
+    assert call(app, body(BODY), None) == 400
+    assert call(app, body(BODY), "sha1=abc") == 400
+    assert call(app, body(BODY), sign(BODY, "other")) == 400
+    assert call(app, body(BODY + b" "), sign(BODY)) == 400
+    assert app.bodies == []
+
+
+def test_rotated_secrets_are_accepted() -> None:
+    """Test that the other configured secrets are accepted too."""
+    app = App()
+
+    assert call(app, body(BODY), sign(BODY, "old"), secret_tokens=["old"]) == 200
+    assert call(app, body(BODY), sign(BODY, "old")) == 400
+    assert app.bodies == [BODY]
+
+
+def test_body_over_the_limit_is_rejected() -> None:
+    """Test that a body over the size limit is rejected before the app."""
+    app = App()
+
+    assert call(app, body(BODY), sign(BODY), max_body_size=len(BODY) - 1) == 413
+    assert app.bodies == []
+
+
+def test_disconnected_client_is_not_answered() -> None:
+    """Test that a body cut short by a disconnect is dropped."""
+    app = App()
+    messages = [
+        {"type": "http.request", "body": BODY[:5], "more_body": True},
+        {"type": "http.disconnect"},
+    ]
+
+    assert call(app, messages, sign(BODY)) is None
+    assert app.bodies == []
+
+
+def test_other_paths_are_not_checked() -> None:
+    """Test that only the webhook endpoint needs a signature."""
+    app = App()
+
+    assert call(app, body(b""), None, path="/health") == 200
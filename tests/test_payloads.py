@@ -0,0 +1,95 @@
+"""Tests for the parsing of workflow job webhooks."""
+
+import json
+
+from typing import Any
+
+import pytest
+
+from autoscaler.models import WorkflowJobAction
+from autoscaler.payloads import (
+    PayloadError,
+    parse_timestamp,
+    parse_workflow_job,
+)
+
+pytestmark = pytest.mark.unit
+
+
+def payload(action: str, **job: Any) -> bytes:
+    """Build a workflow job webhook body, as Github sends it."""
+    return json.dumps(
+        {
+            "action": action,
+            "workflow_job": {
+                "id": 29679449,
+                "run_id": 940463255,
+                "workflow_name": "CI",
+                "head_branch": "main",
+                "status": action,
+                "conclusion": None,
+                "created_at": "2021-06-15T19:22:27Z",
+                "started_at": "2021-06-15T19:22:27Z",
+                "labels": ["self-hosted", "gpu"],
+                "runner_id": None,
+                "runner_name": None,
+                **job,
+            },
+            "repository": {
+                "name": "Hello-World",
+                "default_branch": "main",
+                "owner": {"login": "octo-org"},
+            },
+            "organization": {"login": "octo-org"},
+        }
+    ).encode()
+
+
+def test_parse_timestamp_accepts_github_utc_suffix() -> None:
+    """Test that the ``Z`` that Github marks UTC with is understood."""
+    assert parse_timestamp("2024-01-01T00:00:00Z") == 1704067200.0
+    assert parse_timestamp("2024-01-01T02:00:00+02:00") == 1704067200.0
+    assert parse_timestamp(None) is None
+
+
+def test_parse_queued_job() -> None:
+    """Test that the used fields of a queued job are picked out."""
+    event = parse_workflow_job(payload("queued"))
+
+    assert event is not None
+    assert event.action == WorkflowJobAction.QUEUED
+    assert event.job_id == 29679449
+    assert event.labels == ["self-hosted", "gpu"]
+    assert event.owner == "octo-org"
+    assert event.repo == "Hello-World"
+    assert event.organization == "octo-org"
+    assert event.head_branch == "main"
+    assert event.default_branch == "main"
+    assert event.workflow_name == "CI"
+    assert event.created_at == 1623784947.0
+
+
+def test_parse_cancelled_before_start() -> None:
+    """Test that a job cancelled before any runner picked it up is told."""
+    cancelled = parse_workflow_job(payload("completed", conclusion="cancelled"))
+    finished = parse_workflow_job(
+        payload("completed", conclusion="cancelled", runner_id=12)
+    )
+
+    assert cancelled is not None and cancelled.cancelled_before_start
+    assert finished is not None and not finished.cancelled_before_start
+
+
+def test_ignored_action_is_not_parsed() -> None:
+    """Test that webhooks of ignored actions are skipped."""
+    assert parse_workflow_job(payload("waiting")) is None
+    assert parse_workflow_job(b'{"action": "waiting", "broken') is None
+
+
+def test_invalid_payload_is_rejected() -> None:
+    """Test that payloads without the used fields are rejected."""
+    with pytest.raises(PayloadError):
+        parse_workflow_job(b'{"action": "queued"}')
+
+    with pytest.raises(PayloadError):
+        parse_workflow_job(payload("queued", created_at="yesterday"))
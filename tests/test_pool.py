@@ -0,0 +1,121 @@
+"""Tests for the warm pools of idle runners."""
+
+import asyncio
+
+import pytest
+
+from autoscaler.config import Settings
+from autoscaler.services.capacity import CapacityManager
+from autoscaler.services.classes import RunnerClassRegistry
+from autoscaler.services.pool import (
+    WarmPool,
+    WarmPoolManager,
+)
+
+pytestmark = pytest.mark.unit
+
+
+def create_manager() -> WarmPoolManager:
+    """Create a manager with in-memory claims and no configured pools."""
+    settings = Settings()
+    runner_classes = RunnerClassRegistry()
+    runner_classes.initialize(settings)
+    manager = WarmPoolManager(
+        CapacityManager(None),  # type: ignore[arg-type]
+        runner_classes,
+    )
+    manager.initialize(settings)
+
+    return manager
+
+
+def fill(manager: WarmPoolManager, *runner_ids: str) -> WarmPool:
+    """Get the pool of an org, with some idle runners."""
+    pool = manager.get("octo-org", None, manager._runner_classes.default)
+
+    for runner_id in runner_ids:
+        pool.add(runner_id)
+
+    return pool
+
+
+def test_pool_keeps_the_larger_of_its_size_and_prediction() -> None:
+    """Test that the target follows the prediction, down to the size."""
+
+    async def main() -> None:
+        manager = create_manager()
+        pool = fill(manager, "a", "b", "c")
+        pool.size = 1
+
+        pool.predict(3)
+        assert (pool.target, pool.surplus) == (3, 0)
+
+        pool.predict(0)
+        assert (pool.target, pool.surplus) == (1, 2)
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def test_only_the_surplus_is_retired() -> None:
+    """Test that a pool is scaled down to its target, and no further."""
+
+    async def main() -> None:
+        manager = create_manager()
+        pool = fill(manager, "a", "b", "c")
+        pool.predict(3)
+
+        assert not await manager.retire("a")
+
+        pool.predict(1)
+
+        assert await manager.retire("a")
+        assert not await manager.retire("a")
+        assert await manager.retire("b")
+        assert not await manager.retire("c")
+        assert pool.unclaimed == ["c"]
+        assert manager.waiting_pool("a") is None
+        assert manager.waiting_pool("c") is pool
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def test_retired_runner_is_not_served_to_a_job() -> None:
+    """Test that a runner being retired isn't claimed for a job, and back."""
+
+    async def main() -> None:
+        manager = create_manager()
+        pool = fill(manager, "a")
+        runner_class = pool.runner_class
+
+        assert await manager.retire("a")
+        assert not await manager.claim("octo-org", None, runner_class)
+
+        pool.add("b")
+        pool.predict(1)
+
+        assert await manager.claim("octo-org", None, runner_class)
+        assert not await manager.retire("b")
+
+        await manager.close()
+
+    asyncio.run(main())
+
+
+def test_runner_claimed_by_another_process_is_not_retired() -> None:
+    """Test that a runner that a job was served from elsewhere is kept."""
+
+    async def main() -> None:
+        manager = create_manager()
+        pool = fill(manager, "a")
+        await manager._claims.take("a", 60)
+
+        assert not await manager.retire("a")
+        assert pool.claimed == ["a"]
+
+        await manager.close()
+
+    asyncio.run(main())
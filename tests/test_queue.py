@@ -0,0 +1,275 @@
+"""Tests for the backends of the provisioning queue."""
+
+import asyncio
+import sqlite3
+import time
+
+from pathlib import Path
+from typing import (
+    Awaitable,
+    Callable,
+)
+
+import pytest
+
+from autoscaler.benchmark.fakes import FakeRespServer
+from autoscaler.config import (
+    RunnerSettings,
+    Settings,
+)
+from autoscaler.models import (
+    JobPriority,
+    ProvisioningJob,
+)
+from autoscaler.services.queue import (
+    MemoryQueueBackend,
+    ProvisioningQueue,
+    QueueBackend,
+    RedisQueueBackend,
+    SqliteQueueBackend,
+)
+
+pytestmark = pytest.mark.unit
+
+HISTORY_TTL = 3600
+
+Scenario = Callable[[QueueBackend], Awaitable[None]]
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def run(request: pytest.FixtureRequest, tmp_path: Path) -> Callable[[Scenario], None]:
+    """Run a scenario against each of the queue backends."""
+
+    def run_scenario(scenario: Scenario) -> None:
+        async def main() -> None:
+            server = None
+            backend: QueueBackend
+
+            if request.param == "sqlite":
+                backend = SqliteQueueBackend(str(tmp_path / "queue.db"))
+            elif request.param == "redis":
+                server = FakeRespServer()
+                await server.start()
+                backend = RedisQueueBackend(server.url, "test")
+            else:
+                backend = MemoryQueueBackend()
+
+            try:
+                await scenario(backend)
+            finally:
+                await backend.close()
+
+                if server is not None:
+                    await server.close()
+
+        asyncio.run(main())
+
+    return run_scenario
+
+
+def job(
+    job_id: int,
+    attempts: int = 0,
+    priority: JobPriority = JobPriority.NORMAL,
+) -> ProvisioningJob:
+    """Create a job of an org."""
+    return ProvisioningJob(
+        id=job_id,
+        owner="octo-org",
+        attempts=attempts,
+        priority=priority,
+    )
+
+
+def test_claimed_job_is_removed_by_ack(run: Callable[[Scenario], None]) -> None:
+    """Test that a job is handed out once, and gone once acknowledged."""
+
+    async def scenario(backend: QueueBackend) -> None:
+        assert await backend.put(job(1), HISTORY_TTL)
+        assert await backend.size() == 1
+
+        assert [claimed.id for claimed in await backend.claim(60, 10)] == [1]
+        assert await backend.claim(60, 10) == []
+        assert await backend.size() == 1
+
+        await backend.ack(1)
+
+        assert await backend.size() == 0
+        assert await backend.claim(60, 10) == []
+
+    run(scenario)
+
+
+def test_claim_hands_out_the_oldest_jobs_first(
+    run: Callable[[Scenario], None],
+) -> None:
+    """Test that jobs are claimed in order, up to the limit."""
+
+    async def scenario(backend: QueueBackend) -> None:
+        for job_id in range(1, 6):
+            await backend.put(job(job_id), HISTORY_TTL)
+
+        assert [claimed.id for claimed in await backend.claim(60, 3)] == [1, 2, 3]
+        assert [claimed.id for claimed in await backend.claim(60, 3)] == [4, 5]
+
+    run(scenario)
+
+
+def test_nacked_job_is_handed_out_again(run: Callable[[Scenario], None]) -> None:
+    """Test that a job given back is claimed again, with its attempts."""
+
+    async def scenario(backend: QueueBackend) -> None:
+        await backend.put(job(1), HISTORY_TTL)
+        await backend.claim(60, 10)
+        await backend.nack(job(1, attempts=1))
+
+        claimed = await backend.claim(60, 10)
+
+        assert [(claimed.id, claimed.attempts) for claimed in claimed] == [(1, 1)]
+
+    run(scenario)
+
+
+def test_expired_lease_is_handed_out_again(run: Callable[[Scenario], None]) -> None:
+    """Test that a job whose worker went away is claimed again."""
+
+    async def scenario(backend: QueueBackend) -> None:
+        await backend.put(job(1), HISTORY_TTL)
+        await backend.claim(0.01, 10)
+        await asyncio.sleep(0.05)
+
+        assert [claimed.id for claimed in await backend.claim(60, 10)] == [1]
+
+    run(scenario)
+
+
+def test_renewed_lease_is_kept(run: Callable[[Scenario], None]) -> None:
+    """Test that a job whose lease is renewed isn't handed out again."""
+
+    async def scenario(backend: QueueBackend) -> None:
+        await backend.put(job(1), HISTORY_TTL)
+        await backend.claim(0.05, 10)
+        await backend.renew([1], 60)
+        await asyncio.sleep(0.1)
+
+        assert await backend.claim(60, 10) == []
+
+    run(scenario)
+
+
+def test_recent_jobs_are_not_queued_again(run: Callable[[Scenario], None]) -> None:
+    """Test that a job is remembered for the history TTL, and only then."""
+
+    async def scenario(backend: QueueBackend) -> None:
+        assert await backend.put(job(1), HISTORY_TTL)
+        assert not await backend.put(job(1), HISTORY_TTL)
+
+        await backend.claim(60, 10)
+        await backend.ack(1)
+
+        assert not await backend.put(job(1), HISTORY_TTL)
+
+        assert await backend.put(job(2), 0.01)
+        await backend.claim(60, 10)
+        await backend.ack(2)
+        await asyncio.sleep(0.05)
+
+        assert await backend.put(job(2), HISTORY_TTL)
+        assert await backend.size() == 1
+
+    run(scenario)
+
+
+def test_cancelled_job_is_marked_for_its_worker(
+    run: Callable[[Scenario], None],
+) -> None:
+    """Test that a leased job that is cancelled is removed and marked."""
+
+    async def scenario(backend: QueueBackend) -> None:
+        await backend.put(job(1), HISTORY_TTL)
+        await backend.put(job(2), HISTORY_TTL)
+        await backend.claim(60, 1)
+
+        assert await backend.cancelled([1, 2]) == set()
+
+        await backend.cancel(1, HISTORY_TTL)
+        await backend.cancel(2, 0.01)
+
+        assert await backend.cancelled([1, 2, 3]) == {1, 2}
+        assert await backend.claim(60, 10) == []
+        assert await backend.size() == 0
+
+        await asyncio.sleep(0.05)
+
+        assert await backend.cancelled([1, 2]) == {1}
+        assert await backend.cancelled([]) == set()
+
+    run(scenario)
+
+
+def test_claim_hands_out_the_most_urgent_jobs_first(
+    run: Callable[[Scenario], None],
+) -> None:
+    """Test that jobs are claimed by priority, then in the order queued."""
+
+    async def scenario(backend: QueueBackend) -> None:
+        await backend.put(job(1, priority=JobPriority.LOW), HISTORY_TTL)
+        await backend.put(job(2), HISTORY_TTL)
+        await backend.put(job(3, priority=JobPriority.HIGH), HISTORY_TTL)
+        await backend.put(job(4), HISTORY_TTL)
+        await backend.put(job(5, priority=JobPriority.HIGH), HISTORY_TTL)
+
+        assert [claimed.id for claimed in await backend.claim(60, 3)] == [3, 5, 2]
+
+        await backend.nack(job(3, attempts=1, priority=JobPriority.HIGH))
+
+        assert [claimed.id for claimed in await backend.claim(60, 3)] == [3, 4, 1]
+
+    run(scenario)
+
+
+def test_sqlite_queue_adds_the_priority_to_an_older_database(tmp_path: Path) -> None:
+    """Test that a database made before jobs had a priority can be used."""
+    path = str(tmp_path / "queue.db")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE jobs (id INTEGER PRIMARY KEY, payload TEXT NOT NULL,"
+        " enqueued_at REAL NOT NULL, leased_until REAL)"
+    )
+    db.execute(
+        "INSERT INTO jobs (id, payload, enqueued_at) VALUES (?, ?, ?)",
+        (1, job(1).model_dump_json(), time.time()),
+    )
+    db.commit()
+    db.close()
+
+    async def main() -> None:
+        backend = SqliteQueueBackend(path)
+
+        try:
+            await backend.put(job(2, priority=JobPriority.HIGH), HISTORY_TTL)
+
+            assert [claimed.id for claimed in await backend.claim(60, 10)] == [2, 1]
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
+
+
+def test_jobs_past_the_timeout_are_dropped() -> None:
+    """Test that a job that waited too long doesn't take up a worker."""
+
+    async def main() -> None:
+        queue = ProvisioningQueue()
+        queue.initialize(Settings(runner=RunnerSettings(autoscale_timeout=60)))
+
+        try:
+            await queue.put(job(1).model_copy(update={"queued_at": time.time() - 61}))
+            await queue.put(job(2))
+
+            assert [claimed.id for claimed in await queue.get_batch(10)] == [2]
+            assert await queue.size() == 1
+        finally:
+            await queue.close()
+
+    asyncio.run(main())
@@ -0,0 +1,260 @@
+"""Tests for the reaping of stuck runners and stale registrations."""
+
+import asyncio
+import time
+
+import pytest
+
+from autoscaler import tasks
+from autoscaler.config import (
+    RunnerSettings,
+    Settings,
+)
+from autoscaler.models import (
+    GithubRunner,
+    RunnerRecord,
+)
+from autoscaler.services.capacity import CapacityManager
+from autoscaler.services.classes import RunnerClassRegistry
+from autoscaler.services.pool import (
+    WarmPool,
+    WarmPoolManager,
+)
+
+pytestmark = pytest.mark.unit
+
+PREFIX = "autoscaler-"
+
+
+class FakeRunnerProvider:
+    """A runner provider that remembers the runners it removed."""
+
+    def __init__(self) -> None:
+        """Create a provider with the default runner settings."""
+        self.settings = RunnerSettings()
+        self.removed: list[str] = []
+
+    async def remove_runner(self, runner_id: str) -> None:
+        """Remember a removed runner."""
+        self.removed.append(runner_id)
+
+
+class FakeGithub:
+    """The runners registered on Github, and the ones deregistered."""
+
+    def __init__(self, runners: list[GithubRunner]) -> None:
+        """Register some runners."""
+        self.runners = runners
+        self.deleted: list[int] = []
+
+    async def list_runners(self, owner: str, repo: str | None) -> list[GithubRunner]:
+        """List the registered runners."""
+        return self.runners
+
+    async def delete_runner(self, owner: str, repo: str | None, runner_id: int) -> None:
+        """Remember a deregistered runner."""
+        self.deleted.append(runner_id)
+
+
+@pytest.fixture
+def registered(monkeypatch: pytest.MonkeyPatch) -> FakeGithub:
+    """Replace the Github client with an empty fake."""
+    fake = FakeGithub([])
+    monkeypatch.setattr(tasks.github, "list_runners", fake.list_runners)
+    monkeypatch.setattr(tasks.github, "delete_runner", fake.delete_runner)
+
+    return fake
+
+
+@pytest.fixture
+def warm_pool(monkeypatch: pytest.MonkeyPatch) -> WarmPool:
+    """Replace the warm pools with an empty pool of the org."""
+    settings = Settings()
+    runner_classes = RunnerClassRegistry()
+    runner_classes.initialize(settings)
+    manager = WarmPoolManager(
+        CapacityManager(None),  # type: ignore[arg-type]
+        runner_classes,
+    )
+    manager.initialize(settings)
+    monkeypatch.setattr(tasks, "warm_pools", manager)
+
+    return manager.get("octo-org", None, runner_classes.default)
+
+
+def record(runner_id: str, age: float, warm: bool = False) -> RunnerRecord:
+    """Describe a runner that started some time ago."""
+    return RunnerRecord(
+        id=runner_id,
+        owner="octo-org",
+        name=f"{PREFIX}{runner_id}",
+        started_at=time.time() - age,
+        warm=warm,
+    )
+
+
+def online(runner_id: str, busy: bool = False) -> GithubRunner:
+    """Describe a runner that is online on Github."""
+    return GithubRunner(id=1, name=f"{PREFIX}{runner_id}", status="online", busy=busy)
+
+
+def reap(
+    provider: FakeRunnerProvider,
+    runners: list[RunnerRecord],
+    idle_since: dict[str, float],
+    offline: set[int] | None = None,
+) -> set[int]:
+    """Reap the runners of an org once."""
+    return asyncio.run(
+        tasks.reap_target(
+            runner_provider=provider,  # type: ignore[arg-type]
+            owner="octo-org",
+            repo=None,
+            runners=runners,
+            offline=offline or set(),
+            idle_since=idle_since,
+            name_prefix=PREFIX,
+        )
+    )
+
+
+def test_idle_time_is_counted_from_when_the_runner_was_found_idle(
+    registered: FakeGithub,
+) -> None:
+    """Test that an old runner isn't removed as soon as it is found idle."""
+    provider = FakeRunnerProvider()
+    registered.runners = [online("a")]
+    idle_since: dict[str, float] = {}
+
+    reap(provider, [record("a", age=2 * 60 * 60)], idle_since)
+
+    assert provider.removed == []
+    assert "a" in idle_since
+
+    idle_since["a"] -= provider.settings.idle_timeout
+    reap(provider, [record("a", age=2 * 60 * 60)], idle_since)
+
+    assert provider.removed == ["a"]
+    assert "a" not in idle_since
+
+
+def test_busy_runner_is_no_longer_idle(registered: FakeGithub) -> None:
+    """Test that a runner that picked up a job is not counted as idle."""
+    provider = FakeRunnerProvider()
+    registered.runners = [online("a", busy=True)]
+    idle_since = {"a": time.time() - 2 * 60 * 60}
+
+    reap(provider, [record("a", age=2 * 60 * 60)], idle_since)
+
+    assert provider.removed == []
+    assert idle_since == {}
+
+
+def test_warm_runners_are_not_removed_for_being_idle(
+    registered: FakeGithub,
+    warm_pool: WarmPool,
+) -> None:
+    """Test that warm pool runners wait for jobs for as long as needed."""
+    provider = FakeRunnerProvider()
+    registered.runners = [online("a")]
+    idle_since = {"a": time.time() - 2 * 60 * 60}
+    warm_pool.size = 1
+    warm_pool.add("a")
+
+    reap(provider, [record("a", age=2 * 60 * 60, warm=True)], idle_since)
+
+    assert provider.removed == []
+
+
+def test_warm_runners_above_the_target_are_removed(
+    registered: FakeGithub,
+    warm_pool: WarmPool,
+) -> None:
+    """Test that a pool gives back the slots of the runners it no longer needs."""
+    provider = FakeRunnerProvider()
+    registered.runners = [online("a"), online("b"), online("c", busy=True)]
+    runners = [record(runner_id, age=60, warm=True) for runner_id in "abc"]
+    warm_pool.size = 1
+    warm_pool.predict(3)
+
+    for runner_id in "abc":
+        warm_pool.add(runner_id)
+
+    warm_pool.mark_claimed({"c"})
+    reap(provider, runners, {})
+
+    assert provider.removed == []
+
+    warm_pool.predict(0)
+    reap(provider, runners, {})
+
+    assert provider.removed == ["a"]
+    assert warm_pool.unclaimed == ["b"]
+
+
+def test_busy_warm_runners_are_not_removed_above_the_target(
+    registered: FakeGithub,
+    warm_pool: WarmPool,
+) -> None:
+    """Test that a warm runner Github gave a job to is left alone."""
+    provider = FakeRunnerProvider()
+    registered.runners = [online("a", busy=True)]
+    warm_pool.size = 0
+    warm_pool.add("a")
+
+    assert warm_pool.surplus == 1
+
+    reap(provider, [record("a", age=2 * 60 * 60, warm=True)], {})
+
+    assert provider.removed == []
+    assert warm_pool.unclaimed == ["a"]
+
+
+def test_claimed_warm_runners_are_removed_for_being_idle(
+    registered: FakeGithub,
+    warm_pool: WarmPool,
+) -> None:
+    """Test that a warm runner claimed for a job that went elsewhere goes."""
+    provider = FakeRunnerProvider()
+    registered.runners = [online("a")]
+    idle_since = {"a": time.time() - 2 * 60 * 60}
+    warm_pool.size = 1
+    warm_pool.add("a")
+    warm_pool.mark_claimed({"a"})
+
+    reap(provider, [record("a", age=2 * 60 * 60, warm=True)], idle_since)
+
+    assert provider.removed == ["a"]
+
+
+def test_unregistered_runners_are_removed_after_the_timeout(
+    registered: FakeGithub,
+) -> None:
+    """Test that runners that never come online are removed in the end."""
+    provider = FakeRunnerProvider()
+    timeout = provider.settings.registration_timeout
+
+    reap(provider, [record("young", age=1), record("old", age=timeout + 1)], {})
+
+    assert provider.removed == ["old"]
+
+
+def test_stale_registrations_are_deregistered_on_the_second_check(
+    registered: FakeGithub,
+) -> None:
+    """Test that only this autoscaler's runners that stay offline go."""
+    provider = FakeRunnerProvider()
+    registered.runners = [
+        GithubRunner(id=1, name=f"{PREFIX}gone", status="offline"),
+        GithubRunner(id=2, name="someone-elses", status="offline"),
+        GithubRunner(id=3, name=f"{PREFIX}live", status="offline"),
+    ]
+    runners = [record("live", age=1)]
+
+    offline = reap(provider, runners, {})
+
+    assert offline == {1}
+    assert registered.deleted == []
+
+    assert reap(provider, runners, {}, offline) == set()
+    assert registered.deleted == [1]
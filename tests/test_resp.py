@@ -0,0 +1,91 @@
+"""Tests for the client of the Redis protocol."""
+
+import asyncio
+
+import pytest
+
+from autoscaler.benchmark.fakes import FakeRespServer
+from autoscaler.services.resp import (
+    RespClient,
+    RespError,
+)
+
+pytestmark = pytest.mark.unit
+
+
+def test_cancelled_command_does_not_shift_replies() -> None:
+    """Test that a command cancelled before its reply doesn't desync the next."""
+
+    async def main() -> None:
+        server = FakeRespServer()
+        await server.start()
+        client = RespClient(server.url)
+
+        try:
+            await client.execute("HSET", "h", "a", "1")
+            await client.execute("HSET", "h", "b", "2")
+
+            task = asyncio.create_task(client.execute("HGET", "h", "a"))
+            # Let the command be written, and the task wait for its reply
+            await asyncio.sleep(0)
+            task.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            assert await client.execute("HGET", "h", "b") == "2"
+            assert await client.transaction(("HGET", "h", "a")) == ["1"]
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(main())
+
+
+def test_cancelled_transaction_does_not_shift_replies() -> None:
+    """Test that a transaction cancelled halfway doesn't desync the next."""
+
+    async def main() -> None:
+        server = FakeRespServer()
+        await server.start()
+        client = RespClient(server.url)
+
+        try:
+            await client.execute("HSET", "h", "a", "1")
+
+            task = asyncio.create_task(
+                client.transaction(("HSET", "h", "b", "2"), ("HGET", "h", "a"))
+            )
+            await asyncio.sleep(0)
+            task.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            assert await client.execute("HGET", "h", "a") == "1"
+            assert await client.execute("HGET", "h", "b") is None
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(main())
+
+
+def test_error_reply_keeps_the_connection() -> None:
+    """Test that an error reply is raised, and the next command still works."""
+
+    async def main() -> None:
+        server = FakeRespServer()
+        await server.start()
+        client = RespClient(server.url)
+
+        try:
+            with pytest.raises(RespError):
+                await client.execute("NOSUCHCOMMAND")
+
+            assert await client.execute("PING") == "PONG"
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(main())
@@ -0,0 +1,188 @@
+"""Tests for the fair sharing of runner slots between owners."""
+
+import asyncio
+
+from collections import Counter
+
+import pytest
+
+from autoscaler.config import (
+    OwnerShare,
+    RunnerClass,
+)
+from autoscaler.models import JobPriority
+from autoscaler.services.scheduler import FairShareScheduler
+
+pytestmark = pytest.mark.unit
+
+SMALL = RunnerClass(name="small", image="runner")
+LARGE = RunnerClass(name="large", image="runner")
+
+
+def fits(runner_class: RunnerClass) -> bool:
+    """Have room for a runner of any class."""
+    return True
+
+
+def drain(scheduler: FairShareScheduler, usage: Counter[str], slots: int) -> list[str]:
+    """Hand out some slots, returning the owners they went to."""
+    owners: list[str] = []
+
+    for _ in range(slots):
+        job = scheduler.pop(usage, fits)
+
+        if job is None:
+            break
+
+        usage[job[0]] += 1
+        owners.append(job[0])
+
+    return owners
+
+
+def test_slots_are_shared_by_weight() -> None:
+    """Test that an owner with twice the weight gets twice the slots."""
+
+    async def main() -> None:
+        scheduler = FairShareScheduler()
+        scheduler.configure([OwnerShare(owner="big", weight=2)])
+
+        for _ in range(6):
+            scheduler.add("big", SMALL)
+            scheduler.add("small", SMALL)
+
+        usage: Counter[str] = Counter()
+        owners = drain(scheduler, usage, 6)
+
+        await asyncio.sleep(0)
+
+        assert Counter(owners) == {"big": 4, "small": 2}
+        assert scheduler.waiting == 6
+
+    asyncio.run(main())
+
+
+def test_owners_under_their_minimum_go_first() -> None:
+    """Test that the minimum of an owner is served before any weight."""
+
+    async def main() -> None:
+        scheduler = FairShareScheduler()
+        scheduler.configure(
+            [OwnerShare(owner="big", weight=10), OwnerShare(owner="min", min_runners=2)]
+        )
+
+        for _ in range(3):
+            scheduler.add("big", SMALL)
+            scheduler.add("min", SMALL)
+
+        assert drain(scheduler, Counter(), 3) == ["min", "min", "big"]
+
+    asyncio.run(main())
+
+
+def test_capped_owners_are_skipped() -> None:
+    """Test that an owner at its maximum gets no more slots."""
+
+    async def main() -> None:
+        scheduler = FairShareScheduler()
+        scheduler.configure([OwnerShare(owner="capped", max_runners=1)])
+        scheduler.add("capped", SMALL)
+
+        assert scheduler.is_capped("capped", 1)
+        assert not scheduler.is_capped("capped", 0)
+        assert not scheduler.is_capped("other", 100)
+        assert scheduler.pop(Counter(capped=1), fits) is None
+        assert scheduler.pop(Counter(), fits) == ("capped", SMALL)
+
+    asyncio.run(main())
+
+
+def test_most_urgent_jobs_go_first() -> None:
+    """Test that jobs are served by priority, then by deadline."""
+
+    async def main() -> None:
+        loop = asyncio.get_running_loop()
+        scheduler = FairShareScheduler()
+        low = scheduler.add("org", SMALL, JobPriority.LOW)
+        late = scheduler.add("org", SMALL, deadline=loop.time() + 60)
+        high = scheduler.add("org", SMALL, JobPriority.HIGH)
+        soon = scheduler.add("org", SMALL, deadline=loop.time() + 30)
+        waiters = [high, soon, late, low]
+
+        for served, waiter in enumerate(waiters):
+            scheduler.pop(Counter(), fits)
+
+            assert [waiter.done() for waiter in waiters] == [
+                index <= served for index in range(len(waiters))
+            ]
+
+    asyncio.run(main())
+
+
+def test_full_class_does_not_hold_up_other_classes() -> None:
+    """Test that the job behind one for a full class gets the slot."""
+
+    async def main() -> None:
+        scheduler = FairShareScheduler()
+        large = scheduler.add("org", LARGE, JobPriority.HIGH)
+        small = scheduler.add("org", SMALL)
+        checked: list[str] = []
+
+        def fits_small(runner_class: RunnerClass) -> bool:
+            checked.append(runner_class.name)
+            return runner_class.name == "small"
+
+        assert scheduler.pop(Counter(), fits_small) == ("org", SMALL)
+        assert small.done() and not large.done()
+        assert checked == ["large", "small"]
+
+    asyncio.run(main())
+
+
+def test_jobs_are_dropped_at_their_deadline() -> None:
+    """Test that the timer resolves the jobs that ran out of time."""
+
+    async def main() -> None:
+        loop = asyncio.get_running_loop()
+        scheduler = FairShareScheduler()
+        first = scheduler.add("org", SMALL, deadline=loop.time() + 0.01)
+        second = scheduler.add("org", SMALL, deadline=loop.time() + 0.03)
+        patient = scheduler.add("org", SMALL)
+
+        assert await asyncio.wait_for(first, 1) is False
+        assert not second.done()
+        assert await asyncio.wait_for(second, 1) is False
+        assert not patient.done()
+        assert scheduler.waiting == 1
+
+        assert scheduler.pop(Counter(), fits) == ("org", SMALL)
+        assert patient.result() is True
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiters_are_skipped_and_compacted() -> None:
+    """Test that jobs that stop waiting don't get slots, or stay in the heaps."""
+
+    async def main() -> None:
+        scheduler = FairShareScheduler()
+        waiters = [scheduler.add("org", SMALL) for _ in range(200)]
+
+        waiters[0].cancel()
+        await asyncio.sleep(0)
+
+        assert scheduler.waiting == 199
+        assert scheduler.pop(Counter(), fits) == ("org", SMALL)
+        assert waiters[1].result() is True
+
+        for waiter in waiters[2:190]:
+            waiter.cancel()
+
+        await asyncio.sleep(0)
+
+        assert scheduler.waiting == 10
+        assert scheduler._entries <= 2 * scheduler.waiting + 64
+        assert drain(scheduler, Counter(), 20) == ["org"] * 10
+        assert all(waiter.result() for waiter in waiters[190:])
+
+    asyncio.run(main())